@@ -0,0 +1,188 @@
+"""
+DIGIL Monitoring - Micro-benchmark parsing issue Jira
+======================================================
+Confronta il costo per-issue del parsing JSON v3:
+  - prima: wrapper _AttrDict (un oggetto per ogni accesso a dict/list annidati)
+  - dopo:  jira_client._parse_issue (estrazione diretta in _JiraRecord con __slots__)
+
+Uso:
+    python bench/bench_jira_parse.py [--issues 5000] [--repeat 5]
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from datetime import datetime, date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jira_client import _parse_issue, _adf_to_text, extract_device_id, extract_fornitore  # noqa: E402
+
+FIELD_MAP = {
+    "Assignee Level": "customfield_10101", "Vendor": "customfield_10102",
+    "Info L1": "customfield_10103", "Info L2": "customfield_10104",
+    "Info L3": "customfield_10105", "Info L4": "customfield_10106",
+    "Status L1": "customfield_10107", "Status L2": "customfield_10108",
+    "Status L3": "customfield_10109", "Status L4": "customfield_10110",
+    "Cluster Risoluzione": "customfield_10111",
+}
+JIRA_URL = "https://terna-it.atlassian.net"
+
+
+def make_issue(i: int) -> dict:
+    """Issue sintetico con la stessa forma di /rest/api/3/search/jql (fields=*all)."""
+    vendor = ("IND", "MRN", "SR2")[i % 3]
+    fields = {
+        "summary": f"[Issue_{i}]: Device 1:1:2:16:25:DIGIL_{vendor}_{i:04d} Misure parziali",
+        "description": {"type": "doc", "content": [
+            {"type": "paragraph", "content": [{"type": "text", "text": "Il device non invia misure di tiro."}]},
+            {"type": "bulletList", "content": [{"type": "listItem", "content": [
+                {"type": "paragraph", "content": [{"type": "text", "text": "Batteria OK"}]}]}]},
+        ]},
+        "issuetype": {"id": "10001", "name": "Bug in esercizio", "subtask": False},
+        "status": {"id": "3", "name": "Work In Progress", "statusCategory": {"key": "indeterminate"}},
+        "resolution": None if i % 2 else {"id": "1", "name": "Done"},
+        "priority": {"id": "3", "name": "Medium"},
+        "assignee": {"accountId": "622f434533fb840069656a1a", "displayName": "Team AMS", "active": True},
+        "reporter": {"accountId": "5e86f312b39dbf0c114bdefa", "displayName": "Vittorio Mitri", "active": True},
+        "labels": ["Misure_parziali", "Disconnesso"],
+        "issuelinks": [
+            {"id": "1", "type": {"name": "Relates", "inward": "relates to", "outward": "relates to"},
+             "outwardIssue": {"key": f"IA20-{i + 1}", "fields": {"status": {"name": "Chiusa"}}}},
+            {"id": "2", "type": {"name": "Blocks", "inward": "is blocked by", "outward": "blocks"},
+             "inwardIssue": {"key": f"IA20-{i + 2}", "fields": {"status": {"name": "Aperto"}}}},
+        ],
+        "created": "2026-01-15T09:12:33.000+0100",
+        "updated": "2026-02-02T17:40:01.000+0100",
+        "resolutiondate": None if i % 2 else "2026-02-02T17:40:01.000+0100",
+        "duedate": "2026-02-28",
+        FIELD_MAP["Assignee Level"]: {"value": "L3", "id": "10200"},
+        FIELD_MAP["Vendor"]: {"value": "IndraOlivetti", "id": "10201"},
+        FIELD_MAP["Info L1"]: "Misure parziali",
+        FIELD_MAP["Info L2"]: None,
+        FIELD_MAP["Info L3"]: "Sensore tiro",
+        FIELD_MAP["Info L4"]: "",
+        FIELD_MAP["Status L1"]: {"value": "Done"},
+        FIELD_MAP["Status L2"]: {"value": "Done"},
+        FIELD_MAP["Status L3"]: {"value": "In corso"},
+        FIELD_MAP["Status L4"]: None,
+        FIELD_MAP["Cluster Risoluzione"]: {"value": "Sostituzione sensore"},
+    }
+    # Campi "rumore" presenti con fields=*all
+    for n in range(40):
+        fields[f"customfield_{11000 + n}"] = None if n % 2 else {"self": "x", "value": str(n)}
+    return {"id": str(10000 + i), "key": f"IA20-{i}", "fields": fields}
+
+
+# ---------------------------------------------------------------------------
+# Baseline: percorso precedente basato su _AttrDict (riprodotto qui per confronto)
+# ---------------------------------------------------------------------------
+class _AttrDict:
+    def __init__(self, data):
+        self._data = data
+    def __getattr__(self, name):
+        try:
+            val = self._data[name]
+        except KeyError:
+            return None
+        if isinstance(val, dict):
+            return _AttrDict(val)
+        if isinstance(val, list):
+            return [_AttrDict(v) if isinstance(v, dict) else v for v in val]
+        return val
+    def __bool__(self):
+        return bool(self._data)
+
+
+def _legacy_custom_field(fields, field_map, field_name):
+    fid = field_map.get(field_name)
+    if not fid:
+        return ""
+    val = getattr(fields, fid, None)
+    if val is None:
+        return ""
+    if isinstance(val, str):
+        return val.strip()
+    if isinstance(val, (dict, _AttrDict)):
+        raw = val._data if isinstance(val, _AttrDict) else val
+        return str(raw.get("value", raw.get("name", ""))).strip()
+    return str(val).strip()
+
+
+def legacy_parse(data, field_map, jira_url):
+    key = data["key"]
+    f = _AttrDict(data.get("fields", {}))
+    out = {"key": key}
+    out["summary"] = summary = f.summary or ""
+    out["device_id"] = device_id = extract_device_id(summary)
+    out["fornitore"] = extract_fornitore(device_id)
+    links = []
+    if f.issuelinks:
+        for link in f.issuelinks:
+            if link.outwardIssue:
+                links.append(f"{link.type.outward}: {link.outwardIssue.key}")
+            elif link.inwardIssue:
+                links.append(f"{link.type.inward}: {link.inwardIssue.key}")
+    out["issue_links"] = ", ".join(links)
+    desc_raw = f.description
+    if isinstance(desc_raw, _AttrDict):
+        desc_raw = _adf_to_text(desc_raw._data)
+    out["description"] = desc_raw or ""
+    out["issue_type"] = f.issuetype.name if f.issuetype else ""
+    out["status"] = f.status.name if f.status else ""
+    out["resolution"] = f.resolution.name if f.resolution else "Unresolved"
+    out["priority"] = f.priority.name if f.priority else ""
+    out["assignee"] = f.assignee.displayName if f.assignee else "Unassigned"
+    out["reporter"] = f.reporter.displayName if f.reporter else ""
+    out["labels"] = ", ".join(f.labels) if f.labels else ""
+    out["url"] = f"{jira_url}/browse/{key}"
+    for name in FIELD_MAP:
+        out[name] = _legacy_custom_field(f, field_map, name)
+    out["created"] = datetime.fromisoformat(f.created[:19]) if f.created else None
+    out["updated"] = datetime.fromisoformat(f.updated[:19]) if f.updated else None
+    rd = getattr(f, "resolutiondate", None)
+    out["resolution_date"] = datetime.fromisoformat(str(rd)[:19]) if rd else None
+    out["due_date"] = date.fromisoformat(str(f.duedate)) if f.duedate else None
+    return out
+
+
+def new_parse(data, field_map, jira_url):
+    return _parse_issue(data, field_map, jira_url)
+
+
+def bench(fn, issues, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for d in issues:
+            fn(d, FIELD_MAP, JIRA_URL)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    kept = [fn(d, FIELD_MAP, JIRA_URL) for d in issues]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return best / len(issues) * 1e6, peak / 1024
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--issues", type=int, default=5000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    issues = [make_issue(i) for i in range(args.issues)]
+    print(f"Parsing di {len(issues)} issue sintetici (best of {args.repeat})\n")
+    print(f"{'percorso':<22}{'us/issue':>12}{'peak KiB':>12}")
+    results = {}
+    for name, fn in (("prima (_AttrDict)", legacy_parse), ("dopo (_parse_issue)", new_parse)):
+        us, kib = bench(fn, issues, args.repeat)
+        results[name] = us
+        print(f"{name:<22}{us:>12.2f}{kib:>12.0f}")
+    before, after = results.values()
+    print(f"\nspeedup: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+DIGIL Monitoring - Benchmark fetch maintenance mode
+====================================================
+Confronta fetch_maintenance_bulk contro lo stub locale (bench/stub_server.py):
+  - statico:  async con concorrenza fissa e senza retry
+  - threaded: ThreadPoolExecutor + requests.Session condivisa (MAINT_ASYNC=0)
+  - async:    un event loop + httpx.AsyncClient con connessioni keep-alive
+
+Riporta throughput (richieste/s), numero di socket TCP aperti verso il server,
+richieste servite (inclusi i retry), token emessi, risposte 401 e device rimasti in ERR. Con --capacity lo stub
+risponde 503 oltre N richieste concorrenti: il limite AIMD e i retry a fine giro
+devono riportare gli ERR a zero.
+
+Uso:
+    python bench/bench_maintenance.py [--devices 2000] [--concurrency 80] [--latency-ms 20]
+                                      [--capacity 0] [--error-rate 0]
+                                      [--token-ttl 300] [--auth-latency-ms 0]
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from stub_server import StubProcess  # noqa: E402
+
+
+def make_devices(n: int):
+    vendors = ("IND", "MRN", "SR2")
+    return [f"1:1:2:{16 + i % 4}:{i % 90}:DIGIL_{vendors[i % 3]}_{i:04d}" for i in range(n)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--devices", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=80)
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    ap.add_argument("--capacity", type=int, default=0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--token-ttl", type=float, default=300.0)
+    ap.add_argument("--auth-latency-ms", type=float, default=0.0)
+    args = ap.parse_args()
+
+    srv = StubProcess(latency_ms=args.latency_ms, capacity=args.capacity, error_rate=args.error_rate,
+                      token_ttl=args.token_ttl, auth_latency_ms=args.auth_latency_ms).start()
+    # Configurazione prima dell'import: i singleton leggono l'ambiente alla prima richiesta
+    os.environ.update({
+        "AUTH_URL": f"{srv.base_url}/oauth/token", "BASE_URL": srv.base_url,
+        "CLIENT_ID": "bench", "CLIENT_SECRET": "bench",
+    })
+    import maintenance_api
+    from maintenance_api import fetch_maintenance_bulk
+
+    devices = make_devices(args.devices)
+    # "statico": concorrenza fissa e nessun retry (comportamento precedente all'AIMD)
+    static = {"MAINT_MIN_THREADS": str(args.concurrency), "MAINT_RETRY_ROUNDS": "0"}
+    adaptive = {"MAINT_MIN_THREADS": "4", "MAINT_RETRY_ROUNDS": "2"}
+    modes = [("threaded", {"MAINT_ASYNC": "0", **adaptive})]
+    if maintenance_api.httpx is not None:
+        modes.insert(0, ("statico", {"MAINT_ASYNC": "1", **static}))
+        modes.append(("async", {"MAINT_ASYNC": "1", **adaptive}))
+    else:
+        print("httpx non installato: solo percorso threaded\n")
+
+    print(f"{len(devices)} device, concorrenza {args.concurrency}, latenza stub {args.latency_ms:.0f} ms"
+          f", HTTP/2 disponibile: {maintenance_api.HAS_HTTP2}\n")
+    print(f"{'percorso':<12}{'secondi':>10}{'dev/s':>10}{'socket':>10}{'richieste':>11}{'token':>8}{'401':>6}{'ERR':>8}")
+    try:
+        for name, env in modes:
+            os.environ.update(env)
+            maintenance_api.get_token_manager().invalidate()
+            srv.reset_counters()
+            t0 = time.perf_counter()
+            res = fetch_maintenance_bulk(devices, max_threads=args.concurrency)
+            dt = time.perf_counter() - t0
+            errors = sum(1 for v in res.values() if v in ("ERR", "SKIP"))
+            st = srv.stats()
+            print(f"{name:<12}{dt:>10.2f}{len(devices) / dt:>10.0f}{st['connections']:>10}"
+                  f"{st['requests']:>11}{st['tokens']:>8}{st['unauthorized']:>6}{errors:>8}")
+    finally:
+        srv.stop()
+
+
+if __name__ == "__main__":
+    main()
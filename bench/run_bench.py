@@ -0,0 +1,134 @@
+"""
+DIGIL Monitoring - Benchmark di carico offline (maintenance + Jira)
+====================================================================
+Avvia lo stub locale (bench/stub_server.py) in un processo separato ed esegue contro di esso:
+  - maintenance: fetch_maintenance_bulk su N device sintetici
+  - jira:        download_from_jira (myself, field, search/jql paginata, commenti per issue)
+
+Per ogni scenario riporta throughput, latenza per richiesta p50/p95 (lato client) e picco di
+memoria Python (tracemalloc, misurato in un secondo giro per non falsare i tempi).
+Il DB usato è temporaneo (DIGIL_DB_PATH): il DB reale in data/ non viene toccato.
+
+Uso:
+    python bench/run_bench.py [--devices 2000] [--jira-issues 500] [--latency-ms 20]
+                              [--error-rate 0] [--token-ttl 300] [--only maintenance|jira]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from stub_server import StubProcess  # noqa: E402
+from bench_maintenance import make_devices  # noqa: E402
+
+
+def percentiles(samples):
+    """(p50, p95) in ms; (0, 0) se non ci sono campioni."""
+    if not samples:
+        return 0.0, 0.0
+    if len(samples) == 1:
+        return samples[0], samples[0]
+    q = statistics.quantiles(samples, n=20, method="inclusive")
+    return q[9], q[18]
+
+
+def run_maintenance(devices):
+    from maintenance_api import fetch_maintenance_bulk
+    details = {}
+    t0 = time.perf_counter()
+    res = fetch_maintenance_bulk(devices, details=details)
+    dt = time.perf_counter() - t0
+    errors = sum(1 for v in res.values() if v in ("ERR", "SKIP"))
+    return dt, len(devices), [lat for lat, _ in details.values()], errors
+
+
+def run_jira(base_url, samples):
+    import jira_client
+    jira_client._custom_field_cache.clear()
+    del samples[:]
+    t0 = time.perf_counter()
+    ok, msg = jira_client.download_from_jira(email="bench", token="bench", jira_url=base_url)
+    dt = time.perf_counter() - t0
+    if not ok:
+        raise RuntimeError(msg)
+    return dt, int(msg.split()[0]), list(samples), 0
+
+
+def timed_requests(samples):
+    """Registra la durata (ms) di ogni richiesta fatta con requests (jira_client usa requests.get)."""
+    import requests
+    send = requests.Session.send
+
+    def _send(self, request, **kw):
+        t0 = time.perf_counter()
+        try:
+            return send(self, request, **kw)
+        finally:
+            samples.append((time.perf_counter() - t0) * 1000)
+    requests.Session.send = _send
+
+
+def peak_mib(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--devices", type=int, default=2000)
+    ap.add_argument("--jira-issues", type=int, default=500)
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--token-ttl", type=float, default=300.0)
+    ap.add_argument("--only", choices=("maintenance", "jira"))
+    args = ap.parse_args()
+
+    tmp = tempfile.TemporaryDirectory(prefix="digil-bench-")
+    srv = StubProcess(latency_ms=args.latency_ms, error_rate=args.error_rate, token_ttl=args.token_ttl,
+                      jira_issues=args.jira_issues).start()
+    # Configurazione prima dell'import: DB temporaneo e singleton puntati allo stub
+    os.environ.update({
+        "DIGIL_DB_PATH": str(Path(tmp.name) / "bench.db"),
+        "AUTH_URL": f"{srv.base_url}/oauth/token", "BASE_URL": srv.base_url,
+        "CLIENT_ID": "bench", "CLIENT_SECRET": "bench",
+    })
+    samples = []
+    timed_requests(samples)
+
+    scenarios = []
+    if args.only in (None, "maintenance"):
+        devices = make_devices(args.devices)
+        scenarios.append(("maintenance", lambda: run_maintenance(devices)))
+    if args.only in (None, "jira"):
+        scenarios.append(("jira", lambda: run_jira(srv.base_url, samples)))
+
+    print(f"Stub {srv.base_url}, latenza {args.latency_ms:.0f} ms, errori {args.error_rate:.0%}\n")
+    print(f"{'scenario':<13}{'unità':>8}{'secondi':>10}{'unità/s':>10}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'peak MiB':>10}{'richieste':>11}{'ERR':>6}")
+    try:
+        for name, fn in scenarios:
+            srv.reset_counters()
+            dt, n, lat, errors = fn()
+            requests_served = srv.stats()["requests"]
+            p50, p95 = percentiles(lat)
+            mib = peak_mib(fn)
+            print(f"{name:<13}{n:>8}{dt:>10.2f}{n / dt:>10.0f}{p50:>9.1f}{p95:>9.1f}"
+                  f"{mib:>10.1f}{requests_served:>11}{errors:>6}")
+    finally:
+        srv.stop()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+DIGIL Monitoring - Stub HTTP server per i benchmark
+====================================================
+Server locale che imita gli endpoint usati dalla dashboard:
+  - POST /oauth/token                        -> token client_credentials (expires_in configurabile)
+  - GET  /api/v1/digils/{id}/configuration   -> application.maintenanceMode (401 se token scaduto)
+  - GET  /rest/api/3/myself, /rest/api/3/field
+  - GET  /rest/api/3/search/jql              -> issue sintetici "Bug in esercizio", paginati con nextPageToken
+  - GET  /rest/api/3/issue/{key}/comment     -> commenti in ADF
+Gli endpoint Jira richiedono Basic auth (qualsiasi credenziale).
+
+Conta le connessioni TCP accettate (per misurare il riuso keep-alive)
+e le richieste servite. Latenza configurabile per richiesta; per simulare un backend
+sovraccarico si può impostare una capacità (richieste concorrenti oltre la quale
+risponde 503) e una percentuale di errori 503 casuali (configuration e commenti: la
+ricerca Jira non viene mai fatta fallire, altrimenti il sync si interrompe).
+
+Uso da codice (processo separato, così lo stub non contende il GIL al client misurato):
+    srv = StubProcess(latency_ms=20).start()
+    ... srv.base_url, srv.stats() -> {"connections": .., "requests": ..} ...
+    srv.stop()
+
+Da riga di comando:
+    python bench/stub_server.py --port 8765 --latency-ms 20 [--capacity 20] [--error-rate 0.05]
+                                [--token-ttl 300] [--auth-latency-ms 0] [--jira-issues 500]
+"""
+import json
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+_RE_CONFIG = re.compile(r"^/api/v1/digils/([^/]+)/configuration$")
+_RE_COMMENTS = re.compile(r"^/rest/api/3/issue/([^/]+)/comment$")
+
+# Campi custom restituiti da /rest/api/3/field (nomi cercati da jira_client.CUSTOM_FIELD_NAMES)
+JIRA_FIELDS = {
+    "Assignee Level": "customfield_10101", "Vendor": "customfield_10102",
+    "Info L1": "customfield_10103", "Info L2": "customfield_10104",
+    "Info L3": "customfield_10105", "Info L4": "customfield_10106",
+    "Status L1": "customfield_10107", "Status L2": "customfield_10108",
+    "Status L3": "customfield_10109", "Status L4": "customfield_10110",
+    "Cluster Risoluzione": "customfield_10111",
+}
+_JIRA_PAGE_MAX = 100   # come Jira Cloud: maxResults oltre 100 viene ridotto
+
+
+def _adf(text: str) -> dict:
+    return {"type": "doc", "version": 1, "content": [
+        {"type": "paragraph", "content": [{"type": "text", "text": text}]}]}
+
+
+def make_jira_issue(i: int) -> dict:
+    """Issue sintetico con la forma di /rest/api/3/search/jql (fields=*all)."""
+    vendor = ("IND", "MRN", "SR2")[i % 3]
+    status = ("Aperto", "Work In Progress", "Chiusa")[i % 3]
+    fields = {
+        "summary": f"[Issue_{i}]: Device 1:1:2:{16 + i % 4}:{i % 90}:DIGIL_{vendor}_{i:04d} Misure parziali",
+        "description": _adf("Il device non invia misure di tiro."),
+        "issuetype": {"id": "10001", "name": "Bug in esercizio", "subtask": False},
+        "status": {"id": str(i % 3), "name": status},
+        "resolution": {"id": "1", "name": "Done"} if status == "Chiusa" else None,
+        "priority": {"id": "3", "name": "Medium"},
+        "assignee": {"displayName": "Team AMS"} if i % 4 else None,
+        "reporter": {"displayName": "Stub Reporter"},
+        "labels": ["Misure_parziali"],
+        "issuelinks": [{"type": {"outward": "relates to"}, "outwardIssue": {"key": f"IA20-{i + 1}"}}],
+        "created": "2026-01-15T09:12:33.000+0100",
+        "updated": "2026-02-02T17:40:01.000+0100",
+        "resolutiondate": "2026-02-02T17:40:01.000+0100" if status == "Chiusa" else None,
+        "duedate": None,
+        JIRA_FIELDS["Assignee Level"]: {"value": f"L{1 + i % 4}"},
+        JIRA_FIELDS["Vendor"]: {"value": "IndraOlivetti"},
+        JIRA_FIELDS["Info L1"]: "Misure parziali",
+        JIRA_FIELDS["Status L1"]: {"value": "Done"},
+        JIRA_FIELDS["Cluster Risoluzione"]: {"value": "Sostituzione sensore"},
+    }
+    # Campi "rumore" presenti con fields=*all
+    for n in range(40):
+        fields[f"customfield_{11000 + n}"] = None if n % 2 else {"self": "x", "value": str(n)}
+    return {"id": str(10000 + i), "key": f"IA20-{i}", "fields": fields}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    disable_nagle_algorithm = True  # header e body in write separate: evita lo stallo Nagle/delayed-ACK
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, code: int, payload: dict):
+        self._send_body(code, json.dumps(payload).encode())
+
+    def _send_body(self, code: int, body: bytes):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.server.count_request()
+        if self.path == "/oauth/token":
+            if self.server.auth_latency_s:
+                time.sleep(self.server.auth_latency_s)
+            token = self.server.issue_token()
+            self._send_json(200, {"access_token": token, "token_type": "bearer", "expires_in": self.server.token_ttl})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            self._send_json(200, {"connections": self.server.connections, "requests": self.server.requests,
+                                  "tokens": self.server.tokens_issued, "unauthorized": self.server.unauthorized})
+            return
+        if self.path == "/_reset":
+            self.server.reset_counters()
+            self._send_json(200, {})
+            return
+        self.server.count_request()
+        if self.path.startswith("/rest/api/3/"):
+            self._jira()
+            return
+        m = _RE_CONFIG.match(self.path)
+        if not m:
+            self._send_json(404, {"error": "not found"})
+            return
+        if not self.server.token_valid(self.headers.get("Authorization", "")):
+            self._send_json(401, {"error": "invalid or expired token"})
+            return
+        if not self.server.enter():
+            self._send_json(503, {"error": "overloaded"})
+            return
+        try:
+            if self.server.latency_s:
+                time.sleep(self.server.latency_s)
+        finally:
+            self.server.leave()
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self._send_json(503, {"error": "unavailable"})
+            return
+        clientid = m.group(1)
+        mode = ("ON", "OFF", None)[sum(map(ord, clientid)) % 3]
+        self._send_json(200, {"application": {"maintenanceMode": mode}})
+
+    def _jira(self):
+        if not self.headers.get("Authorization", "").startswith("Basic "):
+            self.server.count_unauthorized()
+            self._send_json(401, {"errorMessages": ["Client must be authenticated"]})
+            return
+        url = urlsplit(self.path)
+        if self.server.latency_s:
+            time.sleep(self.server.latency_s)
+        if url.path == "/rest/api/3/myself":
+            self._send_json(200, {"accountId": "stub", "displayName": "Stub User", "active": True})
+        elif url.path == "/rest/api/3/field":
+            fields = [{"id": fid, "name": name, "custom": True} for name, fid in JIRA_FIELDS.items()]
+            fields.append({"id": "summary", "name": "Summary", "custom": False})
+            self._send_body(200, json.dumps(fields).encode())
+        elif url.path == "/rest/api/3/search/jql":
+            qs = parse_qs(url.query)
+            size = min(int(qs.get("maxResults", ["50"])[0]), _JIRA_PAGE_MAX)
+            start = int(qs.get("nextPageToken", ["p0"])[0][1:])
+            end = min(start + size, self.server.jira_issues)
+            payload = {"issues": [self.server.jira_issue(i) for i in range(start, end)],
+                       "isLast": end >= self.server.jira_issues}
+            if not payload["isLast"]:
+                payload["nextPageToken"] = f"p{end}"
+            self._send_json(200, payload)
+        else:
+            m = _RE_COMMENTS.match(url.path)
+            if not m:
+                self._send_json(404, {"errorMessages": ["not found"]})
+            elif self.server.error_rate and random.random() < self.server.error_rate:
+                self._send_json(503, {"errorMessages": ["unavailable"]})
+            else:
+                n = int(m.group(1).rsplit("-", 1)[-1]) % 4
+                self._send_json(200, {"total": n, "comments": [
+                    {"author": {"displayName": "Team AMS"}, "created": "2026-01-20T10:00:00.000+0100",
+                     "body": _adf(f"Commento {c + 1} su {m.group(1)}")} for c in range(n)]})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+    def __init__(self, addr, latency_ms: float, capacity: int = 0, error_rate: float = 0.0,
+                 token_ttl: float = 300.0, auth_latency_ms: float = 0.0, jira_issues: int = 500):
+        super().__init__(addr, _Handler)
+        self.latency_s = latency_ms / 1000.0
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.auth_latency_s = auth_latency_ms / 1000.0
+        self.jira_issues = jira_issues
+        self._jira_cache = {}   # i -> issue (generati una volta sola)
+        self.active = 0
+        self.connections = 0
+        self.requests = 0
+        self.tokens_issued = 0
+        self.unauthorized = 0
+        self._tokens = {}   # token -> scadenza (time.time)
+        self._count_lock = threading.Lock()
+
+    def issue_token(self) -> str:
+        with self._count_lock:
+            self.tokens_issued += 1
+            token = f"stub-{self.tokens_issued}-{random.getrandbits(32):08x}"
+            self._tokens[token] = time.time() + self.token_ttl
+            return token
+
+    def token_valid(self, header: str) -> bool:
+        token = header[7:] if header.startswith("Bearer ") else ""
+        with self._count_lock:
+            if self._tokens.get(token, 0) > time.time():
+                return True
+            self.unauthorized += 1
+            return False
+
+    def count_unauthorized(self):
+        with self._count_lock:
+            self.unauthorized += 1
+
+    def jira_issue(self, i: int) -> dict:
+        issue = self._jira_cache.get(i)
+        if issue is None:
+            issue = self._jira_cache[i] = make_jira_issue(i)
+        return issue
+
+    def handle_error(self, request, client_address):
+        # Client che chiudono la connessione a metà risposta (cancel/stop): non è un errore dello stub
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def process_request(self, request, client_address):
+        with self._count_lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def count_request(self):
+        with self._count_lock:
+            self.requests += 1
+
+    def reset_counters(self):
+        with self._count_lock:
+            self.connections = 0
+            self.requests = 0
+            self.tokens_issued = 0
+            self.unauthorized = 0
+
+    def enter(self) -> bool:
+        with self._count_lock:
+            if self.capacity and self.active >= self.capacity:
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self._count_lock:
+            self.active -= 1
+
+
+class StubServer:
+    def __init__(self, latency_ms: float = 20.0, host: str = "127.0.0.1", port: int = 0,
+                 capacity: int = 0, error_rate: float = 0.0, token_ttl: float = 300.0,
+                 auth_latency_ms: float = 0.0, jira_issues: int = 500):
+        self._srv = _Server((host, port), latency_ms, capacity, error_rate, token_ttl, auth_latency_ms,
+                            jira_issues)
+        self._thread: threading.Thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._srv.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def connections(self) -> int:
+        return self._srv.connections
+
+    @property
+    def requests(self) -> int:
+        return self._srv.requests
+
+    def reset_counters(self):
+        self._srv.reset_counters()
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._srv.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._srv.shutdown()
+        self._srv.server_close()
+
+
+class StubProcess:
+    """Avvia lo stub in un processo figlio; contatori letti via /_stats."""
+
+    def __init__(self, latency_ms: float = 20.0, capacity: int = 0, error_rate: float = 0.0,
+                 token_ttl: float = 300.0, auth_latency_ms: float = 0.0, jira_issues: int = 500):
+        self.latency_ms = latency_ms
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.auth_latency_ms = auth_latency_ms
+        self.jira_issues = jira_issues
+        self.base_url: str = ""
+        self._proc: subprocess.Popen = None
+
+    def start(self) -> "StubProcess":
+        self._proc = subprocess.Popen(
+            [sys.executable, __file__, "--port", "0", "--latency-ms", str(self.latency_ms),
+             "--capacity", str(self.capacity), "--error-rate", str(self.error_rate),
+             "--token-ttl", str(self.token_ttl), "--auth-latency-ms", str(self.auth_latency_ms),
+             "--jira-issues", str(self.jira_issues)],
+            stdout=subprocess.PIPE, text=True,
+        )
+        self.base_url = self._proc.stdout.readline().split()[-1]
+        return self
+
+    def _get(self, path: str) -> dict:
+        with urllib.request.urlopen(self.base_url + path, timeout=10) as r:
+            return json.loads(r.read())
+
+    def stats(self) -> dict:
+        return self._get("/_stats")
+
+    def reset_counters(self):
+        self._get("/_reset")
+
+    def stop(self):
+        self._proc.terminate()
+        self._proc.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Stub server DIGIL per benchmark")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    ap.add_argument("--capacity", type=int, default=0, help="richieste concorrenti max (0 = illimitate)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="frazione di 503 casuali")
+    ap.add_argument("--token-ttl", type=float, default=300.0, help="expires_in dei token (s)")
+    ap.add_argument("--auth-latency-ms", type=float, default=0.0, help="latenza endpoint token")
+    ap.add_argument("--jira-issues", type=int, default=500, help="issue restituiti da /search/jql")
+    args = ap.parse_args()
+    srv = StubServer(latency_ms=args.latency_ms, port=args.port, capacity=args.capacity,
+                     error_rate=args.error_rate, token_ttl=args.token_ttl,
+                     auth_latency_ms=args.auth_latency_ms, jira_issues=args.jira_issues).start()
+    print(f"Stub in ascolto su {srv.base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        srv.stop()
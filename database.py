@@ -1,7 +1,9 @@
 """
 DIGIL Monitoring - Database Models
 """
+import os
 from datetime import datetime, date
+from functools import lru_cache
 from sqlalchemy import (
     create_engine, Column, String, Integer, Float, Boolean, Date, DateTime,
     Text, ForeignKey, Index, event
@@ -10,7 +12,8 @@ from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from pathlib import Path
 
 BASE_DIR = Path(__file__).parent
-DB_PATH = BASE_DIR / "data" / "digil_monitoring.db"
+# DIGIL_DB_PATH permette di usare un DB alternativo (es. benchmark contro lo stub)
+DB_PATH = Path(os.environ.get("DIGIL_DB_PATH") or BASE_DIR / "data" / "digil_monitoring.db")
 
 engine = create_engine(f"sqlite:///{DB_PATH}", echo=False)
 SessionLocal = sessionmaker(bind=engine)
@@ -26,9 +29,30 @@ def set_sqlite_pragma(dbapi_conn, connection_record):
     c.close()
 
 
+@lru_cache(maxsize=16384)
+def device_name_to_clientid(name: str) -> str:
+    """Converte device_name DB (es. '1:1:2:15:22:DIGIL_MRN_0136') in clientid API (es. '1121522_0136').
+    Se il formato non corrisponde, ritorna l'input invariato.
+    Memoizzata per le chiamate ad-hoc; per le tabelle usare la colonna devices.client_id."""
+    if not name:
+        return name
+    parts = name.split(":")
+    if len(parts) >= 6:
+        try:
+            prefix = "".join(parts[:5])
+            last_seg = parts[5]
+            if "_" in last_seg:
+                suffix = last_seg.split("_")[-1]
+                return f"{prefix}_{suffix}"
+        except Exception:
+            pass
+    return name
+
+
 class Device(Base):
     __tablename__ = "devices"
     device_id = Column(String, primary_key=True)
+    client_id = Column(String)   # clientid API maintenance (derivato da device_id all'import)
     tipo_install = Column(String)
     is_sotto_corona = Column(Boolean, default=False)
     linea = Column(String)
@@ -84,6 +108,7 @@ class Device(Base):
     events = relationship("AnomalyEvent", back_populates="device", cascade="all, delete-orphan")
     ticket_history = relationship("TicketHistory", back_populates="device", cascade="all, delete-orphan",
                                   order_by="TicketHistory.first_seen.desc()")
+    __table_args__ = (Index("idx_dev_client", "client_id"),)
 
 
 class AvailabilityDaily(Base):
@@ -111,7 +136,9 @@ class AnomalyEvent(Base):
     related_ticket = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     device = relationship("Device", back_populates="events")
-    __table_args__ = (Index("idx_ev_sev", "severity"), Index("idx_ev_ack", "acknowledged"),)
+    __table_args__ = (Index("idx_ev_sev", "severity"), Index("idx_ev_ack", "acknowledged"),
+                      # ultimo alert aperto per device (queries.latest_alerts)
+                      Index("idx_ev_ack_dev_time", "acknowledged", "device_id", "created_at"),)
 
 
 class TicketHistory(Base):
@@ -138,6 +165,28 @@ class TicketHistory(Base):
     __table_args__ = (Index("idx_th_device", "device_id"), Index("idx_th_ticket", "ticket_id"),)
 
 
+class MaintenanceStatus(Base):
+    """Ultimo stato maintenanceMode noto per device (API DIGIL)."""
+    __tablename__ = "maintenance_status"
+    device_id = Column(String, primary_key=True)
+    status = Column(String, nullable=False)   # ON, OFF, NULL, ERR
+    fetched_at = Column(DateTime, nullable=False)
+    latency_ms = Column(Integer)
+    error = Column(String)
+    __table_args__ = (Index("idx_ms_fetched", "fetched_at"),)
+
+
+class MaintenanceHistory(Base):
+    """Storico append-only dei cambi di maintenanceMode (una riga per transizione, ERR esclusi)."""
+    __tablename__ = "maintenance_history"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    fetched_at = Column(DateTime, nullable=False)
+    latency_ms = Column(Integer)
+    __table_args__ = (Index("idx_mh_device_time", "device_id", "fetched_at"),)
+
+
 class ImportLog(Base):
     __tablename__ = "import_log"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -160,11 +209,27 @@ def _ensure_columns():
     from sqlalchemy import inspect, text
     insp = inspect(engine)
     existing = {c["name"] for c in insp.get_columns("devices")}
-    needed = [("last_complete_date", "DATE"), ("ticket_data_apertura_l4", "DATE")]
+    needed = [("last_complete_date", "DATE"), ("ticket_data_apertura_l4", "DATE"), ("client_id", "VARCHAR")]
     with engine.begin() as conn:
         for col, typ in needed:
             if col not in existing:
                 conn.execute(text(f"ALTER TABLE devices ADD COLUMN {col} {typ}"))
+    # create_all non aggiunge indici nuovi a tabelle già esistenti
+    for table in (Device.__table__, AnomalyEvent.__table__):
+        for idx in table.indexes:
+            idx.create(engine, checkfirst=True)
+    _backfill_client_ids()
+
+
+def _backfill_client_ids():
+    """Valorizza devices.client_id per le righe importate prima dell'introduzione della colonna."""
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        ids = conn.execute(text("SELECT device_id FROM devices WHERE client_id IS NULL")).scalars().all()
+        if ids:
+            # SQL testuale: il backfill non deve toccare updated_at
+            conn.execute(text("UPDATE devices SET client_id = :cid WHERE device_id = :did"),
+                         [{"did": did, "cid": device_name_to_clientid(did)} for did in ids])
 
 def get_session():
     return SessionLocal()
@@ -8,7 +8,8 @@ import json, re
 from datetime import datetime, date
 from typing import Dict, Tuple, Optional
 from pathlib import Path
-from database import get_session, init_db, Device, AvailabilityDaily, AnomalyEvent, ImportLog, TicketHistory
+from database import (get_session, init_db, Device, AvailabilityDaily, AnomalyEvent, ImportLog, TicketHistory,
+                      device_name_to_clientid)
 
 # I 4 stati ufficiali — nuova nomenclatura (febbraio 2026)
 # I codici numerici dello sheet Av Status ora mappano ai nuovi nomi
@@ -156,6 +157,7 @@ class ExcelImporter:
             if not device_id: continue
             device = session.get(Device, device_id)
             if device is None: device = Device(device_id=device_id); session.add(device)
+            device.client_id = device_name_to_clientid(device_id)
             device.tipo_install = safe_str(row.get("Tipo Installazione AM"))
             device.is_sotto_corona = is_sotto_corona(safe_str(row.get("Tipo Installazione AM")))
             device.linea = safe_str(row.get("Linea"))
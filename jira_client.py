@@ -12,8 +12,10 @@ from database import get_session, init_db, Device
 HAS_JIRA = True
 
 from sqlalchemy import create_engine, Column, String, Integer, Boolean, Date, DateTime, Text, Index
+from sqlalchemy import select, update, exists, func, or_
 from sqlalchemy.orm import declarative_base, sessionmaker
-from database import Base, engine, SessionLocal
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import Base, engine, SessionLocal, DB_PATH
 
 BASE_DIR = Path(__file__).parent
 ENV_FILE = BASE_DIR / ".env"
@@ -139,6 +141,12 @@ def purge_non_bug_tickets():
         session.close()
 
 
+# Pattern DeviceID nel Summary, compilati una volta (usati sia per riga che in forma vettoriale
+# nell'import CSV/Excel). Il DeviceID estratto è persistito in jira_tickets.device_id (indicizzato).
+_RE_DEVICE_PREFIXED = re.compile(r'Device\s+([\d:]+:DIGIL_\w+)')
+_RE_DEVICE_BARE = re.compile(r'(\d+:\d+:\d+:\d+:\d+:DIGIL_\w+)')
+
+
 def extract_device_id(summary: str) -> str:
     """Estrae il DeviceID dal Summary Jira.
     Patterns:
@@ -149,11 +157,11 @@ def extract_device_id(summary: str) -> str:
     if not summary:
         return ""
     # Pattern 1: "Device XXXXX"
-    m = re.search(r'Device\s+([\d:]+:DIGIL_\w+)', str(summary))
+    m = _RE_DEVICE_PREFIXED.search(str(summary))
     if m:
         return m.group(1)
     # Pattern 2: DeviceID diretto nel testo
-    m = re.search(r'(\d+:\d+:\d+:\d+:\d+:DIGIL_\w+)', str(summary))
+    m = _RE_DEVICE_BARE.search(str(summary))
     if m:
         return m.group(1)
     return ""
@@ -267,26 +275,21 @@ def _discover_custom_fields(jira_url, email, token) -> dict:
         return {}
 
 
-def _get_custom_field(fields, field_map: dict, field_name: str) -> str:
-    """Estrae il valore di un custom field dall'issue.
-    Gestisce sia valori stringa che oggetti con .value o .name."""
+def _get_custom_field(fields: dict, field_map: dict, field_name: str) -> str:
+    """Estrae il valore di un custom field dal dict "fields" grezzo dell'issue (JSON v3).
+    Gestisce sia valori stringa che oggetti con "value" o "name"."""
     fid = field_map.get(field_name)
     if not fid:
         return ""
     try:
-        val = getattr(fields, fid, None)
+        val = fields.get(fid)
         if val is None:
             return ""
-        # Jira custom fields possono essere: stringa, dict con value, oggetto con .value/.name
+        # Jira custom fields possono essere: stringa, dict con value/name, numero
         if isinstance(val, str):
             return val.strip()
-        if isinstance(val, (dict, _AttrDict)):
-            raw = val._data if isinstance(val, _AttrDict) else val
-            return str(raw.get("value", raw.get("name", ""))).strip()
-        if hasattr(val, 'value') and val.value is not None:
-            return str(val.value).strip()
-        if hasattr(val, 'name') and val.name is not None:
-            return str(val.name).strip()
+        if isinstance(val, dict):
+            return str(val.get("value", val.get("name", ""))).strip()
         return str(val).strip()
     except Exception:
         return ""
@@ -299,38 +302,108 @@ class JiraError(Exception):
     pass
 
 
-class _AttrDict:
-    """Wrapper che permette accesso ad attributi come la libreria jira."""
-    def __init__(self, data):
-        self._data = data
-    def __getattr__(self, name):
-        try:
-            val = self._data[name]
-        except KeyError:
-            return None
-        if isinstance(val, dict):
-            return _AttrDict(val)
-        if isinstance(val, list):
-            return [_AttrDict(v) if isinstance(v, dict) else v for v in val]
-        return val
-    def __bool__(self):
-        return bool(self._data)
+# Attributo JiraTicket -> nome del custom field Jira
+_CUSTOM_FIELD_ATTRS = (
+    ("assignee_level", "Assignee Level"), ("vendor", "Vendor"),
+    ("info_l1", "Info L1"), ("info_l2", "Info L2"), ("info_l3", "Info L3"), ("info_l4", "Info L4"),
+    ("cluster_risoluzione", "Cluster Risoluzione"),
+    ("status_l1", "Status L1"), ("status_l2", "Status L2"), ("status_l3", "Status L3"), ("status_l4", "Status L4"),
+)
+
+
+class _JiraRecord:
+    """Record compatto di un issue Jira, estratto dal JSON API v3 in un solo passaggio.
+    Gli slot hanno gli stessi nomi delle colonne JiraTicket."""
+    __slots__ = (
+        "key", "summary", "description", "issue_type", "status", "resolution", "priority",
+        "assignee", "reporter", "labels", "issue_links", "url",
+        "created", "updated", "resolution_date", "due_date",
+        "device_id", "fornitore",
+    ) + tuple(attr for attr, _ in _CUSTOM_FIELD_ATTRS)
+
+
+def _obj_attr(obj, attr: str, default: str = "") -> str:
+    """Ritorna obj[attr] se obj è un dict non vuoto, altrimenti default (come 'f.status.name if f.status')."""
+    if not obj or not isinstance(obj, dict):
+        return default
+    return obj.get(attr)
+
 
+def _parse_iso_datetime(val):
+    if not val:
+        return None
+    try:
+        return datetime.fromisoformat(str(val)[:19])
+    except Exception:
+        return None
+
+
+def _parse_iso_date(val):
+    if not val:
+        return None
+    try:
+        return date.fromisoformat(str(val)[:10])
+    except Exception:
+        return None
+
+
+def _parse_issue(data: dict, custom_field_map: dict, jira_url: str) -> _JiraRecord:
+    """Converte un issue JSON v3 (dict grezzo) in _JiraRecord senza wrapper intermedi."""
+    f = data.get("fields") or {}
+    rec = _JiraRecord()
+    key = data["key"]
+    rec.key = key
+    rec.summary = f.get("summary") or ""
+    rec.device_id = extract_device_id(rec.summary)
+    rec.fornitore = extract_fornitore(rec.device_id)
+    # API v3: description può essere ADF (dict) o stringa
+    desc_raw = f.get("description")
+    if isinstance(desc_raw, dict):
+        desc_raw = _adf_to_text(desc_raw)
+    rec.description = desc_raw or ""
+    rec.issue_type = _obj_attr(f.get("issuetype"), "name")
+    rec.status = _obj_attr(f.get("status"), "name")
+    rec.resolution = _obj_attr(f.get("resolution"), "name", "Unresolved")
+    rec.priority = _obj_attr(f.get("priority"), "name")
+    rec.assignee = _obj_attr(f.get("assignee"), "displayName", "Unassigned")
+    rec.reporter = _obj_attr(f.get("reporter"), "displayName")
+    labels = f.get("labels")
+    rec.labels = ", ".join(labels) if labels else ""
+    rec.url = f"{jira_url}/browse/{key}"
+
+    # Issue Links
+    links = []
+    try:
+        for link in f.get("issuelinks") or ():
+            ltype = link.get("type") or {}
+            out_issue = link.get("outwardIssue")
+            in_issue = link.get("inwardIssue")
+            if out_issue:
+                links.append(f"{ltype.get('outward')}: {out_issue.get('key')}")
+            elif in_issue:
+                links.append(f"{ltype.get('inward')}: {in_issue.get('key')}")
+    except Exception:
+        pass
+    rec.issue_links = ", ".join(links)
 
-class _JiraIssue:
-    """Simula un issue della libreria jira a partire dal JSON API v3."""
-    def __init__(self, data):
-        self.key = data["key"]
-        self.fields = _AttrDict(data.get("fields", {}))
+    # Custom fields
+    for attr, field_name in _CUSTOM_FIELD_ATTRS:
+        setattr(rec, attr, _get_custom_field(f, custom_field_map, field_name))
 
+    rec.created = _parse_iso_datetime(f.get("created"))
+    rec.updated = _parse_iso_datetime(f.get("updated"))
+    rec.resolution_date = _parse_iso_datetime(f.get("resolutiondate"))
+    rec.due_date = _parse_iso_date(f.get("duedate"))
+    return rec
 
-def _search_issues_v3(jira_url, email, token, jql, progress_cb=None):
+
+def _search_issues_v3(jira_url, email, token, jql, start_token=None):
     """Esegue la ricerca ticket via REST API v3 (/rest/api/3/search/jql).
-    Gestisce la paginazione e ritorna una lista di _JiraIssue."""
+    Generatore: produce una pagina alla volta come (lista di issue JSON grezzi, next_page_token).
+    next_page_token è None sull'ultima pagina; start_token riprende da una pagina intermedia."""
     url = f"{jira_url.rstrip('/')}/rest/api/3/search/jql"
     auth = (email, token)
-    all_issues = []
-    next_token = None
+    next_token = start_token
     max_results = 100
     while True:
         params = {
@@ -353,16 +426,63 @@ def _search_issues_v3(jira_url, email, token, jql, progress_cb=None):
             )
         data = resp.json()
         issues = data.get("issues", [])
-        for issue_data in issues:
-            all_issues.append(_JiraIssue(issue_data))
         next_token = data.get("nextPageToken")
         is_last = data.get("isLast", False)
-        if progress_cb:
-            try: progress_cb("fetch", len(all_issues), None)
-            except Exception: pass
         if not issues or is_last or not next_token:
-            break
-    return all_issues
+            yield issues, None
+            return
+        yield issues, next_token
+
+
+# ============================================================
+# STATO SYNC (ripresa da nextPageToken dopo interruzione)
+# ============================================================
+# Oltre questa età lo stato di un sync interrotto è ignorato: con ORDER BY created DESC le prime
+# pagine (ticket più recenti) sarebbero ormai vecchie e si riparte da capo
+SYNC_RESUME_MAX_AGE = timedelta(hours=6)
+
+
+def _sync_state_path() -> Path:
+    return DB_PATH.parent / "jira_sync_state.json"
+
+
+def _load_sync_state(jql: str):
+    """Ritorna (next_page_token, ticket_salvati, ultima chiave salvata) di un sync interrotto per
+    la stessa JQL da meno di SYNC_RESUME_MAX_AGE, altrimenti (None, 0, None)."""
+    fp = _sync_state_path()
+    if not fp.exists():
+        return None, 0, None
+    try:
+        data = json.loads(fp.read_text(encoding="utf-8"))
+        fresh = datetime.now() - datetime.fromisoformat(data["updated_at"]) < SYNC_RESUME_MAX_AGE
+        if fresh and data.get("jql") == jql and data.get("next_page_token") and data.get("last_key"):
+            return data["next_page_token"], int(data.get("saved", 0)), data["last_key"]
+    except Exception:
+        pass
+    return None, 0, None
+
+
+def _save_sync_state(jql: str, next_token: str, saved: int, last_key: str):
+    try:
+        fp = _sync_state_path()
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fp.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({
+            "jql": jql, "next_page_token": next_token, "saved": saved, "last_key": last_key,
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        }), encoding="utf-8")
+        tmp.replace(fp)
+    except Exception:
+        pass
+
+
+def _clear_sync_state():
+    try:
+        _sync_state_path().unlink()
+    except FileNotFoundError:
+        pass
+    except Exception:
+        pass
 
 
 def _adf_to_text(adf):
@@ -436,126 +556,75 @@ def download_from_jira(email=None, token=None, jira_url="https://terna-it.atlass
     if progress_cb:
         try: progress_cb("fetch", 0, None)
         except Exception: pass
-    try:
-        issues = _search_issues_v3(jira_url, email, token, jql, progress_cb=progress_cb)
-    except JiraError as e:
-        return False, f"Query fallita: {e}"
 
     init_jira_db()
+    # Se un sync precedente si è interrotto da poco, riprende dall'ultima pagina non salvata
+    start_token, count, resume_key = _load_sync_state(jql)
     session = SessionLocal()
-    count = 0
-    total = len(issues)
-    try:
-        for issue in issues:
-            if progress_cb and (count % 10 == 0 or count == total - 1):
-                try: progress_cb("save", count, total)
+
+    def save_page(issues):
+        # Un solo upsert + commit per pagina: memoria limitata alla pagina corrente e progresso persistito
+        nonlocal count
+        rows = []
+        for issue_data in issues:
+            rec = _parse_issue(issue_data, custom_field_map, jira_url)
+            rows.append(_record_to_row(rec, jira_url, email, token))
+            count += 1
+            if progress_cb and count % 10 == 0:
+                try: progress_cb("save", count, None)
                 except Exception: pass
-            f = issue.fields
-            key = issue.key
-            summary = f.summary or ""
-            device_id = extract_device_id(summary)
-            fornitore = extract_fornitore(device_id)
-
-            # Comments (API v3)
-            comments_str = ""
-            try:
-                comments_data = _get_comments_v3(jira_url, email, token, key)
-                if comments_data:
-                    parts = []
-                    for c in comments_data:
-                        author = c.get("author", {}).get("displayName", "")
-                        created = c.get("created", "")[:19]
-                        # API v3 usa ADF (Atlassian Document Format) per body
-                        body = c.get("body", "")
-                        if isinstance(body, dict):
-                            # Estrai testo da ADF
-                            body = _adf_to_text(body)
-                        parts.append(f"[{created}] {author}:\n{body}")
-                    comments_str = "\n---\n".join(parts)
-            except Exception:
-                pass
-
-            # Issue Links
-            links_str = ""
-            try:
-                issue_links = f.issuelinks
-                if issue_links:
-                    links = []
-                    for link in issue_links:
-                        if link.outwardIssue:
-                            links.append(f"{link.type.outward}: {link.outwardIssue.key}")
-                        elif link.inwardIssue:
-                            links.append(f"{link.type.inward}: {link.inwardIssue.key}")
-                    links_str = ", ".join(links)
-            except Exception:
-                pass
-
-            ticket = session.get(JiraTicket, key)
-            if ticket is None:
-                ticket = JiraTicket(key=key)
-                session.add(ticket)
-
-            ticket.summary = summary
-            # API v3: description può essere ADF (dict) o stringa
-            desc_raw = f.description
-            if isinstance(desc_raw, dict):
-                desc_raw = _adf_to_text(desc_raw)
-            elif isinstance(desc_raw, _AttrDict):
-                desc_raw = _adf_to_text(desc_raw._data)
-            ticket.description = desc_raw or ""
-            ticket.issue_type = f.issuetype.name if f.issuetype else ""
-            ticket.status = f.status.name if f.status else ""
-            ticket.resolution = f.resolution.name if f.resolution else "Unresolved"
-            ticket.priority = f.priority.name if f.priority else ""
-            ticket.assignee = f.assignee.displayName if f.assignee else "Unassigned"
-            ticket.reporter = f.reporter.displayName if f.reporter else ""
-            ticket.labels = ", ".join(f.labels) if f.labels else ""
-            ticket.url = f"{jira_url}/browse/{key}"
-            ticket.num_comments = len(comments_data) if comments_str else 0
-            ticket.comments = comments_str or "Nessun commento"
-            ticket.issue_links = links_str or "Nessun link"
-            ticket.device_id = device_id
-            ticket.fornitore = fornitore
-
-            # Custom fields
-            ticket.assignee_level = _get_custom_field(f, custom_field_map, "Assignee Level")
-            ticket.vendor = _get_custom_field(f, custom_field_map, "Vendor")
-            ticket.info_l1 = _get_custom_field(f, custom_field_map, "Info L1")
-            ticket.info_l2 = _get_custom_field(f, custom_field_map, "Info L2")
-            ticket.info_l3 = _get_custom_field(f, custom_field_map, "Info L3")
-            ticket.info_l4 = _get_custom_field(f, custom_field_map, "Info L4")
-            ticket.cluster_risoluzione = _get_custom_field(f, custom_field_map, "Cluster Risoluzione")
-            ticket.status_l1 = _get_custom_field(f, custom_field_map, "Status L1")
-            ticket.status_l2 = _get_custom_field(f, custom_field_map, "Status L2")
-            ticket.status_l3 = _get_custom_field(f, custom_field_map, "Status L3")
-            ticket.status_l4 = _get_custom_field(f, custom_field_map, "Status L4")
+        _upsert_tickets(session, rows)
+        session.commit()
+        if progress_cb:
+            try: progress_cb("fetch", count, None)
+            except Exception: pass
 
+    try:
+        try:
+            pages = _search_issues_v3(jira_url, email, token, jql, start_token=start_token)
+            page = next(pages, None)
+        except JiraError as e:
+            if not start_token:
+                return False, f"Query fallita: {e}"
+            # Token di ripresa scaduto/non valido: riparte da capo
+            _clear_sync_state(); count = 0; resume_key = None
             try:
-                ticket.created = datetime.fromisoformat(f.created[:19]) if f.created else None
-            except Exception:
-                pass
-            try:
-                ticket.updated = datetime.fromisoformat(f.updated[:19]) if f.updated else None
-            except Exception:
-                pass
+                pages = _search_issues_v3(jira_url, email, token, jql)
+                page = next(pages, None)
+            except JiraError as e2:
+                return False, f"Query fallita: {e2}"
+
+        while page is not None:
+            issues, next_token = page
+            save_page(issues)
+            if next_token and issues:
+                _save_sync_state(jql, next_token, count, issues[-1].get("key"))
             try:
-                rd = getattr(f, 'resolutiondate', None)
-                ticket.resolution_date = datetime.fromisoformat(str(rd)[:19]) if rd else None
-            except Exception:
-                ticket.resolution_date = None
+                page = next(pages, None)
+            except JiraError as e:
+                return False, f"Query interrotta dopo {count} ticket (riprende al prossimo sync): {e}"
+
+        msg = f"{count} ticket scaricati"
+        if resume_key:
+            # Ripresa: le prime pagine erano state salvate prima dell'interruzione e nel frattempo
+            # possono essere cambiate (o arrivati ticket nuovi). Le riscarica fino alla pagina che
+            # contiene l'ultima chiave salvata allora.
+            total = count
             try:
-                ticket.due_date = date.fromisoformat(str(f.duedate)) if f.duedate else None
-            except Exception:
-                pass
-
-            ticket.last_synced = datetime.utcnow()
-            count += 1
+                for issues, _ in _search_issues_v3(jira_url, email, token, jql):
+                    save_page(issues)
+                    if any(i.get("key") == resume_key for i in issues):
+                        break
+            except JiraError as e:
+                return False, f"Sync ripreso incompleto ({total} ticket): aggiornamento dei ticket recenti fallito: {e}"
+            msg = f"{total} ticket scaricati (sync ripreso, {count - total} ticket recenti riscaricati)"
 
         # Correlazione con dati Excel (Device table)
         _correlate_with_devices(session)
 
         session.commit()
-        return True, f"{count} ticket scaricati"
+        _clear_sync_state()
+        return True, msg
     except Exception as e:
         session.rollback()
         return False, f"Errore salvataggio: {e}"
@@ -563,6 +632,54 @@ def download_from_jira(email=None, token=None, jira_url="https://terna-it.atlass
         session.close()
 
 
+def _record_to_row(rec: _JiraRecord, jira_url, email, token) -> dict:
+    """Scarica i commenti e converte un _JiraRecord nella riga (dict) da scrivere in jira_tickets."""
+    # Comments (API v3)
+    comments_str = ""
+    num_comments = 0
+    try:
+        comments_data = _get_comments_v3(jira_url, email, token, rec.key)
+        if comments_data:
+            parts = []
+            for c in comments_data:
+                author = c.get("author", {}).get("displayName", "")
+                created = c.get("created", "")[:19]
+                # API v3 usa ADF (Atlassian Document Format) per body
+                body = c.get("body", "")
+                if isinstance(body, dict):
+                    # Estrai testo da ADF
+                    body = _adf_to_text(body)
+                parts.append(f"[{created}] {author}:\n{body}")
+            comments_str = "\n---\n".join(parts)
+            num_comments = len(comments_data)
+    except Exception:
+        pass
+
+    row = {attr: getattr(rec, attr) for attr in _JiraRecord.__slots__}
+    row["issue_links"] = rec.issue_links or "Nessun link"
+    row["num_comments"] = num_comments
+    row["comments"] = comments_str or "Nessun commento"
+    row["last_synced"] = datetime.utcnow()
+    return row
+
+
+def _upsert_tickets(session, rows: list, keep_if_null=()) -> int:
+    """Scrive le righe in jira_tickets con un solo INSERT ... ON CONFLICT(key) DO UPDATE (executemany).
+    Tutte le righe devono avere le stesse chiavi; le colonne non presenti (es. correlazione Excel) restano invariate.
+    Le colonne in keep_if_null non sovrascrivono il valore salvato con NULL (COALESCE)."""
+    if not rows:
+        return 0
+    jt = JiraTicket.__table__
+    stmt = sqlite_insert(jt)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[jt.c.key],
+        set_={col: func.coalesce(stmt.excluded[col], jt.c[col]) if col in keep_if_null else stmt.excluded[col]
+              for col in rows[0] if col != "key"},
+    )
+    session.execute(stmt, rows)
+    return len(rows)
+
+
 def import_from_excel(file_path: str):
     """Importa ticket da un file Excel o CSV esportato da Jira."""
     import pandas as pd
@@ -591,85 +708,12 @@ def import_from_excel(file_path: str):
         if "Type" in df.columns:
             df = df[df["Type"] == "Bug in esercizio"].copy()
 
+    rows = _export_to_rows(df)
     init_jira_db()
     session = SessionLocal()
-    count = 0
     try:
-        for _, row in df.iterrows():
-            key = str(row.get("Key", ""))
-            if not key:
-                continue
-            summary = str(row.get("Summary", ""))
-            device_id = extract_device_id(summary)
-            fornitore = extract_fornitore(device_id)
-
-            ticket = session.get(JiraTicket, key)
-            if ticket is None:
-                ticket = JiraTicket(key=key)
-                session.add(ticket)
-
-            ticket.summary = summary
-            ticket.description = str(row.get("Description", "")) if not pd.isna(row.get("Description")) else ""
-            ticket.issue_type = str(row.get("Type", ""))
-            ticket.status = str(row.get("Status", ""))
-            ticket.resolution = str(row.get("Resolution", "Unresolved"))
-            ticket.priority = str(row.get("Priority", ""))
-            ticket.assignee = str(row.get("Assignee", "")) if not pd.isna(row.get("Assignee")) else "Unassigned"
-            ticket.reporter = str(row.get("Reporter", "")) if not pd.isna(row.get("Reporter")) else ""
-            ticket.labels = str(row.get("Labels", "")) if not pd.isna(row.get("Labels")) else ""
-            ticket.url = str(row.get("URL", "")) if not pd.isna(row.get("URL")) else ""
-            ticket.comments = str(row.get("Comments", "")) if not pd.isna(row.get("Comments")) else ""
-            ticket.num_comments = int(row.get("Num Comments", 0)) if not pd.isna(row.get("Num Comments")) else 0
-            ticket.issue_links = str(row.get("Issue Links", "")) if not pd.isna(row.get("Issue Links")) else ""
-            ticket.device_id = device_id
-            ticket.fornitore = fornitore
-
-            # Custom fields (se presenti nel file Excel)
-            # Supporta sia nomi diretti che formato CSV Jira "Campo personalizzato (Nome)"
-            def _safe_excel(col, alt_col=None):
-                v = row.get(col)
-                if (v is None or (isinstance(v, float) and pd.isna(v))) and alt_col:
-                    v = row.get(alt_col)
-                if v is None or (isinstance(v, float) and pd.isna(v)):
-                    return ""
-                return str(v).strip()
-            ticket.assignee_level = _safe_excel("Assignee Level", "Campo personalizzato (Assignee Level)")
-            ticket.vendor = _safe_excel("Vendor", "Campo personalizzato (Vendor)")
-            ticket.info_l1 = _safe_excel("Info L1", "Campo personalizzato (Info L1)")
-            ticket.info_l2 = _safe_excel("Info L2", "Campo personalizzato (Info L2)")
-            ticket.info_l3 = _safe_excel("Info L3", "Campo personalizzato (Info L3)")
-            ticket.info_l4 = _safe_excel("Info L4", "Campo personalizzato (Info L4)")
-            ticket.cluster_risoluzione = _safe_excel("Cluster Risoluzione", "Campo personalizzato (Cluster Risoluzione)")
-            ticket.status_l1 = _safe_excel("Status L1", "Campo personalizzato (Status L1)")
-            ticket.status_l2 = _safe_excel("Status L2", "Campo personalizzato (Status L2)")
-            ticket.status_l3 = _safe_excel("Status L3", "Campo personalizzato (Status L3)")
-            ticket.status_l4 = _safe_excel("Status L4", "Campo personalizzato (Status L4)")
-
-            try:
-                c = str(row.get("Created", ""))
-                ticket.created = datetime.fromisoformat(c[:19]) if c and c != "nan" else None
-            except Exception:
-                pass
-            try:
-                u = str(row.get("Updated", ""))
-                ticket.updated = datetime.fromisoformat(u[:19]) if u and u != "nan" else None
-            except Exception:
-                pass
-            try:
-                # "Risolti" = nome colonna CSV Jira italiano; "Resolved" = inglese
-                rd = str(row.get("Risolti", row.get("Resolved", row.get("Campo personalizzato (Resolved)", ""))))
-                ticket.resolution_date = datetime.fromisoformat(rd[:19]) if rd and rd not in ("nan", "NaT", "") else None
-            except Exception:
-                ticket.resolution_date = None
-            try:
-                d = str(row.get("Due Date", ""))
-                ticket.due_date = date.fromisoformat(d[:10]) if d and d != "nan" and d != "NaT" else None
-            except Exception:
-                pass
-
-            ticket.last_synced = datetime.utcnow()
-            count += 1
-
+        # Date vuote o non interpretabili nell'export: resta il valore già salvato
+        count = _upsert_tickets(session, rows, keep_if_null=_EXPORT_DATE_COLS)
         _correlate_with_devices(session)
         session.commit()
         return True, f"{count} ticket importati da Excel"
@@ -680,19 +724,144 @@ def import_from_excel(file_path: str):
         session.close()
 
 
+# Colonne data dell'export Excel/CSV: se la cella è vuota o non interpretabile non sovrascrivono il DB
+_EXPORT_DATE_COLS = ("created", "updated", "resolution_date", "due_date")
+
+# Mesi abbreviati dei CSV Jira ("01/mar/25 10:00"), in italiano e in inglese
+_JIRA_MONTHS = {m: i for i, m in enumerate(
+    ("gen", "feb", "mar", "apr", "mag", "giu", "lug", "ago", "set", "ott", "nov", "dic"), 1)}
+_JIRA_MONTHS.update({m: i for i, m in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1)})
+_RE_JIRA_CSV_DATE = re.compile(r"^(\d{1,2})/([A-Za-z]{3})/(\d{2}|\d{4})\b")
+
+
+def _export_to_rows(df) -> list:
+    """Converte un export Jira (DataFrame con colonne già rinominate) nelle righe di jira_tickets.
+    Tutte le trasformazioni sono per colonna: nessun iterrows."""
+    import pandas as pd
+    idx = df.index
+
+    def text(col, default=""):
+        if col not in df.columns:
+            return pd.Series(default, index=idx, dtype=object)
+        s = df[col]
+        return s.where(s.notna(), default).astype(str)
+
+    def custom(field_name):
+        # Supporta sia nomi diretti che formato CSV Jira "Campo personalizzato (Nome)"
+        s = None
+        for col in (field_name, f"Campo personalizzato ({field_name})"):
+            if col in df.columns:
+                s = df[col] if s is None else s.where(s.notna(), df[col])
+        if s is None:
+            return pd.Series("", index=idx, dtype=object)
+        return s.where(s.notna(), "").astype(str).str.strip()
+
+    def timestamps(*cols):
+        col = next((c for c in cols if c in df.columns), None)
+        if col is None:
+            return pd.Series(pd.NaT, index=idx, dtype="datetime64[ns]")
+        s = df[col]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            return s
+        s = s.where(s.notna(), "").astype(str).str.strip()
+        out = pd.to_datetime(s.str[:19], format="ISO8601", errors="coerce")
+        # Formato dei CSV Jira: dd/MMM/yy HH:mm (mese abbreviato, anche AM/PM nelle istanze inglesi)
+        rest = out.isna() & s.str.match(_RE_JIRA_CSV_DATE)
+        if rest.any():
+            num = s[rest].str.replace(_RE_JIRA_CSV_DATE, lambda m: f"{m.group(1)}/{_JIRA_MONTHS.get(m.group(2).lower(), 0)}/{m.group(3)}",
+                                      regex=True)
+            for fmt in ("%d/%m/%y %H:%M", "%d/%m/%y %I:%M %p", "%d/%m/%Y %H:%M", "%d/%m/%y", "%d/%m/%Y"):
+                missing = out.isna() & rest
+                if not missing.any():
+                    break
+                out[missing] = pd.to_datetime(num[missing[rest]], format=fmt, errors="coerce")
+        return out
+
+    def nullable(s):
+        # NaT -> None, così SQLAlchemy scrive NULL
+        return s.astype(object).where(s.notna(), None)
+
+    summary = text("Summary")
+    device_id = (summary.str.extract(_RE_DEVICE_PREFIXED, expand=False)
+                 .fillna(summary.str.extract(_RE_DEVICE_BARE, expand=False))
+                 .fillna(""))
+    # Stessa priorità di extract_fornitore: IND > MRN > SR2/SRT
+    did_upper = device_id.str.upper()
+    fornitore = pd.Series("", index=idx, dtype=object)
+    fornitore = fornitore.mask(did_upper.str.contains("DIGIL_SR2|DIGIL_SRT", regex=True), "SIRTI")
+    fornitore = fornitore.mask(did_upper.str.contains("DIGIL_MRN", regex=False), "MII")
+    fornitore = fornitore.mask(did_upper.str.contains("DIGIL_IND", regex=False), "INDRA")
+
+    if "Num Comments" in df.columns:
+        num_comments = pd.to_numeric(df["Num Comments"], errors="coerce").fillna(0).astype(int)
+    else:
+        num_comments = pd.Series(0, index=idx, dtype=int)
+
+    # "Risolti" = nome colonna CSV Jira italiano; "Resolved" = inglese
+    resolved = timestamps("Risolti", "Resolved", "Campo personalizzato (Resolved)")
+    due = timestamps("Due Date")
+
+    out = pd.DataFrame({
+        "key": text("Key"),
+        "summary": summary,
+        "description": text("Description"),
+        "issue_type": text("Type"),
+        "status": text("Status"),
+        "resolution": text("Resolution", "Unresolved"),
+        "priority": text("Priority"),
+        "assignee": text("Assignee", "Unassigned"),
+        "reporter": text("Reporter"),
+        "labels": text("Labels"),
+        "url": text("URL"),
+        "comments": text("Comments"),
+        "num_comments": num_comments,
+        "issue_links": text("Issue Links"),
+        "device_id": device_id,
+        "fornitore": fornitore,
+        "created": nullable(timestamps("Created")),
+        "updated": nullable(timestamps("Updated")),
+        "resolution_date": nullable(resolved),
+        "due_date": nullable(due.dt.date.where(due.notna())),
+    }, index=idx)
+    for attr, field_name in _CUSTOM_FIELD_ATTRS:
+        out[attr] = custom(field_name)
+    out["last_synced"] = datetime.utcnow()
+    out = out[out["key"].str.strip() != ""]
+    return out.to_dict("records")
+
+
 def _correlate_with_devices(session):
-    """Correla i ticket Jira con i dati dei Device (Risoluzione attuata, Macro-area)."""
-    tickets = session.query(JiraTicket).filter(JiraTicket.device_id != "", JiraTicket.device_id != None).all()
-    for ticket in tickets:
-        device = session.get(Device, ticket.device_id)
-        if device:
-            ticket.risoluzione_attuata = device.risoluzione_attuata or ""
-            ticket.macro_area = getattr(device, 'cluster_analisi', None) or ""
+    """Correla i ticket Jira con i dati dei Device (Risoluzione attuata, Macro-area).
+    Un solo UPDATE con subquery correlate su devices: aggiorna solo i ticket i cui valori differiscono.
+    Ritorna il numero di ticket aggiornati."""
+    jt = JiraTicket.__table__
+    dv = Device.__table__
+    same_device = dv.c.device_id == jt.c.device_id
+    dev_ris = func.coalesce(dv.c.risoluzione_attuata, "")
+    dev_macro = func.coalesce(dv.c.cluster_analisi, "")
+    stmt = (
+        update(jt)
+        .where(
+            jt.c.device_id.isnot(None), jt.c.device_id != "",
+            exists().where(same_device, or_(
+                jt.c.risoluzione_attuata.is_distinct_from(dev_ris),
+                jt.c.macro_area.is_distinct_from(dev_macro),
+            )),
+        )
+        .values(
+            risoluzione_attuata=select(dev_ris).where(same_device).scalar_subquery(),
+            macro_area=select(dev_macro).where(same_device).scalar_subquery(),
+        )
+    )
+    return session.execute(stmt).rowcount
 
 
-def get_ticket_data(filters=None):
+def get_ticket_data(filters=None, timing=True):
     """Ritorna i ticket filtrati per la visualizzazione.
-    Solo ticket: type='Bug in esercizio', fornitore IN (INDRA/MII/SIRTI)."""
+    Solo ticket: type='Bug in esercizio', fornitore IN (INDRA/MII/SIRTI).
+    Con timing=False non calcola timing_hours/timing_color, che dipendono dall'ora corrente
+    (per i dati tenuti in cache: il timing va calcolato a ogni visualizzazione)."""
     session = SessionLocal()
     try:
         q = session.query(JiraTicket).filter(
@@ -718,7 +887,7 @@ def get_ticket_data(filters=None):
         tickets = q.order_by(JiraTicket.created.desc()).all()
         result = []
         for t in tickets:
-            hours, color = compute_timing_hours(t.created, t.updated)
+            hours, color = compute_timing_hours(t.created, t.updated) if timing else (None, None)
             result.append({
                 "key": t.key,
                 "device_id": t.device_id or "",
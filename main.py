@@ -1,32 +1,36 @@
 """
 DIGIL Monitoring Dashboard - PyQt5 - Terna IoT Team
 """
-import sys, json
+import sys, json, calendar
+import numpy as np
 from pathlib import Path
 from datetime import datetime, date
-from typing import Optional, List, Dict
-from collections import Counter
+from typing import Optional, List
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout,
     QLabel, QPushButton, QTableWidget, QTableWidgetItem, QProgressBar,
     QGroupBox, QFileDialog, QMessageBox, QTabWidget, QHeaderView,
     QAbstractItemView, QStatusBar, QFrame, QLineEdit, QComboBox,
     QDialog, QTextEdit, QPlainTextEdit, QScrollArea, QSplitter, QSizePolicy,
-    QFormLayout, QDateEdit, QDialogButtonBox, QCheckBox, QProgressDialog, QGridLayout
+    QFormLayout, QDateEdit, QDialogButtonBox, QCheckBox, QGridLayout, QTableView, QToolTip
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QDate, QTimer, QUrl
+from PyQt5.QtCore import (Qt, QThread, pyqtSignal, QDate, QTimer, QUrl, QAbstractTableModel,
+    QSortFilterProxyModel, QModelIndex, QObject, QRunnable, QThreadPool, QRect, QSize, QEvent)
 from PyQt5.QtGui import QDesktopServices
 import threading as _maint_threading
-from PyQt5.QtGui import QColor, QFont, QBrush, QPixmap
-from database import get_session, init_db, Device, AvailabilityDaily, AnomalyEvent, ImportLog, TicketHistory
-from importer import run_import
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtGui import QColor, QFont, QBrush, QPixmap, QPainter, QImage
+from database import get_session, init_db, Device, ImportLog, device_name_to_clientid
+from importer import run_import, AV_STATUS_NUMERIC
 from detection import run_detection
 from jira_client import (init_jira_db, import_from_excel as jira_import_excel, download_from_jira,
-    get_ticket_data, get_filter_options, get_ticket_overview_by_fornitore, compute_timing_hours,
+    get_ticket_data, compute_timing_hours,
     FORNITORE_DISPLAY, HAS_JIRA, get_jira_stats, _load_credentials)
 from maintenance_api import (fetch_maintenance_bulk, get_token_manager as get_maint_tm,
-    load_cache as load_maint_cache, save_cache as save_maint_cache, cache_last_updated as maint_cache_ts,
-    device_name_to_clientid)
+    save_cache as save_maint_cache, cache_last_updated as maint_cache_ts,
+    stale_devices as maint_stale_devices, device_priorities as maint_priorities,
+    get_flapping_devices as maint_flapping)
+from read_model import read_model
 
 JIRA_USERS = {
     "Festa Rosa": "60705508126db9006f3be9e8",
@@ -54,9 +58,9 @@ QPushButton#jira { background: #0052CC; color: white; }
 QPushButton#jira:hover { background: #0747A6; }
 QPushButton#toggle_on { background: #E65100; color: white; border: 2px solid #BF360C; font-weight: bold; }
 QPushButton#toggle_off { background: white; color: #666; border: 1px solid #CCC; font-weight: normal; }
-QTableWidget { border: 1px solid #CCCCCC; gridline-color: #E0E0E0; background: white; alternate-background-color: #F8FBFF; font-size: 11px; }
-QTableWidget::item { padding: 3px 5px; }
-QTableWidget::item:selected { background: #CCE5FF; color: black; }
+QTableWidget, QTableView { border: 1px solid #CCCCCC; gridline-color: #E0E0E0; background: white; alternate-background-color: #F8FBFF; font-size: 11px; }
+QTableWidget::item, QTableView::item { padding: 3px 5px; }
+QTableWidget::item:selected, QTableView::item:selected { background: #CCE5FF; color: black; }
 QHeaderView::section { background: #0066CC; color: white; padding: 6px; border: none; font-weight: bold; font-size: 11px; }
 QTabWidget::pane { border: 1px solid #CCCCCC; background: white; }
 QTabBar::tab { background: #F0F0F0; border: 1px solid #CCCCCC; padding: 10px 24px; font-weight: bold; font-size: 13px; min-width: 100px; }
@@ -140,10 +144,6 @@ def trend_str(t):
     if not t: return "-"
     return "".join("\u25a0" if c == "O" else "\u25a1" for c in t)
 
-def func_count():
-    from sqlalchemy import func
-    return func.count()
-
 class ImportThread(QThread):
     progress = pyqtSignal(str); finished = pyqtSignal(dict, int); error = pyqtSignal(str)
     def __init__(self, fp): super().__init__(); self.file_path = fp
@@ -170,62 +170,394 @@ class JiraDownloadThread(QThread):
             self.finished_ok.emit(False, f"Errore: {e}")
 
 class MaintenanceCheckThread(QThread):
+    """Check maintenance in background. Ogni blocco di risultati è salvato in maintenance_status/
+    history da un thread di scrittura dedicato (in ordine, senza fermare il fetch) e solo dopo
+    emesso con batch: il thread GUI non scrive mai sul DB. finished_ok arriva a blocchi salvati."""
     progress = pyqtSignal(int, int)  # done, total
+    batch = pyqtSignal(dict, dict)   # risultati parziali salvati {device_id: status} (senza SKIP), {device_id: (latency_ms, errore)}
     finished_ok = pyqtSignal(dict)   # {device_id: status}
     error = pyqtSignal(str)
-    def __init__(self, device_ids):
+    def __init__(self, device_ids, time_budget_s=None):
         super().__init__(); self.device_ids = device_ids; self.stop_flag = _maint_threading.Event()
+        self.time_budget_s = time_budget_s
+        self.details = {}  # {device_id: (latency_ms, errore)}
     def stop(self): self.stop_flag.set()
+    def _save_batch(self, res):
+        fresh = {k: v for k, v in res.items() if v != "SKIP"}
+        details = {k: self.details.get(k) for k in fresh}
+        save_maint_cache(fresh, details)
+        self.batch.emit(fresh, details)
     def run(self):
         try:
-            res = fetch_maintenance_bulk(self.device_ids,
-                                          progress_cb=lambda d, t: self.progress.emit(d, t),
-                                          stop_flag=self.stop_flag)
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="maint-save") as writer:
+                res = fetch_maintenance_bulk(self.device_ids,
+                                              progress_cb=lambda d, t: self.progress.emit(d, t),
+                                              stop_flag=self.stop_flag, details=self.details,
+                                              batch_cb=lambda b: writer.submit(self._save_batch, b),
+                                              time_budget_s=self.time_budget_s)
             self.finished_ok.emit(res)
         except Exception as e:
             self.error.emit(str(e))
 
+
+class _QuerySignals(QObject):
+    done = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class QueryWorker(QRunnable):
+    """Esegue load() (query + costruzione righe) su un thread del pool, con la propria sessione.
+    Il risultato torna al thread GUI via segnale (connessione queued)."""
+    def __init__(self, fn):
+        super().__init__(); self.fn = fn; self.signals = _QuerySignals(); self.setAutoDelete(False)
+    def run(self):
+        try: res = self.fn()
+        except Exception as e:
+            self.signals.failed.emit(str(e)); return
+        self.signals.done.emit(res)
+
+# Ruoli letti dagli item prodotti dai renderer (rfn) e restituiti dal modello
+_CELL_ROLES = (Qt.DisplayRole, Qt.BackgroundRole, Qt.ForegroundRole, Qt.FontRole,
+               Qt.ToolTipRole, Qt.TextAlignmentRole, Qt.UserRole)
+_SORT_ROLE = Qt.UserRole + 1   # valore grezzo della riga, usato per ordinare senza renderizzare
+
+
+class _RowModel(QAbstractTableModel):
+    """Modello a righe dict per FilterableTable. Le celle sono renderizzate solo quando la vista
+    le chiede (righe visibili): l'item del renderer viene convertito nei suoi ruoli e messo in cache."""
+    _CACHE_MAX = 50000
+
+    def __init__(self, columns, parent=None):
+        super().__init__(parent); self.columns = columns; self.rows = []; self._rfn = None; self._cells = {}
+    def rowCount(self, parent=QModelIndex()): return 0 if parent.isValid() else len(self.rows)
+    def columnCount(self, parent=QModelIndex()): return 0 if parent.isValid() else len(self.columns)
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal and 0 <= section < len(self.columns): return self.columns[section]
+        return None
+    def set_rows(self, rows, rfn):
+        self.beginResetModel(); self.rows = rows; self._rfn = rfn; self._cells = {}; self.endResetModel()
+    def _cell(self, r, c):
+        cell = self._cells.get((r, c))
+        if cell is None:
+            if len(self._cells) >= self._CACHE_MAX: self._cells.clear()
+            rd = self.rows[r]; cn = self.columns[c]
+            it = self._rfn(rd, cn) if self._rfn else QTableWidgetItem(str(rd.get(cn,"")))
+            cell = {}
+            if it:
+                for role in _CELL_ROLES:
+                    v = it.data(role)
+                    if v is not None: cell[role] = v
+            self._cells[(r, c)] = cell
+        return cell
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid(): return None
+        if role == _SORT_ROLE: return str(self.rows[index.row()].get(self.columns[index.column()], ""))
+        if role not in _CELL_ROLES: return None
+        return self._cell(index.row(), index.column()).get(role)
+    def refresh_cells(self, rows, c):
+        """Invalida la cache della colonna c per le righe indicate e notifica la vista."""
+        for r in rows:
+            self._cells.pop((r, c), None)
+            idx = self.index(r, c); self.dataChanged.emit(idx, idx)
+
+
+class _RowFilterProxy(QSortFilterProxyModel):
+    """Proxy di FilterableTable: il filtro è l'insieme delle righe sorgente ammesse (None = tutte),
+    calcolato da FilterableTable; l'ordinamento usa il valore grezzo (_SORT_ROLE)."""
+    def __init__(self, parent=None):
+        super().__init__(parent); self.accepted = None; self.setSortRole(_SORT_ROLE)
+    def set_accepted(self, accepted):
+        # invalidate() ricostruisce le mappature in un colpo (layoutChanged); invalidateFilter() emette
+        # una rimozione per ogni intervallo di righe scartate, quadratico con filtri sparsi
+        self.accepted = accepted; self.invalidate()
+    def filterAcceptsRow(self, row, parent): return self.accepted is None or row in self.accepted
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Vertical and role == Qt.DisplayRole: return section + 1
+        return super().headerData(section, orientation, role)
+
+
 class FilterableTable(QWidget):
+    FILTER_DELAY_MS = 150   # debounce dei filtri testuali
+
     def __init__(self, columns, parent=None, dynamic_cols=None):
-        super().__init__(parent); self.columns = columns; self._all = []; self._filt = []; self._rfn = None
+        super().__init__(parent); self.columns = columns; self._all = []
+        self._keys = {}                   # colonna -> chiavi di ricerca minuscole, una per riga
+        self._last_act = None; self._last_accepted = None   # ultimo filtro applicato (per restringere)
+        self._filter_timer = QTimer(self); self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(self.FILTER_DELAY_MS); self._filter_timer.timeout.connect(self._apply)
         self._dynamic_cols = list(dynamic_cols) if dynamic_cols else []
         lo = QVBoxLayout(self); lo.setContentsMargins(0,0,0,0); lo.setSpacing(2)
         fw = QWidget(); fl = QHBoxLayout(fw); fl.setContentsMargins(2,2,2,2); fl.setSpacing(2)
         self.filters = {}
         for col in columns:
             le = QLineEdit(); le.setPlaceholderText(f"Filtra {col}"); le.setMaximumHeight(22)
-            le.setStyleSheet("font-size:10px;padding:1px 4px;"); le.textChanged.connect(self._apply); self.filters[col] = le; fl.addWidget(le)
+            le.setStyleSheet("font-size:10px;padding:1px 4px;"); le.textChanged.connect(self._filter_timer.start); self.filters[col] = le; fl.addWidget(le)
         lo.addWidget(fw)
-        self.table = QTableWidget(); self.table.setColumnCount(len(columns)); self.table.setHorizontalHeaderLabels(columns)
+        self.model = _RowModel(columns, self); self.proxy = _RowFilterProxy(self); self.proxy.setSourceModel(self.model)
+        self.table = QTableView(); self.table.setModel(self.proxy)
         self.table.setAlternatingRowColors(True); self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
-        self.table.setSelectionMode(QAbstractItemView.ExtendedSelection); self.table.setSortingEnabled(True)
+        self.table.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        # Nessun ordinamento finché l'utente non clicca un'intestazione: resta l'ordine della query
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder); self.table.setSortingEnabled(True)
         self.table.setEditTriggers(QAbstractItemView.NoEditTriggers); self.table.verticalHeader().setDefaultSectionSize(24)
         self.table.horizontalHeader().setStretchLastSection(True); lo.addWidget(self.table)
     def clear_filters(self):
         for le in self.filters.values(): le.blockSignals(True); le.clear(); le.blockSignals(False)
         self._apply()
-    def set_data(self, data, rfn=None): self._all = data; self._rfn = rfn; self._apply()
-    def _apply(self):
-        act = {c: le.text().strip().lower() for c, le in self.filters.items() if le.text().strip()}
-        self._filt = [r for r in self._all if all(t in str(r.get(c,"")).lower() for c,t in act.items())] if act else list(self._all)
-        self.table.setSortingEnabled(False); self.table.setRowCount(len(self._filt))
-        for ri, rd in enumerate(self._filt):
-            for ci, cn in enumerate(self.columns):
-                it = self._rfn(rd, cn) if self._rfn else QTableWidgetItem(str(rd.get(cn,"")))
-                if it: self.table.setItem(ri, ci, it)
-        self.table.setSortingEnabled(True)
-        # Auto-resize colonne dinamiche al contenuto
+    def set_data(self, data, rfn=None):
+        self._all = data
+        self._keys = {c: [str(r.get(c,"")).lower() for r in data] for c in self.columns}
+        self._last_act = None; self._last_accepted = None
+        self.model.set_rows(data, rfn); self._apply()
+        # Auto-resize colonne dinamiche al contenuto (solo righe visibili)
         for ci in self._dynamic_cols:
             if 0 <= ci < len(self.columns):
                 self.table.resizeColumnToContents(ci)
+    def _apply(self):
+        self._filter_timer.stop()
+        act = {c: le.text().strip().lower() for c, le in self.filters.items() if le.text().strip()}
+        if act == self._last_act: return
+        # Se ogni testo del filtro precedente è contenuto nel nuovo, le righe ammesse sono un
+        # sottoinsieme delle precedenti: si riparte da quelle invece che da tutte
+        narrowing = self._last_accepted is not None and all(t in act.get(c, "") for c, t in self._last_act.items())
+        accepted = None
+        if act:
+            cand = self._last_accepted if narrowing else range(len(self._all))
+            for c, t in act.items():
+                if narrowing and self._last_act.get(c) == t: continue
+                keys = self._keys[c]; cand = [i for i in cand if t in keys[i]]
+            accepted = set(cand)
+        self._last_act = act; self._last_accepted = accepted
+        self.proxy.set_accepted(accepted)
+    def update_column(self, col, values, key="_full_did", key_col="DeviceID"):
+        """Aggiorna in place la colonna `col` per le righe con row[key] in values, senza ricostruire
+        la tabella: solo le celle cambiate vengono invalidate e ridisegnate."""
+        if not values or col not in self.columns or key_col not in self.columns: return
+        changed = []
+        for ri, rd in enumerate(self._all):
+            k = rd.get(key)
+            if k in values: rd[col] = values[k]; changed.append(ri)
+        keys = self._keys.get(col)
+        if keys is not None:
+            for ri in changed: keys[ri] = str(self._all[ri].get(col,"")).lower()
+        self.model.refresh_cells(changed, self.columns.index(col))
+        if self._last_act and col in self._last_act:   # il filtro su col va ricalcolato da capo
+            self._last_act = None; self._last_accepted = None; self._apply()
     def get_selected_rows_data(self):
-        rows = sorted(set(idx.row() for idx in self.table.selectedIndexes()))
-        return [self._filt[r] for r in rows if r < len(self._filt)]
+        rows = sorted(set(self.proxy.mapToSource(idx).row() for idx in self.table.selectionModel().selectedRows()))
+        return [self._all[r] for r in rows if 0 <= r < len(self._all)]
+
+
+def avail_legend():
+    """Legenda dei 4 stati di availability (riga orizzontale)."""
+    leg = QHBoxLayout(); leg.setSpacing(4)
+    for lbl, clr in [("Disp. Completa","#2E7D32"),("Buona Disp.","#66BB6A"),("Disp. Limitata","#F9A825"),("No Data","#C62828")]:
+        sq = QLabel(""); sq.setFixedSize(10,10); sq.setStyleSheet(f"background:{clr};border-radius:1px;"); leg.addWidget(sq); leg.addWidget(QLabel(f"<small>{lbl}</small>")); leg.addSpacing(6)
+    leg.addStretch()
+    return leg
+
+
+class FleetHeatmap(QWidget):
+    """Heatmap availability di tutta la flotta: una riga per device, una colonna per giorno.
+    La matrice uint8 dei codici (AV_CODES, 0 = nessun dato) diventa una QImage 1 pixel per cella
+    passando da una LUT di colori; paintEvent ridisegna solo la parte esposta, scalata dello zoom
+    (pixel per cella). Doppio click su una riga: device_activated(device_id)."""
+    ZOOMS = (1, 2, 3, 4, 6, 8, 12, 16)
+    AXIS_H = 16
+    LUT = np.array([QColor("#EEEEEE").rgb()] + [QColor(avail_color(str(c))).rgb() for c in range(1, 5)], dtype=np.uint32)
+    device_activated = pyqtSignal(str)
+    zoom_changed = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent); self.zoom = 2
+        self._ids = []; self._first = None; self._matrix = None; self._img = None; self._buf = None; self._bounds = []
+
+    def set_data(self, ids, first_day, matrix, groups=None):
+        """ids e righe di matrix nello stesso ordine; groups (chiave per riga) disegna un separatore
+        dove la chiave cambia."""
+        self._ids = ids; self._first = first_day; self._matrix = matrix
+        self._bounds = [i for i in range(1, len(ids)) if groups[i] != groups[i-1]] if groups else []
+        h, w = matrix.shape
+        self._buf = np.ascontiguousarray(self.LUT[matrix]) if w else None   # tenuto vivo: la QImage non copia i dati
+        self._img = QImage(self._buf.data, w, h, w * 4, QImage.Format_RGB32) if w and h else None
+        self._resize(); self.update()
+
+    def set_zoom(self, z):
+        z = min(self.ZOOMS, key=lambda v: abs(v - z))
+        if z != self.zoom:
+            self.zoom = z; self._resize(); self.update(); self.zoom_changed.emit(z)
+
+    def zoom_in(self): self.set_zoom(self.ZOOMS[min(self.ZOOMS.index(self.zoom) + 1, len(self.ZOOMS) - 1)])
+    def zoom_out(self): self.set_zoom(self.ZOOMS[max(self.ZOOMS.index(self.zoom) - 1, 0)])
+
+    def _resize(self):
+        h, w = self._matrix.shape if self._matrix is not None else (0, 0)
+        self.setFixedSize(max(w * self.zoom, 1), self.AXIS_H + h * self.zoom)
+
+    def paintEvent(self, ev):
+        p = QPainter(self); r = ev.rect(); z = self.zoom
+        if self._img is None: return
+        h, w = self._matrix.shape
+        # Asse: un tick per mese, etichetta se c'è spazio
+        small = QFont(self.font()); small.setPixelSize(10); p.setFont(small); p.setPen(QColor("#666"))
+        if r.top() < self.AXIS_H:
+            o0 = self._first.toordinal(); last_x = -100
+            for i in range(w):
+                d = date.fromordinal(o0 + i)
+                if d.day != 1 and i: continue
+                x = i * z; p.drawLine(x, self.AXIS_H - 4, x, self.AXIS_H - 1)
+                if x - last_x >= 44:
+                    p.drawText(QRect(x + 2, 0, 60, self.AXIS_H - 2), Qt.AlignLeft | Qt.AlignVCenter, f"{_CalendarGrid.MONTH_ABBR[d.month-1]} {d.year % 100:02d}"); last_x = x
+        # Celle: solo la porzione esposta dell'immagine
+        x0 = max(r.left() // z, 0); x1 = min(r.right() // z + 1, w)
+        y0 = max((r.top() - self.AXIS_H) // z, 0); y1 = min((r.bottom() - self.AXIS_H) // z + 1, h)
+        if x1 > x0 and y1 > y0:
+            p.drawImage(QRect(x0 * z, self.AXIS_H + y0 * z, (x1 - x0) * z, (y1 - y0) * z), self._img, QRect(x0, y0, x1 - x0, y1 - y0))
+        p.setPen(QColor("#424242"))
+        for b in self._bounds:
+            if y0 <= b <= y1: y = self.AXIS_H + b * z; p.drawLine(r.left(), y, r.right(), y)
+
+    def _cell_at(self, pos):
+        """(riga, giorno) sotto pos, None fuori dalla griglia."""
+        if self._matrix is None or pos.y() < self.AXIS_H: return None
+        row = (pos.y() - self.AXIS_H) // self.zoom; col = pos.x() // self.zoom
+        h, w = self._matrix.shape
+        return (row, col) if 0 <= row < h and 0 <= col < w else None
+
+    def event(self, ev):
+        if ev.type() == QEvent.ToolTip:
+            cell = self._cell_at(ev.pos())
+            if cell:
+                row, col = cell; code = int(self._matrix[row, col])
+                d = date.fromordinal(self._first.toordinal() + col)
+                QToolTip.showText(ev.globalPos(), f"{self._ids[row]}\n{d.strftime('%d/%m/%Y')}: {AV_STATUS_NUMERIC.get(code, 'nessun dato')}", self)
+            else:
+                QToolTip.hideText(); ev.ignore()
+            return True
+        return super().event(ev)
+
+    def mouseDoubleClickEvent(self, ev):
+        cell = self._cell_at(ev.pos())
+        if cell: self.device_activated.emit(self._ids[cell[0]])
+
+    def wheelEvent(self, ev):
+        if ev.modifiers() & Qt.ControlModifier:
+            self.zoom_in() if ev.angleDelta().y() > 0 else self.zoom_out(); ev.accept()
+        else:
+            super().wheelEvent(ev)
+
+
+class _CalendarGrid(QWidget):
+    """Griglia di AvailabilityCalendar dipinta in paintEvent (nessun widget per cella).
+    Vista mese: 7 colonne × 6 settimane. Vista heatmap: tutto lo storico, un blocco per anno
+    (anno, mesi, poi una colonna per settimana e una riga per giorno); click su una cella apre quel mese."""
+    CELL_W, CELL_H, GAP, HDR_H = 46, 34, 3, 20       # vista mese
+    HM_CELL, HM_GAP, HM_LEFT, HM_YEAR_H = 11, 2, 18, 16   # heatmap
+    DAY_NAMES = ["L", "M", "M", "G", "V", "S", "D"]
+    MONTH_ABBR = ["gen", "feb", "mar", "apr", "mag", "giu", "lug", "ago", "set", "ott", "nov", "dic"]
+
+    def __init__(self, cal):
+        super().__init__(cal); self._cal = cal; self.heatmap = False
+        self._cells = []    # [(QRect, data, stato)] della vista corrente, per paint e tooltip
+        self._labels = []   # [(QRect, testo, allineamento)]
+        self._colors = {}   # stato -> QColor
+        self._size = QSize(0, 0)
+
+    def _color(self, status):
+        c = self._colors.get(status)
+        if c is None: c = self._colors[status] = QColor(avail_color(status))
+        return c
+
+    def relayout(self):
+        """Ricalcola celle ed etichette della vista corrente (month/heatmap) e ridisegna."""
+        self._cells = []; self._labels = []
+        if self.heatmap: self._layout_heatmap()
+        else: self._layout_month()
+        self.setFixedSize(self._size); self.update()
+
+    def _layout_month(self):
+        y, m = self._cal._cur
+        w, h, g = self.CELL_W, self.CELL_H, self.GAP
+        for ci, dn in enumerate(self.DAY_NAMES):
+            self._labels.append((QRect(ci*(w+g), 0, w, self.HDR_H), dn, Qt.AlignCenter))
+        for ri, week in enumerate(calendar.monthcalendar(y, m)):
+            for ci, day in enumerate(week):
+                if day == 0: continue
+                d = date(y, m, day)
+                self._cells.append((QRect(ci*(w+g), self.HDR_H + g + ri*(h+g), w, h), d, self._cal._map.get(d)))
+        self._size = QSize(7*w + 6*g, self.HDR_H + g + 6*(h+g))
+
+    def _layout_heatmap(self):
+        cmap = self._cal._map
+        if not cmap: self._size = QSize(0, 0); return
+        first, last = min(cmap), max(cmap)
+        step = self.HM_CELL + self.HM_GAP; grid_top = 2*self.HM_YEAR_H; block_h = grid_top + 7*step + 6
+        top = 0; width = 0
+        for year in range(first.year, last.year + 1):
+            jan1 = date(year, 1, 1); origin = jan1.toordinal() - jan1.weekday()   # lunedì della prima settimana
+            self._labels.append((QRect(0, top, 60, self.HM_YEAR_H), str(year), Qt.AlignLeft | Qt.AlignVCenter))
+            for ri in (0, 2, 4):
+                self._labels.append((QRect(0, top + grid_top + ri*step, self.HM_LEFT - 4, self.HM_CELL), self.DAY_NAMES[ri], Qt.AlignRight | Qt.AlignVCenter))
+            d0 = max(first, jan1); d1 = min(last, date(year, 12, 31)); last_lbl = -100
+            for o in range(d0.toordinal(), d1.toordinal() + 1):
+                d = date.fromordinal(o); col = (o - origin) // 7
+                x = self.HM_LEFT + col*step
+                self._cells.append((QRect(x, top + grid_top + d.weekday()*step, self.HM_CELL, self.HM_CELL), d, cmap.get(d)))
+                if (d.day == 1 or o == d0.toordinal()) and x - last_lbl >= 3*step:
+                    last_lbl = x; self._labels.append((QRect(x, top + self.HM_YEAR_H, 40, self.HM_YEAR_H), self.MONTH_ABBR[d.month-1], Qt.AlignLeft | Qt.AlignVCenter))
+                width = max(width, x + self.HM_CELL)
+            top += block_h
+        self._size = QSize(width, top)
+
+    def sizeHint(self): return self._size
+
+    def paintEvent(self, ev):
+        p = QPainter(self); p.setRenderHint(QPainter.Antialiasing)
+        small = QFont(self.font()); small.setPixelSize(10 if self.heatmap else 11); small.setBold(not self.heatmap)
+        p.setFont(small); p.setPen(QColor("#666"))
+        for rect, text, align in self._labels:
+            p.drawText(rect, align, text)
+        if self.heatmap:
+            p.setPen(Qt.NoPen); empty = QColor("#EEEEEE")
+            for rect, d, status in self._cells:
+                if rect.intersects(ev.rect()):
+                    p.setBrush(self._color(status) if status else empty); p.drawRoundedRect(rect, 2, 2)
+            return
+        f = QFont(self.font()); f.setPixelSize(13); bold = QFont(f); bold.setBold(True)
+        white = QColor("white"); grey = QColor("#BBB")
+        for rect, d, status in self._cells:
+            if status:
+                p.setPen(Qt.NoPen); p.setBrush(self._color(status)); p.drawRoundedRect(rect, 5, 5)
+                p.setFont(bold); p.setPen(white)
+            else:
+                p.setFont(f); p.setPen(grey)
+            p.drawText(rect, Qt.AlignCenter, str(d.day))
+
+    def _cell_at(self, pos):
+        for rect, d, status in self._cells:
+            if rect.contains(pos): return d, status
+        return None, None
+
+    def event(self, ev):
+        if ev.type() == QEvent.ToolTip:
+            d, status = self._cell_at(ev.pos())
+            if status: QToolTip.showText(ev.globalPos(), f"{d.strftime('%d/%m/%Y')}: {status}", self)
+            else: QToolTip.hideText(); ev.ignore()
+            return True
+        return super().event(ev)
+
+    def mousePressEvent(self, ev):
+        d, _ = self._cell_at(ev.pos())
+        if self.heatmap and d is not None:
+            self._cal.show_month(d.year, d.month)
+        super().mousePressEvent(ev)
 
 
 class AvailabilityCalendar(QWidget):
-    """Vista calendario per Availability daily. Mostra un mese alla volta con frecce di navigazione.
-    Le celle dei giorni sono colorate in base allo stato di availability."""
+    """Vista calendario per Availability daily. Mostra un mese alla volta con frecce di navigazione,
+    oppure (pulsante Heatmap) tutto lo storico in una heatmap settimane × giorni.
+    Le celle sono colorate in base allo stato di availability e dipinte da _CalendarGrid:
+    cambiare mese aggiorna solo lo stato e ridisegna."""
     IT_MONTHS = ["gennaio","febbraio","marzo","aprile","maggio","giugno",
                  "luglio","agosto","settembre","ottobre","novembre","dicembre"]
 
@@ -255,21 +587,23 @@ class AvailabilityCalendar(QWidget):
         self.prev_btn = QPushButton("◀"); self.prev_btn.setObjectName("secondary"); self.prev_btn.setFixedSize(32,26); self.prev_btn.clicked.connect(self._prev_month)
         self.next_btn = QPushButton("▶"); self.next_btn.setObjectName("secondary"); self.next_btn.setFixedSize(32,26); self.next_btn.clicked.connect(self._next_month)
         self.lbl = QLabel(""); self.lbl.setAlignment(Qt.AlignCenter); self.lbl.setStyleSheet("font-weight:bold;font-size:14px;color:#0066CC;")
-        hdr.addWidget(self.prev_btn); hdr.addWidget(self.lbl, stretch=1); hdr.addWidget(self.next_btn)
+        self.hm_btn = QPushButton("Heatmap"); self.hm_btn.setObjectName("secondary"); self.hm_btn.setCheckable(True); self.hm_btn.setFixedHeight(26); self.hm_btn.toggled.connect(self._set_heatmap)
+        hdr.addWidget(self.prev_btn); hdr.addWidget(self.lbl, stretch=1); hdr.addWidget(self.next_btn); hdr.addWidget(self.hm_btn)
         lo.addLayout(hdr)
-        self.grid = QGridLayout(); self.grid.setSpacing(3); self.grid.setContentsMargins(0,0,0,0)
-        for ci, dn in enumerate(["L","M","M","G","V","S","D"]):
-            h = QLabel(dn); h.setAlignment(Qt.AlignCenter); h.setStyleSheet("font-weight:bold;color:#666;font-size:11px;padding:2px 0;")
-            self.grid.addWidget(h, 0, ci)
-        gw = QWidget(); gw.setLayout(self.grid); lo.addWidget(gw)
-        # Legenda
-        leg = QHBoxLayout(); leg.setSpacing(4)
-        for lbl, clr in [("Disp. Completa","#2E7D32"),("Buona Disp.","#66BB6A"),("Disp. Limitata","#F9A825"),("No Data","#C62828")]:
-            sq = QLabel(""); sq.setFixedSize(10,10); sq.setStyleSheet(f"background:{clr};border-radius:1px;"); leg.addWidget(sq); leg.addWidget(QLabel(f"<small>{lbl}</small>")); leg.addSpacing(6)
-        leg.addStretch(); lo.addLayout(leg)
+        self.grid = _CalendarGrid(self); lo.addWidget(self.grid, alignment=Qt.AlignLeft)
+        lo.addLayout(avail_legend())
 
     def _set_month(self, y, m): self._cur = (y, m); self._render()
 
+    def show_month(self, y, m):
+        """Torna alla vista mese su (y, m), ad es. dal click su una cella della heatmap."""
+        self._cur = (y, m)
+        if self.hm_btn.isChecked(): self.hm_btn.setChecked(False)
+        else: self._render()
+
+    def _set_heatmap(self, on):
+        self.grid.heatmap = on; self._render()
+
     def _prev_month(self):
         y, m = self._cur
         if m == 1: y, m = y-1, 12
@@ -283,33 +617,17 @@ class AvailabilityCalendar(QWidget):
         self._set_month(y, m)
 
     def _render(self):
-        import calendar
         y, m = self._cur
-        self.lbl.setText(f"{self.IT_MONTHS[m-1]} {y}")
-        self.prev_btn.setEnabled(self._cur > self._min_month)
-        self.next_btn.setEnabled(self._cur < self._max_month)
-        # Pulisci righe giorni (1..6)
-        for r in range(1, 7):
-            for c in range(7):
-                it = self.grid.itemAtPosition(r, c)
-                if it:
-                    w = it.widget()
-                    if w:
-                        self.grid.removeWidget(w); w.deleteLater()
-        cal = calendar.monthcalendar(y, m)
-        for ri, week in enumerate(cal, start=1):
-            for ci, day in enumerate(week):
-                if day == 0: continue
-                d = date(y, m, day)
-                status = self._map.get(d)
-                cell = QLabel(str(day)); cell.setAlignment(Qt.AlignCenter); cell.setFixedSize(46, 34)
-                if status:
-                    color = avail_color(status)
-                    cell.setStyleSheet(f"background:{color};color:white;font-weight:bold;border-radius:5px;font-size:13px;")
-                    cell.setToolTip(f"{d.strftime('%d/%m/%Y')}: {status}")
-                else:
-                    cell.setStyleSheet("color:#BBB;font-size:13px;")
-                self.grid.addWidget(cell, ri, ci)
+        hm = self.grid.heatmap
+        self.prev_btn.setVisible(not hm); self.next_btn.setVisible(not hm)
+        if hm:
+            (y0, m0), (y1, m1) = self._min_month, self._max_month
+            self.lbl.setText(f"{self.IT_MONTHS[m0-1]} {y0} – {self.IT_MONTHS[m1-1]} {y1}")
+        else:
+            self.lbl.setText(f"{self.IT_MONTHS[m-1]} {y}")
+            self.prev_btn.setEnabled(self._cur > self._min_month)
+            self.next_btn.setEnabled(self._cur < self._max_month)
+        self.grid.relayout()
 
 
 class JiraFromListDialog(QDialog):
@@ -552,118 +870,115 @@ class JiraTicketDialog(QDialog):
 class DeviceDetailDialog(QDialog):
     def __init__(self, device_id, parent=None):
         super().__init__(parent); self.setWindowTitle(f"Dettaglio: {device_id}"); self.setMinimumSize(780, 720); self.setStyleSheet(STYLE)
-        session = get_session()
-        try:
-            device = session.get(Device, device_id)
-            if not device: QMessageBox.warning(self, "Errore", f"Device {device_id} non trovato"); return
-            layout = QVBoxLayout(self)
-            top = QHBoxLayout()
-            tl = QLabel(device_id); tl.setStyleSheet("font-size:16px;font-weight:bold;color:#0066CC;"); tl.setTextInteractionFlags(Qt.TextSelectableByMouse); top.addWidget(tl)
-            hl = QLabel(device.current_health or "?"); hbg = HEALTH_BG.get(device.current_health,"#F5F5F5")
-            hl.setStyleSheet(f"background:{hbg};padding:4px 12px;border-radius:3px;font-weight:bold;"); top.addWidget(hl)
-            if device.is_sotto_corona:
-                sc = QLabel("SOTTO CORONA"); sc.setStyleSheet("background:#E3F2FD;color:#1565C0;padding:4px 8px;border-radius:3px;font-weight:bold;"); top.addWidget(sc)
-            top.addStretch()
-            self._fs_btn = QPushButton("⛶ Fullscreen"); self._fs_btn.setObjectName("secondary"); self._fs_btn.clicked.connect(self._toggle_fullscreen); top.addWidget(self._fs_btn)
-            cpb = QPushButton("Copia Info"); cpb.setObjectName("secondary"); cpb.clicked.connect(lambda: self._copy_info(device, session)); top.addWidget(cpb)
-            jb = QPushButton("Ticket Jira"); jb.setObjectName("jira"); jb.clicked.connect(lambda: self._open_jira(device)); top.addWidget(jb)
-            layout.addLayout(top)
-            scroll = QScrollArea(); scroll.setWidgetResizable(True); content = QWidget(); cl = QVBoxLayout(content)
-            grid = QGridLayout(); grid.setSpacing(4); r = 0
-            for lbl, val in [("DeviceID",device.device_id),("Linea",device.linea),("Sostegno",device.st_sostegno),("Fornitore",device.fornitore),("Tipo",device.sistema_digil),("DT",device.dt),("Denominazione",device.denominazione),("Regione",f"{device.regione or ''} / {device.provincia or ''}"),("IP",device.ip_address),("Installazione",str(device.data_install) if device.data_install else "-"),("Tipo Install.",device.tipo_install),("Da file master",device.da_file_master)]:
+        # Snapshot caricato in un colpo solo e tenuto dal dialog (anche per "Copia Info")
+        device = self.device = read_model.device_detail(device_id)
+        if not device: QMessageBox.warning(self, "Errore", f"Device {device_id} non trovato"); return
+        layout = QVBoxLayout(self)
+        top = QHBoxLayout()
+        tl = QLabel(device_id); tl.setStyleSheet("font-size:16px;font-weight:bold;color:#0066CC;"); tl.setTextInteractionFlags(Qt.TextSelectableByMouse); top.addWidget(tl)
+        hl = QLabel(device.current_health or "?"); hbg = HEALTH_BG.get(device.current_health,"#F5F5F5")
+        hl.setStyleSheet(f"background:{hbg};padding:4px 12px;border-radius:3px;font-weight:bold;"); top.addWidget(hl)
+        if device.is_sotto_corona:
+            sc = QLabel("SOTTO CORONA"); sc.setStyleSheet("background:#E3F2FD;color:#1565C0;padding:4px 8px;border-radius:3px;font-weight:bold;"); top.addWidget(sc)
+        top.addStretch()
+        self._fs_btn = QPushButton("⛶ Fullscreen"); self._fs_btn.setObjectName("secondary"); self._fs_btn.clicked.connect(self._toggle_fullscreen); top.addWidget(self._fs_btn)
+        cpb = QPushButton("Copia Info"); cpb.setObjectName("secondary"); cpb.clicked.connect(self._copy_info); top.addWidget(cpb)
+        jb = QPushButton("Ticket Jira"); jb.setObjectName("jira"); jb.clicked.connect(lambda: self._open_jira(device)); top.addWidget(jb)
+        layout.addLayout(top)
+        scroll = QScrollArea(); scroll.setWidgetResizable(True); content = QWidget(); cl = QVBoxLayout(content)
+        grid = QGridLayout(); grid.setSpacing(4); r = 0
+        for lbl, val in [("DeviceID",device.device_id),("Linea",device.linea),("Sostegno",device.st_sostegno),("Fornitore",device.fornitore),("Tipo",device.sistema_digil),("DT",device.dt),("Denominazione",device.denominazione),("Regione",f"{device.regione or ''} / {device.provincia or ''}"),("IP",device.ip_address),("Installazione",str(device.data_install) if device.data_install else "-"),("Tipo Install.",device.tipo_install),("Da file master",device.da_file_master)]:
+            if val:
+                lb = QLabel(f"<b style='color:#666'>{lbl}:</b>"); lb.setTextInteractionFlags(Qt.TextSelectableByMouse)
+                vl = QLabel(str(val)); vl.setTextInteractionFlags(Qt.TextSelectableByMouse); grid.addWidget(lb, r, 0); grid.addWidget(vl, r, 1); r += 1
+        ga = QGroupBox("Anagrafica"); ga.setLayout(grid); cl.addWidget(ga)
+        dl = QHBoxLayout()
+        for name, val in [("Mongo",device.check_mongo),("Batteria",device.batteria),("Porta",device.porta_aperta)]:
+            bx = QLabel(f"<center><small>{name}</small><br><b>{val or '-'}</b></center>")
+            bg = "#E8F5E9" if val=="OK" else "#FFEBEE" if val=="KO" else "#F5F5F5"
+            bx.setStyleSheet(f"background:{bg};border:1px solid #CCC;border-radius:4px;padding:6px;min-width:60px;"); dl.addWidget(bx)
+        dl.addWidget(QLabel(f"<b>Trend 7d:</b> {trend_str(device.trend_7d)}")); dl.addWidget(QLabel(f"<b>Giorni:</b> {device.days_in_current}")); dl.addStretch()
+        gd = QGroupBox("Diagnostica"); gd.setLayout(dl); cl.addWidget(gd)
+        # Onesait vs MongoDB date comparison
+        if device.data_onesait or device.data_mongo:
+            pl = QHBoxLayout()
+            one_str = str(device.data_onesait) if device.data_onesait and device.data_onesait.year >= 2020 else "-"
+            mongo_str = str(device.data_mongo) if device.data_mongo and device.data_mongo.year >= 2020 else "-"
+            # Colora in rosso se Onesait > MongoDB (pipeline bloccata)
+            pipeline_ko = (device.data_onesait and device.data_mongo and
+                          device.data_onesait.year >= 2020 and device.data_mongo.year >= 2020 and
+                          device.data_onesait > device.data_mongo)
+            obg = "#FFEBEE" if pipeline_ko else "#E8F5E9" if one_str != "-" else "#F5F5F5"
+            mbg = "#FFEBEE" if pipeline_ko else "#E8F5E9" if mongo_str != "-" else "#F5F5F5"
+            pl.addWidget(QLabel(f"<center><small>Onesait</small><br><b>{one_str}</b></center>").setStyleSheet(f"background:{obg};border:1px solid #CCC;border-radius:4px;padding:6px;min-width:80px;") or QLabel(f"<center><small>Onesait</small><br><b>{one_str}</b></center>"))
+            pl.addWidget(QLabel(f"<center><small>MongoDB</small><br><b>{mongo_str}</b></center>").setStyleSheet(f"background:{mbg};border:1px solid #CCC;border-radius:4px;padding:6px;min-width:80px;") or QLabel(f"<center><small>MongoDB</small><br><b>{mongo_str}</b></center>"))
+            if pipeline_ko:
+                delta = (device.data_onesait - device.data_mongo).days
+                wl = QLabel(f"<b style='color:#C62828'>⚠ Pipeline bloccata ({delta}gg)</b>")
+                pl.addWidget(wl)
+            pl.addStretch()
+            gpl = QGroupBox("Pipeline Dati"); gpl.setLayout(pl); cl.addWidget(gpl)
+        if device.last_avail_status:
+            av_bg = avail_color(device.last_avail_status)
+            cl.addWidget(QLabel(f"<b>Ultimo availability:</b> {device.last_avail_status} ({device.last_avail_date})").setStyleSheet(f"padding:4px 8px;border-left:4px solid {av_bg};background:#FAFAFA;") or QLabel(f"<b>Ultimo availability:</b> {device.last_avail_status} ({device.last_avail_date})"))
+        if device.misure_mancanti:
+            mm_box = QVBoxLayout()
+            metrics = [m.strip() for m in device.misure_mancanti.split(",") if m.strip()]
+            top_line = QLabel(f"<b>{len(metrics)} metriche non in arrivo</b>")
+            mm_box.addWidget(top_line)
+            chips = QLabel("  ".join(f"<span style='background:#FFF3E0;color:#E65100;padding:2px 6px;border-radius:3px;'>{m}</span>" for m in metrics))
+            chips.setWordWrap(True); chips.setTextInteractionFlags(Qt.TextSelectableByMouse)
+            mm_box.addWidget(chips)
+            if device.last_complete_date and device.last_complete_date.year >= 2020:
+                days = (date.today() - device.last_complete_date).days
+                mm_box.addWidget(QLabel(f"<small>Ultima DISPONIBILITÀ COMPLETA: <b>{device.last_complete_date}</b> ({days} giorni fa)</small>"))
+            gmm = QGroupBox("Metriche Mancanti"); gmm.setLayout(mm_box); cl.addWidget(gmm)
+        malf = [("Tipo",device.tipo_malfunzionamento),("Cluster",device.cluster_analisi),("Analisi",device.analisi_malfunzionamento),("Intervento",device.tipologia_intervento),("Strategia",device.strategia_risolutiva),("Cause",device.cause_anomalie),("Risoluzione",device.risoluzione_attuata),("Note",device.note)]
+        if any(v for _,v in malf):
+            mg = QGridLayout(); mg.setSpacing(4); mr = 0
+            for lbl, val in malf:
                 if val:
-                    lb = QLabel(f"<b style='color:#666'>{lbl}:</b>"); lb.setTextInteractionFlags(Qt.TextSelectableByMouse)
-                    vl = QLabel(str(val)); vl.setTextInteractionFlags(Qt.TextSelectableByMouse); grid.addWidget(lb, r, 0); grid.addWidget(vl, r, 1); r += 1
-            ga = QGroupBox("Anagrafica"); ga.setLayout(grid); cl.addWidget(ga)
-            dl = QHBoxLayout()
-            for name, val in [("Mongo",device.check_mongo),("Batteria",device.batteria),("Porta",device.porta_aperta)]:
-                bx = QLabel(f"<center><small>{name}</small><br><b>{val or '-'}</b></center>")
-                bg = "#E8F5E9" if val=="OK" else "#FFEBEE" if val=="KO" else "#F5F5F5"
-                bx.setStyleSheet(f"background:{bg};border:1px solid #CCC;border-radius:4px;padding:6px;min-width:60px;"); dl.addWidget(bx)
-            dl.addWidget(QLabel(f"<b>Trend 7d:</b> {trend_str(device.trend_7d)}")); dl.addWidget(QLabel(f"<b>Giorni:</b> {device.days_in_current}")); dl.addStretch()
-            gd = QGroupBox("Diagnostica"); gd.setLayout(dl); cl.addWidget(gd)
-            # Onesait vs MongoDB date comparison
-            if device.data_onesait or device.data_mongo:
-                pl = QHBoxLayout()
-                one_str = str(device.data_onesait) if device.data_onesait and device.data_onesait.year >= 2020 else "-"
-                mongo_str = str(device.data_mongo) if device.data_mongo and device.data_mongo.year >= 2020 else "-"
-                # Colora in rosso se Onesait > MongoDB (pipeline bloccata)
-                pipeline_ko = (device.data_onesait and device.data_mongo and
-                              device.data_onesait.year >= 2020 and device.data_mongo.year >= 2020 and
-                              device.data_onesait > device.data_mongo)
-                obg = "#FFEBEE" if pipeline_ko else "#E8F5E9" if one_str != "-" else "#F5F5F5"
-                mbg = "#FFEBEE" if pipeline_ko else "#E8F5E9" if mongo_str != "-" else "#F5F5F5"
-                pl.addWidget(QLabel(f"<center><small>Onesait</small><br><b>{one_str}</b></center>").setStyleSheet(f"background:{obg};border:1px solid #CCC;border-radius:4px;padding:6px;min-width:80px;") or QLabel(f"<center><small>Onesait</small><br><b>{one_str}</b></center>"))
-                pl.addWidget(QLabel(f"<center><small>MongoDB</small><br><b>{mongo_str}</b></center>").setStyleSheet(f"background:{mbg};border:1px solid #CCC;border-radius:4px;padding:6px;min-width:80px;") or QLabel(f"<center><small>MongoDB</small><br><b>{mongo_str}</b></center>"))
-                if pipeline_ko:
-                    delta = (device.data_onesait - device.data_mongo).days
-                    wl = QLabel(f"<b style='color:#C62828'>⚠ Pipeline bloccata ({delta}gg)</b>")
-                    pl.addWidget(wl)
-                pl.addStretch()
-                gpl = QGroupBox("Pipeline Dati"); gpl.setLayout(pl); cl.addWidget(gpl)
-            if device.last_avail_status:
-                av_bg = avail_color(device.last_avail_status)
-                cl.addWidget(QLabel(f"<b>Ultimo availability:</b> {device.last_avail_status} ({device.last_avail_date})").setStyleSheet(f"padding:4px 8px;border-left:4px solid {av_bg};background:#FAFAFA;") or QLabel(f"<b>Ultimo availability:</b> {device.last_avail_status} ({device.last_avail_date})"))
-            if device.misure_mancanti:
-                mm_box = QVBoxLayout()
-                metrics = [m.strip() for m in device.misure_mancanti.split(",") if m.strip()]
-                top_line = QLabel(f"<b>{len(metrics)} metriche non in arrivo</b>")
-                mm_box.addWidget(top_line)
-                chips = QLabel("  ".join(f"<span style='background:#FFF3E0;color:#E65100;padding:2px 6px;border-radius:3px;'>{m}</span>" for m in metrics))
-                chips.setWordWrap(True); chips.setTextInteractionFlags(Qt.TextSelectableByMouse)
-                mm_box.addWidget(chips)
-                if device.last_complete_date and device.last_complete_date.year >= 2020:
-                    days = (date.today() - device.last_complete_date).days
-                    mm_box.addWidget(QLabel(f"<small>Ultima DISPONIBILITÀ COMPLETA: <b>{device.last_complete_date}</b> ({days} giorni fa)</small>"))
-                gmm = QGroupBox("Metriche Mancanti"); gmm.setLayout(mm_box); cl.addWidget(gmm)
-            malf = [("Tipo",device.tipo_malfunzionamento),("Cluster",device.cluster_analisi),("Analisi",device.analisi_malfunzionamento),("Intervento",device.tipologia_intervento),("Strategia",device.strategia_risolutiva),("Cause",device.cause_anomalie),("Risoluzione",device.risoluzione_attuata),("Note",device.note)]
-            if any(v for _,v in malf):
-                mg = QGridLayout(); mg.setSpacing(4); mr = 0
-                for lbl, val in malf:
-                    if val:
-                        mg.addWidget(QLabel(f"<b style='color:#666'>{lbl}:</b>"), mr, 0, Qt.AlignTop)
-                        vl = QLabel(str(val)); vl.setWordWrap(True); vl.setTextInteractionFlags(Qt.TextSelectableByMouse); mg.addWidget(vl, mr, 1); mr += 1
-                gm = QGroupBox("Malfunzionamento"); gm.setLayout(mg); cl.addWidget(gm)
-            if device.ticket_id:
-                tgl = QGridLayout()
-                tgl.addWidget(QLabel("<b style='color:#666'>ID:</b>"), 0, 0); tid = QLabel(f"<b>{device.ticket_id}</b>"); tid.setTextInteractionFlags(Qt.TextSelectableByMouse); tgl.addWidget(tid, 0, 1)
-                tgl.addWidget(QLabel("<b style='color:#666'>Stato:</b>"), 1, 0)
-                sbg = "#FFEBEE" if device.ticket_stato=="Aperto" else "#E8F5E9" if device.ticket_stato in ("Chiuso","Risolto") else "#FFF3E0"
-                sll = QLabel(device.ticket_stato or "-"); sll.setStyleSheet(f"background:{sbg};padding:2px 8px;border-radius:3px;"); tgl.addWidget(sll, 1, 1)
-                if device.ticket_data_apertura: tgl.addWidget(QLabel("<b style='color:#666'>Apertura:</b>"), 2, 0); tgl.addWidget(QLabel(str(device.ticket_data_apertura)), 2, 1)
-                if device.ticket_data_risoluzione: tgl.addWidget(QLabel("<b style='color:#666'>Risoluzione:</b>"), 3, 0); tgl.addWidget(QLabel(str(device.ticket_data_risoluzione)), 3, 1)
-                gt = QGroupBox("Ticket Corrente"); gt.setLayout(tgl); cl.addWidget(gt)
-            thist = session.query(TicketHistory).filter(TicketHistory.device_id==device_id).order_by(TicketHistory.first_seen.desc()).all()
-            if thist:
-                ht = QTableWidget(); hc = ["Ticket","Stato","Apertura","Risoluzione","Tipo Malf.","Cluster","Note","Prima volta","Ultima volta"]
-                ht.setColumnCount(9); ht.setHorizontalHeaderLabels(hc); ht.setRowCount(len(thist)); ht.horizontalHeader().setStretchLastSection(True); ht.setAlternatingRowColors(True); ht.setEditTriggers(QAbstractItemView.NoEditTriggers)
-                for i, th in enumerate(thist):
-                    ht.setItem(i,0,QTableWidgetItem(th.ticket_id or "-"))
-                    st = th.ticket_stato or "-"; sb = "#FFEBEE" if st=="Aperto" else "#E8F5E9" if st in ("Chiuso","Risolto") else "#FFF3E0" if st=="Interno" else "#F5F5F5"
-                    ht.setItem(i,1,colored_item(st, sb, bold=True))
-                    ht.setItem(i,2,QTableWidgetItem(str(th.ticket_data_apertura) if th.ticket_data_apertura else "-"))
-                    ht.setItem(i,3,QTableWidgetItem(str(th.ticket_data_risoluzione) if th.ticket_data_risoluzione else "-"))
-                    ht.setItem(i,4,QTableWidgetItem(th.tipo_malfunzionamento or "-")); ht.setItem(i,5,QTableWidgetItem(th.cluster_analisi or "-"))
-                    ht.setItem(i,6,QTableWidgetItem((th.note or "-")[:80]))
-                    ht.setItem(i,7,QTableWidgetItem(th.first_seen.strftime("%Y-%m-%d %H:%M") if th.first_seen else "-"))
-                    ht.setItem(i,8,QTableWidgetItem(th.last_seen.strftime("%Y-%m-%d %H:%M") if th.last_seen else "-"))
-                ht.resizeColumnsToContents(); gh = QGroupBox(f"Storico Ticket ({len(thist)})"); ghl = QVBoxLayout(); ghl.addWidget(ht); gh.setLayout(ghl); cl.addWidget(gh)
-            avail = session.query(AvailabilityDaily).filter(AvailabilityDaily.device_id==device_id).order_by(AvailabilityDaily.check_date).all()
-            if avail:
-                entries = [(a.check_date, a.raw_status) for a in avail]
-                cal = AvailabilityCalendar(entries)
-                tlo = QVBoxLayout(); tlo.addWidget(cal)
-                gtl = QGroupBox(f"Timeline Availability ({len(avail)} giorni)"); gtl.setLayout(tlo); cl.addWidget(gtl)
-            events = session.query(AnomalyEvent).filter(AnomalyEvent.device_id==device_id).order_by(AnomalyEvent.created_at.desc()).limit(10).all()
-            if events:
-                et = QTableWidget(); et.setColumnCount(4); et.setHorizontalHeaderLabels(["Data","Tipo","Severity","Descrizione"]); et.setRowCount(len(events)); et.horizontalHeader().setStretchLastSection(True)
-                for i, e in enumerate(events):
-                    et.setItem(i,0,QTableWidgetItem(str(e.event_date))); et.setItem(i,1,QTableWidgetItem(e.event_type))
-                    et.setItem(i,2,colored_item(e.severity, SEV_BG.get(e.severity), SEV_COLORS.get(e.severity), True)); et.setItem(i,3,QTableWidgetItem(e.description or ""))
-                ge = QGroupBox("Alert Recenti"); el = QVBoxLayout(); el.addWidget(et); ge.setLayout(el); cl.addWidget(ge)
-            cl.addStretch(); scroll.setWidget(content); layout.addWidget(scroll)
-            cb = QPushButton("Chiudi"); cb.clicked.connect(self.close); layout.addWidget(cb, alignment=Qt.AlignRight)
-        finally: session.close()
+                    mg.addWidget(QLabel(f"<b style='color:#666'>{lbl}:</b>"), mr, 0, Qt.AlignTop)
+                    vl = QLabel(str(val)); vl.setWordWrap(True); vl.setTextInteractionFlags(Qt.TextSelectableByMouse); mg.addWidget(vl, mr, 1); mr += 1
+            gm = QGroupBox("Malfunzionamento"); gm.setLayout(mg); cl.addWidget(gm)
+        if device.ticket_id:
+            tgl = QGridLayout()
+            tgl.addWidget(QLabel("<b style='color:#666'>ID:</b>"), 0, 0); tid = QLabel(f"<b>{device.ticket_id}</b>"); tid.setTextInteractionFlags(Qt.TextSelectableByMouse); tgl.addWidget(tid, 0, 1)
+            tgl.addWidget(QLabel("<b style='color:#666'>Stato:</b>"), 1, 0)
+            sbg = "#FFEBEE" if device.ticket_stato=="Aperto" else "#E8F5E9" if device.ticket_stato in ("Chiuso","Risolto") else "#FFF3E0"
+            sll = QLabel(device.ticket_stato or "-"); sll.setStyleSheet(f"background:{sbg};padding:2px 8px;border-radius:3px;"); tgl.addWidget(sll, 1, 1)
+            if device.ticket_data_apertura: tgl.addWidget(QLabel("<b style='color:#666'>Apertura:</b>"), 2, 0); tgl.addWidget(QLabel(str(device.ticket_data_apertura)), 2, 1)
+            if device.ticket_data_risoluzione: tgl.addWidget(QLabel("<b style='color:#666'>Risoluzione:</b>"), 3, 0); tgl.addWidget(QLabel(str(device.ticket_data_risoluzione)), 3, 1)
+            gt = QGroupBox("Ticket Corrente"); gt.setLayout(tgl); cl.addWidget(gt)
+        thist = device.ticket_history
+        if thist:
+            ht = QTableWidget(); hc = ["Ticket","Stato","Apertura","Risoluzione","Tipo Malf.","Cluster","Note","Prima volta","Ultima volta"]
+            ht.setColumnCount(9); ht.setHorizontalHeaderLabels(hc); ht.setRowCount(len(thist)); ht.horizontalHeader().setStretchLastSection(True); ht.setAlternatingRowColors(True); ht.setEditTriggers(QAbstractItemView.NoEditTriggers)
+            for i, th in enumerate(thist):
+                ht.setItem(i,0,QTableWidgetItem(th.ticket_id or "-"))
+                st = th.ticket_stato or "-"; sb = "#FFEBEE" if st=="Aperto" else "#E8F5E9" if st in ("Chiuso","Risolto") else "#FFF3E0" if st=="Interno" else "#F5F5F5"
+                ht.setItem(i,1,colored_item(st, sb, bold=True))
+                ht.setItem(i,2,QTableWidgetItem(str(th.ticket_data_apertura) if th.ticket_data_apertura else "-"))
+                ht.setItem(i,3,QTableWidgetItem(str(th.ticket_data_risoluzione) if th.ticket_data_risoluzione else "-"))
+                ht.setItem(i,4,QTableWidgetItem(th.tipo_malfunzionamento or "-")); ht.setItem(i,5,QTableWidgetItem(th.cluster_analisi or "-"))
+                ht.setItem(i,6,QTableWidgetItem((th.note or "-")[:80]))
+                ht.setItem(i,7,QTableWidgetItem(th.first_seen.strftime("%Y-%m-%d %H:%M") if th.first_seen else "-"))
+                ht.setItem(i,8,QTableWidgetItem(th.last_seen.strftime("%Y-%m-%d %H:%M") if th.last_seen else "-"))
+            ht.resizeColumnsToContents(); gh = QGroupBox(f"Storico Ticket ({len(thist)})"); ghl = QVBoxLayout(); ghl.addWidget(ht); gh.setLayout(ghl); cl.addWidget(gh)
+        avail = device.availability
+        if avail:
+            cal = AvailabilityCalendar(avail)
+            tlo = QVBoxLayout(); tlo.addWidget(cal)
+            gtl = QGroupBox(f"Timeline Availability ({len(avail)} giorni)"); gtl.setLayout(tlo); cl.addWidget(gtl)
+        events = device.events
+        if events:
+            et = QTableWidget(); et.setColumnCount(4); et.setHorizontalHeaderLabels(["Data","Tipo","Severity","Descrizione"]); et.setRowCount(len(events)); et.horizontalHeader().setStretchLastSection(True)
+            for i, e in enumerate(events):
+                et.setItem(i,0,QTableWidgetItem(str(e.event_date))); et.setItem(i,1,QTableWidgetItem(e.event_type))
+                et.setItem(i,2,colored_item(e.severity, SEV_BG.get(e.severity), SEV_COLORS.get(e.severity), True)); et.setItem(i,3,QTableWidgetItem(e.description or ""))
+            ge = QGroupBox("Alert Recenti"); el = QVBoxLayout(); el.addWidget(et); ge.setLayout(el); cl.addWidget(ge)
+        cl.addStretch(); scroll.setWidget(content); layout.addWidget(scroll)
+        cb = QPushButton("Chiudi"); cb.clicked.connect(self.close); layout.addWidget(cb, alignment=Qt.AlignRight)
 
     def _toggle_fullscreen(self):
         if self.isFullScreen():
@@ -678,14 +993,15 @@ class DeviceDetailDialog(QDialog):
             self._toggle_fullscreen(); return
         super().keyPressEvent(ev)
 
-    def _copy_info(self, device, session):
+    def _copy_info(self):
+        device = self.device
         lines = [f"DeviceID: {device.device_id}",f"Fornitore: {device.fornitore}",f"Linea: {device.linea}",f"Sostegno: {device.st_sostegno}",f"DT: {device.dt}",f"Denominazione: {device.denominazione}",f"Regione: {device.regione} / {device.provincia}",f"IP: {device.ip_address}",f"Tipo: {device.sistema_digil}",f"Tipo Install: {device.tipo_install}",f"Sotto Corona: {'Si' if device.is_sotto_corona else 'No'}",f"Data Install: {device.data_install}","","--- Diagnostica ---",f"Mongo: {device.check_mongo}",f"Batteria: {device.batteria}",f"Porta: {device.porta_aperta}",f"Health: {device.current_health}",f"Ultimo Avail: {device.last_avail_status} ({device.last_avail_date})",f"Trend 7d: {trend_str(device.trend_7d)}",f"Giorni: {device.days_in_current}",f"Data Onesait: {device.data_onesait or '-'}",f"Data MongoDB: {device.data_mongo or '-'}"]
         if device.misure_mancanti:
             lines += ["","--- Misure Mancanti ---", f"Metriche: {device.misure_mancanti}"]
             if device.last_complete_date: lines.append(f"Ultima Disp. Completa: {device.last_complete_date}")
         lines += ["","--- Ticket ---",f"Ticket: {device.ticket_id or 'Nessuno'}",f"Stato: {device.ticket_stato or '-'}",f"Apertura: {device.ticket_data_apertura or '-'}",f"Risoluzione: {device.ticket_data_risoluzione or '-'}"]
         if device.tipo_malfunzionamento: lines += ["","--- Malfunzionamento ---",f"Tipo: {device.tipo_malfunzionamento}",f"Cluster: {device.cluster_analisi or '-'}",f"Analisi: {device.analisi_malfunzionamento or '-'}",f"Cause: {device.cause_anomalie or '-'}",f"Note: {device.note or '-'}"]
-        hist = session.query(TicketHistory).filter(TicketHistory.device_id==device.device_id).order_by(TicketHistory.first_seen.desc()).all()
+        hist = device.ticket_history
         if hist:
             lines += ["",f"--- Storico Ticket ({len(hist)}) ---"]
             for h in hist: lines.append(f"  {h.ticket_id} [{h.ticket_stato}] Apt:{h.ticket_data_apertura or '-'} Ris:{h.ticket_data_risoluzione or '-'} Tipo:{h.tipo_malfunzionamento or '-'}")
@@ -767,9 +1083,11 @@ class TicketDetailDialog(QDialog):
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__(); self.import_thread = None; self._alert_no_ticket = False; self._dev_no_ticket = False
-        # Carica cache maintenance da disco (così UI mostra subito ultimo stato noto)
-        self._maint_cache: Dict[str, str] = load_maint_cache()
         self._maint_thread = None
+        # Query delle tabelle in background: al massimo una richiesta viva per tipo (la più recente)
+        self._query_pool = QThreadPool(self); self._query_pool.setMaxThreadCount(2)
+        self._queries = {}; self._query_workers = set()
+        self._maint_overlay = {}  # {tabella: {device_id: status}} arrivati mentre la query è in corso
         self.init_ui(); self.setStyleSheet(STYLE); init_db(); init_jira_db(); self.refresh_data()
         # Timer auto-refresh Jira ogni ora
         self.jira_timer = QTimer(self); self.jira_timer.timeout.connect(self._auto_refresh_jira); self.jira_timer.start(3600000)
@@ -777,6 +1095,11 @@ class MainWindow(QMainWindow):
         QTimer.singleShot(2000, self._startup_jira_download)
         # Check maintenance API all'avvio: lazy, in background — UI mostra subito cache
         QTimer.singleShot(3000, lambda: self.run_maintenance_check(at_boot=True))
+        # Refresh continuo: piccoli batch silenziosi dei device con TTL scaduto
+        import os as _os
+        try: trickle_min = float(_os.getenv("MAINT_TRICKLE_MINUTES", "5"))
+        except Exception: trickle_min = 5.0
+        self.maint_timer = QTimer(self); self.maint_timer.timeout.connect(self._maint_trickle); self.maint_timer.start(int(trickle_min * 60000))
 
     def _startup_jira_download(self):
         """Chiede conferma e tenta download ticket Jira all'avvio."""
@@ -820,9 +1143,12 @@ class MainWindow(QMainWindow):
         cl.addWidget(sep2)
         for c in [self.card_jira_totale,self.card_jira_week]: cl.addWidget(c)
         ml.addLayout(cl)
-        self.tabs = QTabWidget(); self.tabs.addTab(self._create_alerts_tab(), "\u26a0 Alert"); self.tabs.addTab(self._create_devices_tab(), "\U0001f4cb Dispositivi"); self.tabs.addTab(self._create_overview_tab(), "\U0001f4ca Overview"); self.tabs.addTab(self._create_ticket_tab(), "\U0001f3ab Ticket"); self.tabs.addTab(self._create_delta_tab(), "\u0394 Delta Ticket")
+        self.tabs = QTabWidget(); self.tabs.addTab(self._create_alerts_tab(), "\u26a0 Alert"); self.tabs.addTab(self._create_devices_tab(), "\U0001f4cb Dispositivi"); self.tabs.addTab(self._create_overview_tab(), "\U0001f4ca Overview"); self.tabs.addTab(self._create_ticket_tab(), "\U0001f3ab Ticket"); self.tabs.addTab(self._create_delta_tab(), "\u0394 Delta Ticket"); self.tabs.addTab(self._create_heatmap_tab(), "\u25a6 Heatmap")
         self.tabs.currentChanged.connect(self._on_tab_changed); ml.addWidget(self.tabs)
         self.status_bar = QStatusBar(); self.setStatusBar(self.status_bar); self.status_label = QLabel("Pronto"); self.status_bar.addWidget(self.status_label, stretch=1)
+        # Progress check maintenance non bloccante (al posto del dialog modale)
+        self.maint_progress = QProgressBar(); self.maint_progress.setMaximumWidth(220); self.maint_progress.setMaximumHeight(16); self.maint_progress.setFormat("Maint. %v/%m"); self.maint_progress.hide(); self.status_bar.addPermanentWidget(self.maint_progress)
+        self.maint_cancel_btn = QPushButton("Annulla"); self.maint_cancel_btn.setObjectName("secondary"); self.maint_cancel_btn.setMaximumHeight(20); self.maint_cancel_btn.clicked.connect(self._cancel_maint_check); self.maint_cancel_btn.hide(); self.status_bar.addPermanentWidget(self.maint_cancel_btn)
 
     def _make_card(self, value, label, bg="#FFFFFF"):
         card = QWidget(); card.setStyleSheet(f"background:{bg};border:1px solid #CCC;border-radius:5px;"); card.setFixedHeight(64); card.setMinimumWidth(80)
@@ -900,7 +1226,7 @@ class MainWindow(QMainWindow):
         for i in range(7,11): self.alert_table.table.setColumnWidth(i,48)
         self.alert_table.table.setColumnWidth(11,50); self.alert_table.table.setColumnWidth(12,80); self.alert_table.table.setColumnWidth(13,220); self.alert_table.table.setColumnWidth(14,260); self.alert_table.table.setColumnWidth(15,90); self.alert_table.table.setColumnWidth(16,80)
         self.alert_table.table.doubleClicked.connect(self._on_alert_dblclick)
-        self.alert_table.table.cellClicked.connect(lambda r, c: self._on_ticket_click(self.alert_table.table, r, c))
+        self.alert_table.table.clicked.connect(lambda idx: self._on_ticket_click(self.alert_table.table, idx))
         layout.addWidget(self.alert_table); return tab
 
     def _toggle_alert_nt(self):
@@ -910,15 +1236,12 @@ class MainWindow(QMainWindow):
         self.alert_sev.setCurrentIndex(0); self.alert_type.setCurrentIndex(0); self.alert_forn.setCurrentIndex(0)
         self._alert_no_ticket = False; self.alert_no_ticket_btn.setChecked(False); self.alert_no_ticket_btn.setObjectName("toggle_off"); self.alert_no_ticket_btn.setStyle(self.alert_no_ticket_btn.style()); self.alert_table.clear_filters()
     def _on_alert_dblclick(self, index):
-        hdr = self.alert_table.table.horizontalHeaderItem(index.column())
-        if hdr and hdr.text() == "Ticket": return
-        it = self.alert_table.table.item(index.row(), 2)
-        if it: DeviceDetailDialog(it.data(Qt.UserRole) or it.text(), self).exec_()
-    def _on_ticket_click(self, table, row, col):
-        hdr = table.horizontalHeaderItem(col)
-        if not hdr or hdr.text() != "Ticket": return
-        it = table.item(row, col)
-        if it: _open_jira_ticket(it.text())
+        if index.model().headerData(index.column(), Qt.Horizontal) == "Ticket": return
+        it = index.sibling(index.row(), 2)
+        if it.isValid(): DeviceDetailDialog(it.data(Qt.UserRole) or it.data(), self).exec_()
+    def _on_ticket_click(self, table, index):
+        if table.model().headerData(index.column(), Qt.Horizontal) != "Ticket": return
+        if index.data(): _open_jira_ticket(index.data())
     def _jira_from_alerts(self):
         sel = self.alert_table.get_selected_rows_data()
         if not sel: QMessageBox.warning(self, "Nessuna selezione", "Seleziona righe."); return
@@ -952,7 +1275,7 @@ class MainWindow(QMainWindow):
         for i in range(6,12): self.dev_table.table.setColumnWidth(i,48)
         self.dev_table.table.setColumnWidth(12,60); self.dev_table.table.setColumnWidth(13,42); self.dev_table.table.setColumnWidth(15,90); self.dev_table.table.setColumnWidth(16,80)
         self.dev_table.table.doubleClicked.connect(self._on_dev_dblclick)
-        self.dev_table.table.cellClicked.connect(lambda r, c: self._on_ticket_click(self.dev_table.table, r, c))
+        self.dev_table.table.clicked.connect(lambda idx: self._on_ticket_click(self.dev_table.table, idx))
         layout.addWidget(self.dev_table); return tab
 
     def _toggle_dev_nt(self):
@@ -962,10 +1285,9 @@ class MainWindow(QMainWindow):
         self.dev_forn.setCurrentIndex(0); self.dev_health.setCurrentIndex(0); self.dev_tipo.setCurrentIndex(0); self.dev_install.setCurrentIndex(0); self.dev_ticket.setCurrentIndex(0)
         self._dev_no_ticket = False; self.dev_no_ticket_btn.setChecked(False); self.dev_no_ticket_btn.setObjectName("toggle_off"); self.dev_no_ticket_btn.setStyle(self.dev_no_ticket_btn.style()); self.dev_table.clear_filters()
     def _on_dev_dblclick(self, index):
-        hdr = self.dev_table.table.horizontalHeaderItem(index.column())
-        if hdr and hdr.text() == "Ticket": return
-        it = self.dev_table.table.item(index.row(), 0)
-        if it: DeviceDetailDialog(it.data(Qt.UserRole) or it.text(), self).exec_()
+        if index.model().headerData(index.column(), Qt.Horizontal) == "Ticket": return
+        it = index.sibling(index.row(), 0)
+        if it.isValid(): DeviceDetailDialog(it.data(Qt.UserRole) or it.data(), self).exec_()
     def _jira_from_devices(self):
         sel = self.dev_table.get_selected_rows_data()
         if not sel: QMessageBox.warning(self, "Nessuna selezione", "Seleziona righe."); return
@@ -1080,43 +1402,57 @@ class MainWindow(QMainWindow):
         self.delta_table = FilterableTable(cols, dynamic_cols=[0,1])
         for i, w in enumerate([170,90,160,160,90,110,80,110,110,110,110,110,110]):
             self.delta_table.table.setColumnWidth(i, w)
-        self.delta_table.table.cellClicked.connect(lambda r, c: self._on_ticket_click(self.delta_table.table, r, c))
+        self.delta_table.table.clicked.connect(lambda idx: self._on_ticket_click(self.delta_table.table, idx))
         layout.addWidget(self.delta_table)
         return tab
 
+    def _create_heatmap_tab(self):
+        tab = QWidget(); layout = QVBoxLayout(tab)
+        top = QHBoxLayout()
+        top.addWidget(QLabel("<b style='color:#0066CC;font-size:14px'>Heatmap Availability flotta</b>"))
+        top.addStretch()
+        top.addWidget(QLabel("Ordina per:")); self.hm_sort = QComboBox(); self.hm_sort.addItems(["Fornitore","DT","Health","DeviceID"]); self.hm_sort.currentTextChanged.connect(self._apply_heatmap_sort); top.addWidget(self.hm_sort)
+        zo = QPushButton("\u2212"); zo.setObjectName("secondary"); zo.setFixedWidth(32); top.addWidget(zo)
+        self.hm_zoom_label = QLabel(""); self.hm_zoom_label.setStyleSheet("color:#666;"); top.addWidget(self.hm_zoom_label)
+        zi = QPushButton("+"); zi.setObjectName("secondary"); zi.setFixedWidth(32); top.addWidget(zi)
+        self.hm_count_label = QLabel(""); self.hm_count_label.setStyleSheet("color:#666;font-weight:bold;margin-left:8px;"); top.addWidget(self.hm_count_label)
+        layout.addLayout(top)
+        self.fleet_hm = FleetHeatmap(); self._hm_data = None
+        zo.clicked.connect(self.fleet_hm.zoom_out); zi.clicked.connect(self.fleet_hm.zoom_in)
+        self.fleet_hm.zoom_changed.connect(lambda z: self.hm_zoom_label.setText(f"{z} px"))
+        self.fleet_hm.device_activated.connect(lambda did: DeviceDetailDialog(did, self).exec_())
+        self.hm_zoom_label.setText(f"{self.fleet_hm.zoom} px")
+        scroll = QScrollArea(); scroll.setWidget(self.fleet_hm); scroll.setStyleSheet("background:white;"); layout.addWidget(scroll)
+        leg = avail_legend(); leg.insertWidget(0, QLabel("<small><i>Ctrl+rotella: zoom — doppio click: dettaglio device</i></small>")); leg.insertSpacing(1, 12)
+        layout.addLayout(leg)
+        return tab
+
+    def refresh_heatmap(self):
+        def load():
+            return read_model.availability_matrix(), read_model.devices()
+        def apply(res):
+            self._hm_data = res; self._apply_heatmap_sort()
+        self._run_query("heatmap", load, apply)
+
+    _HEALTH_ORDER = {"KO": 0, "DEGRADED": 1, "OK": 2}
+
+    def _apply_heatmap_sort(self):
+        """Riordina le righe della heatmap (Fornitore, DT, Health o DeviceID; poi DeviceID) e
+        ridisegna: l'ordinamento è un take numpy sulla matrice in cache, senza query."""
+        if self._hm_data is None: return
+        (ids, first, matrix), devs = self._hm_data
+        col = {"Fornitore": "fornitore", "DT": "dt", "Health": "current_health"}.get(self.hm_sort.currentText())
+        if col:
+            groups = [(devs.get(did) or {}).get(col) or "" for did in ids]
+            if col == "current_health": key = lambda i: (self._HEALTH_ORDER.get(groups[i], 3), groups[i], ids[i])
+            else: key = lambda i: (groups[i] == "", groups[i], ids[i])
+        else:
+            groups = None; key = lambda i: ids[i]
+        order = sorted(range(len(ids)), key=key)
+        self.fleet_hm.set_data([ids[i] for i in order], first, matrix[order], [groups[i] for i in order] if groups else None)
+        self.hm_count_label.setText(f"{len(ids)} device × {matrix.shape[1]} giorni")
+
     def refresh_delta(self):
-        session = get_session()
-        try:
-            jira_map = {}
-            try:
-                for t in get_ticket_data():
-                    if t.get("key"): jira_map[t["key"]] = t
-            except Exception: pass
-            rows = []
-            devs = session.query(Device).filter(Device.ticket_id.isnot(None), Device.ticket_id != "").all()
-            for d in devs:
-                jt = jira_map.get(d.ticket_id, {})
-                created = jt.get("created"); updated = jt.get("updated"); status = jt.get("status","") or ""
-                created_str = created.strftime("%Y-%m-%d") if created else ""
-                updated_str = updated.strftime("%Y-%m-%d") if updated else ""
-                closed_str = updated.strftime("%Y-%m-%d") if (updated and status in ("Chiusa","Discarded")) else ""
-                rows.append({
-                    "DeviceID": d.device_id,
-                    "_full_did": d.device_id,
-                    "Ticket": d.ticket_id or "-",
-                    "Tipo Malf. (Excel)": d.tipo_malfunzionamento or "-",
-                    "Tipo Malf. (Jira)": jt.get("effetto","") or "-",
-                    "Stato (Excel)": d.ticket_stato or "-",
-                    "Stato (Jira)": status or "-",
-                    "Livello (Jira)": jt.get("assignee_level","") or "-",
-                    "Data Apertura (Excel)": str(d.ticket_data_apertura) if d.ticket_data_apertura else "-",
-                    "Data Risoluzione (Excel)": str(d.ticket_data_risoluzione) if d.ticket_data_risoluzione else "-",
-                    "Data Apertura L4 (Excel)": str(d.ticket_data_apertura_l4) if d.ticket_data_apertura_l4 else "-",
-                    "Data Apertura (Jira)": created_str or "-",
-                    "Chiusura (Jira)": closed_str or "-",
-                    "Aggiornato (Jira)": updated_str or "-",
-                })
-        finally: session.close()
         def render_delta(row, col):
             val = row.get(col, "")
             if col == "DeviceID":
@@ -1128,16 +1464,13 @@ class MainWindow(QMainWindow):
                 if key: it.setToolTip(f"Apri {JIRA_BASE_URL}/browse/{key}")
                 return it
             if col in ("Stato (Excel)","Stato (Jira)"): return ticket_stato_item(val)
-            if col.startswith("Tipo Malf."):
-                excel = row.get("Tipo Malf. (Excel)","") or ""; jira = row.get("Tipo Malf. (Jira)","") or ""
-                mismatch = excel != "-" and jira != "-" and excel.strip().lower() != jira.strip().lower()
-                if mismatch: return colored_item(val, "#FFF3E0", "#E65100")
-            if col in ("Data Apertura (Excel)","Data Apertura (Jira)"):
-                e = row.get("Data Apertura (Excel)","-"); j = row.get("Data Apertura (Jira)","-")
-                if e != "-" and j != "-" and e != j: return colored_item(val, "#FFF3E0", "#E65100")
+            if col.startswith("Tipo Malf.") and row.get("_tipo_mismatch"): return colored_item(val, "#FFF3E0", "#E65100")
+            if col in ("Data Apertura (Excel)","Data Apertura (Jira)") and row.get("_data_mismatch"): return colored_item(val, "#FFF3E0", "#E65100")
             return QTableWidgetItem(str(val))
-        self.delta_table.set_data(rows, render_delta)
-        self.delta_count_label.setText(f"{len(rows)} righe")
+        def apply(rows):
+            self.delta_table.set_data(rows, render_delta)
+            self.delta_count_label.setText(f"{len(rows)} righe")
+        self._run_query("delta", read_model.delta, apply)
 
     def _refresh_jira_api(self):
         """Aggiorna ticket da Jira API in background."""
@@ -1153,9 +1486,10 @@ class MainWindow(QMainWindow):
     def _on_jira_download_done(self, ok, msg):
         self.tkt_refresh_btn.setEnabled(True); self.tkt_refresh_btn.setText("Aggiorna da Jira")
         self.status_label.setText(msg)
-        if ok:
-            self._populate_tkt_filters(); self.refresh_tickets(); self._refresh_jira_cards()
-        else:
+        # Il download salva pagina per pagina: anche se fallisce a metà il DB può essere cambiato
+        read_model.invalidate("tickets")
+        self._populate_tkt_filters(then=self.refresh_tickets); self._refresh_jira_cards()
+        if not ok:
             QMessageBox.warning(self, "Jira", f"{msg}\n\nPer configurare le credenziali, crea un file .env\nnella cartella del tool con:\n\nJIRA_EMAIL=tua.email@reply.it\nJIRA_API_TOKEN=il_tuo_token")
 
     def _import_jira_excel(self):
@@ -1166,16 +1500,20 @@ class MainWindow(QMainWindow):
         self.status_label.setText(msg)
         if ok:
             QMessageBox.information(self, "Import Jira", msg)
-            self._populate_tkt_filters(); self.refresh_tickets(); self._refresh_jira_cards()
+            read_model.invalidate("tickets")
+            self._populate_tkt_filters(then=self.refresh_tickets); self._refresh_jira_cards()
         else:
             QMessageBox.critical(self, "Errore", msg)
 
-    def _populate_tkt_filters(self):
-        opts = get_filter_options()
-        for combo, key in [(self.tkt_status,"statuses"),(self.tkt_reporter,"reporters"),(self.tkt_assignee,"assignees"),(self.tkt_priority,"priorities"),(self.tkt_resolution,"resolutions")]:
-            combo.blockSignals(True); combo.clear(); combo.addItem("Tutti")
-            for v in opts.get(key, []): combo.addItem(v)
-            combo.blockSignals(False)
+    def _populate_tkt_filters(self, then=None):
+        """Ricarica le opzioni dei filtri ticket; then() viene chiamata dopo l'aggiornamento dei combo."""
+        def apply(opts):
+            for combo, key in [(self.tkt_status,"statuses"),(self.tkt_reporter,"reporters"),(self.tkt_assignee,"assignees"),(self.tkt_priority,"priorities"),(self.tkt_resolution,"resolutions")]:
+                combo.blockSignals(True); combo.clear(); combo.addItem("Tutti")
+                for v in opts.get(key, []): combo.addItem(v)
+                combo.blockSignals(False)
+            if then: then()
+        self._run_query("tkt_filters", read_model.ticket_filter_options, apply)
 
     def _clear_tkt_filters(self):
         for c in [self.tkt_status, self.tkt_reporter, self.tkt_assignee, self.tkt_priority, self.tkt_resolution]: c.setCurrentIndex(0)
@@ -1183,13 +1521,10 @@ class MainWindow(QMainWindow):
         self.tkt_table.clear_filters(); self.refresh_tickets()
 
     def _on_tkt_dblclick(self, index):
-        it = self.tkt_table.table.item(index.row(), 0)
-        if it:
-            key = it.data(Qt.UserRole) or it.text()
-            data = get_ticket_data()
-            for t in data:
-                if t["key"] == key:
-                    TicketDetailDialog(t, self).exec_(); return
+        it = index.sibling(index.row(), 0)
+        if it.isValid():
+            t = read_model.ticket(it.data(Qt.UserRole) or it.data())
+            if t: TicketDetailDialog(t, self).exec_()
 
     def refresh_tickets(self):
         filters = {}
@@ -1202,21 +1537,23 @@ class MainWindow(QMainWindow):
         from datetime import datetime as dt2
         filters["created_from"] = dt2.combine(fd, dt2.min.time())
         filters["created_to"] = dt2.combine(td, dt2.max.time())
-        try:
-            data = get_ticket_data(filters)
-        except Exception:
-            data = []
-        rows = []
-        for t in data:
-            created_str = t["created"].strftime("%Y-%m-%d") if t["created"] else ""
-            updated_str = t["updated"].strftime("%Y-%m-%d") if t["updated"] else ""
-            closed_str = ""
-            if t["status"] in ("Chiusa","Discarded") and t["updated"]:
-                closed_str = t["updated"].strftime("%Y-%m-%d")
-            h = t["timing_hours"]; timing_txt = f"{h}h"
-            ris = t.get("risoluzione","")
-            macro = t.get("macro_area","")
-            rows.append({"Ticket":t["key"],"_key":t["key"],"DeviceID":t["device_id"],"_full_did":t["device_id"],"Data Apertura":created_str,"Stato":t["status"],"Livello":t.get("assignee_level",""),"Tipo Malf.":t["labels"],"Cluster-analisi":macro,"Risoluzione":ris,"Aggiornato":updated_str,"Chiusura":closed_str,"Timing":timing_txt,"_timing_color":t["timing_color"],"_has_ris":bool(ris),"_has_macro":bool(macro)})
+        def load():
+            try:
+                data = read_model.tickets(filters)
+            except Exception:
+                data = []
+            rows = []
+            for t in data:
+                created_str = t["created"].strftime("%Y-%m-%d") if t["created"] else ""
+                updated_str = t["updated"].strftime("%Y-%m-%d") if t["updated"] else ""
+                closed_str = ""
+                if t["status"] in ("Chiusa","Discarded") and t["updated"]:
+                    closed_str = t["updated"].strftime("%Y-%m-%d")
+                h, timing_color = compute_timing_hours(t["created"], t["updated"]); timing_txt = f"{h}h"
+                ris = t.get("risoluzione","")
+                macro = t.get("macro_area","")
+                rows.append({"Ticket":t["key"],"_key":t["key"],"DeviceID":t["device_id"],"_full_did":t["device_id"],"Data Apertura":created_str,"Stato":t["status"],"Livello":t.get("assignee_level",""),"Tipo Malf.":t["labels"],"Cluster-analisi":macro,"Risoluzione":ris,"Aggiornato":updated_str,"Chiusura":closed_str,"Timing":timing_txt,"_timing_color":timing_color,"_has_ris":bool(ris),"_has_macro":bool(macro)})
+            return rows
         def render_tkt(row, col):
             val = row.get(col, "")
             if col == "Ticket":
@@ -1245,211 +1582,226 @@ class MainWindow(QMainWindow):
             elif col == "DeviceID":
                 it = QTableWidgetItem(val); it.setData(Qt.UserRole, row.get("_full_did")); it.setToolTip(row.get("_full_did", val)); it.setForeground(QColor("#0066CC")); f = it.font(); f.setBold(True); it.setFont(f); return it
             return QTableWidgetItem(str(val))
-        self.tkt_table.set_data(rows, render_tkt)
-        self.tkt_count_label.setText(f"{len(rows)} ticket")
+        def apply(rows):
+            self.tkt_table.set_data(rows, render_tkt)
+            self.tkt_count_label.setText(f"{len(rows)} ticket")
+        self._run_query("tickets", load, apply)
 
     def refresh_data(self):
-        session = get_session()
-        try:
-            total = session.query(Device).count()
+        def apply(res):
+            total, health, crit, high, types = res
             if total == 0: self.status_label.setText("Nessun dato. Importa un file Excel."); return
-            health = dict(session.query(Device.current_health, func_count()).group_by(Device.current_health).all())
             self._update_card(self.card_total, total); self._update_card(self.card_ok, health.get("OK",0)); self._update_card(self.card_ko, health.get("KO",0)); self._update_card(self.card_deg, health.get("DEGRADED",0))
-            self._update_card(self.card_crit, session.query(AnomalyEvent).filter(AnomalyEvent.severity=="CRITICAL",AnomalyEvent.acknowledged==False).count())
-            self._update_card(self.card_high, session.query(AnomalyEvent).filter(AnomalyEvent.severity=="HIGH",AnomalyEvent.acknowledged==False).count())
-            types = [r[0] for r in session.query(AnomalyEvent.event_type).distinct().all() if r[0]]
+            self._update_card(self.card_crit, crit); self._update_card(self.card_high, high)
             self.alert_type.blockSignals(True); self.alert_type.clear(); self.alert_type.addItem("Tutti")
-            for tp in sorted(types): self.alert_type.addItem(tp)
+            for tp in types: self.alert_type.addItem(tp)
             self.alert_type.blockSignals(False)
             self.refresh_alerts(); self.refresh_devices(); self.refresh_overview(); self._refresh_jira_cards(); self.status_label.setText(f"Dati: {total} dispositivi")
-        except Exception as e: self.status_label.setText(f"Errore: {e}")
-        finally: session.close()
+        self._run_query("data", read_model.summary, apply)
 
     def refresh_alerts(self):
-        session = get_session()
-        try:
-            from sqlalchemy import func, and_
-            q = session.query(AnomalyEvent, Device).join(Device, AnomalyEvent.device_id == Device.device_id).filter(AnomalyEvent.acknowledged == False)
-            sev = self.alert_sev.currentText()
-            if sev != "Tutti": q = q.filter(AnomalyEvent.severity == sev)
-            typ = self.alert_type.currentText()
-            if typ != "Tutti": q = q.filter(AnomalyEvent.event_type == typ)
-            forn = self.alert_forn.currentText()
-            if forn != "Tutti": q = q.filter(Device.fornitore == forn)
-            # Toggle: solo senza ticket
-            if self._alert_no_ticket:
-                q = q.filter((Device.ticket_id == None) | (Device.ticket_id == ""))
-            # Deduplicazione: un solo alert per device, il più recente (created_at)
-            best = {}  # device_id -> (event, device)
-            for event, device in q.all():
-                did = device.device_id
-                if did not in best:
-                    best[did] = (event, device)
-                else:
-                    prev_ev, _ = best[did]
-                    if (event.created_at or datetime.min) > (prev_ev.created_at or datetime.min):
-                        best[did] = (event, device)
+        sev = self.alert_sev.currentText(); typ = self.alert_type.currentText(); forn = self.alert_forn.currentText()
+        no_ticket = self._alert_no_ticket
+        overlay = self._maint_overlay["alerts"] = {}
+        def load():
+            # Un solo alert per device, il più recente (dal read model in memoria)
+            alerts = read_model.latest_alerts(severity=None if sev == "Tutti" else sev, event_type=None if typ == "Tutti" else typ,
+                                              fornitore=None if forn == "Tutti" else forn, no_ticket=no_ticket)
             data = []
-            for event, device in best.values():
-                metrics = device.misure_mancanti or ""
+            for (did, severity, event_type, description), d in alerts:
+                metrics = d["misure_mancanti"] or ""
                 metrics_short = metrics if len(metrics) <= 60 else metrics[:57] + "..."
-                data.append({"Severity":event.severity,"Tipo":(event.event_type or "").replace("_"," "),"DeviceID":device.device_id,"_full_did":device.device_id,"Meter":device_name_to_clientid(device.device_id),"Fornitore":device.fornitore or "-","DT":device.dt or "-","Trend":trend_str(device.trend_7d),"Mongo":device.check_mongo or "-","Batt":device.batteria or "-","Porta":device.porta_aperta or "-","Maint.":self._maint_cache.get(device.device_id, "-"),"Sotto C.":"SC" if device.is_sotto_corona else "","Onesait":str(device.data_onesait) if device.data_onesait and device.data_onesait.year >= 2020 else "-","Misure Mancanti":metrics_short,"_metrics_full":metrics,"Descrizione":event.description or "","Ticket":device.ticket_id or "-","Stato":device.ticket_stato or "-"})
-            def ra(row, col):
-                val = row.get(col, "")
-                if col == "Severity": return colored_item(val, SEV_BG.get(val,""), SEV_COLORS.get(val,""), True)
-                elif col == "DeviceID": it = QTableWidgetItem(val); it.setData(Qt.UserRole, row.get("_full_did")); it.setToolTip(row.get("_full_did", val)); it.setForeground(QColor("#0066CC")); f = it.font(); f.setBold(True); it.setFont(f); return it
-                elif col in ("Mongo","Batt","Porta"): return check_item(val)
-                elif col == "Maint.": return maint_item(val)
-                elif col == "Sotto C." and val == "SC": return colored_item("SC","#E3F2FD","#1565C0",True)
-                elif col == "Onesait" and val != "-": return colored_item(val, "#FFF3E0", "#E65100")
-                elif col == "Trend": it = QTableWidgetItem(val); it.setFont(QFont("Consolas",10)); return it
-                elif col == "Misure Mancanti":
-                    it = QTableWidgetItem(val)
-                    full = row.get("_metrics_full", "")
-                    if full:
-                        it.setToolTip(full); it.setForeground(QColor("#E65100")); it.setBackground(QColor("#FFF8E1"))
-                    return it
-                elif col == "Ticket" and val != "-":
-                    it = QTableWidgetItem(val); it.setForeground(QColor("#0052CC"))
-                    f = it.font(); f.setBold(True); f.setUnderline(True); it.setFont(f)
-                    key = _extract_jira_key(val)
-                    if key: it.setToolTip(f"Apri {JIRA_BASE_URL}/browse/{key}")
-                    return it
-                elif col == "Stato": return ticket_stato_item(val)
-                return QTableWidgetItem(str(val))
+                onesait = d["data_onesait"]
+                data.append({"Severity":severity,"Tipo":(event_type or "").replace("_"," "),"DeviceID":did,"_full_did":did,"Meter":d["client_id"] or device_name_to_clientid(did),"Fornitore":d["fornitore"] or "-","DT":d["dt"] or "-","Trend":trend_str(d["trend_7d"]),"Mongo":d["check_mongo"] or "-","Batt":d["batteria"] or "-","Porta":d["porta_aperta"] or "-","Maint.":d["maint"] or "-","Sotto C.":"SC" if d["is_sotto_corona"] else "","Onesait":str(onesait) if onesait and onesait.year >= 2020 else "-","Misure Mancanti":metrics_short,"_metrics_full":metrics,"Descrizione":description or "","Ticket":d["ticket_id"] or "-","Stato":d["ticket_stato"] or "-"})
+            return data
+        def ra(row, col):
+            val = row.get(col, "")
+            if col == "Severity": return colored_item(val, SEV_BG.get(val,""), SEV_COLORS.get(val,""), True)
+            elif col == "DeviceID": it = QTableWidgetItem(val); it.setData(Qt.UserRole, row.get("_full_did")); it.setToolTip(row.get("_full_did", val)); it.setForeground(QColor("#0066CC")); f = it.font(); f.setBold(True); it.setFont(f); return it
+            elif col in ("Mongo","Batt","Porta"): return check_item(val)
+            elif col == "Maint.": return maint_item(val)
+            elif col == "Sotto C." and val == "SC": return colored_item("SC","#E3F2FD","#1565C0",True)
+            elif col == "Onesait" and val != "-": return colored_item(val, "#FFF3E0", "#E65100")
+            elif col == "Trend": it = QTableWidgetItem(val); it.setFont(QFont("Consolas",10)); return it
+            elif col == "Misure Mancanti":
+                it = QTableWidgetItem(val)
+                full = row.get("_metrics_full", "")
+                if full:
+                    it.setToolTip(full); it.setForeground(QColor("#E65100")); it.setBackground(QColor("#FFF8E1"))
+                return it
+            elif col == "Ticket" and val != "-":
+                it = QTableWidgetItem(val); it.setForeground(QColor("#0052CC"))
+                f = it.font(); f.setBold(True); f.setUnderline(True); it.setFont(f)
+                key = _extract_jira_key(val)
+                if key: it.setToolTip(f"Apri {JIRA_BASE_URL}/browse/{key}")
+                return it
+            elif col == "Stato": return ticket_stato_item(val)
+            return QTableWidgetItem(str(val))
+        def apply(data):
+            self._apply_maint_overlay(data, overlay)
             self.alert_table.set_data(data, ra); self.alert_count_label.setText(f"{len(data)} alert")
-        finally: session.close()
+        self._run_query("alerts", load, apply)
 
     def refresh_devices(self):
-        session = get_session()
-        try:
-            q = session.query(Device)
-            forn = self.dev_forn.currentText()
-            if forn != "Tutti": q = q.filter(Device.fornitore == forn)
-            hlth = self.dev_health.currentText()
-            if hlth != "Tutti": q = q.filter(Device.current_health == hlth)
-            tipo = self.dev_tipo.currentText()
-            if tipo != "Tutti": q = q.filter(Device.sistema_digil.contains(tipo))
-            inst = self.dev_install.currentText()
-            if inst == "Completa": q = q.filter(Device.is_sotto_corona == False)
-            elif inst == "Sotto corona": q = q.filter(Device.is_sotto_corona == True)
-            tkt = self.dev_ticket.currentText()
-            if tkt == "Vuoto": q = q.filter((Device.ticket_id == None) | (Device.ticket_id == ""))
-            elif tkt != "Tutti": q = q.filter(Device.ticket_stato == tkt)
-            if self._dev_no_ticket: q = q.filter((Device.ticket_id == None) | (Device.ticket_id == ""))
+        forn = self.dev_forn.currentText(); hlth = self.dev_health.currentText(); tipo = self.dev_tipo.currentText()
+        inst = self.dev_install.currentText(); tkt = self.dev_ticket.currentText(); no_ticket = self._dev_no_ticket
+        overlay = self._maint_overlay["devices"] = {}
+        def keep(d):
+            if forn != "Tutti" and d["fornitore"] != forn: return False
+            if hlth != "Tutti" and d["current_health"] != hlth: return False
+            if tipo != "Tutti" and tipo.lower() not in (d["sistema_digil"] or "").lower(): return False
+            if inst == "Completa" and d["is_sotto_corona"] is not False: return False
+            if inst == "Sotto corona" and d["is_sotto_corona"] is not True: return False
+            if (tkt == "Vuoto" or no_ticket) and d["ticket_id"]: return False
+            if tkt not in ("Tutti", "Vuoto") and d["ticket_stato"] != tkt: return False
+            return True
+        def load():
             data = []
-            for d in q.all():
-                sd = d.sistema_digil or ""; ts = "M" if "master" in sd else "S" if "slave" in sd else "?"
-                data.append({"DeviceID":d.device_id,"_full_did":d.device_id,"Meter":device_name_to_clientid(d.device_id),"Linea":d.linea or "-","Fornitore":d.fornitore or "-","Tipo":ts,"DT":d.dt or "-","Health":d.current_health or "-","Mongo":d.check_mongo or "-","Batt":d.batteria or "-","Porta":d.porta_aperta or "-","Maint.":self._maint_cache.get(d.device_id, "-"),"Sotto C.":"SC" if d.is_sotto_corona else "","Trend":trend_str(d.trend_7d),"Giorni":str(d.days_in_current) if d.days_in_current else "-","Malf.":d.tipo_malfunzionamento or "-","Ticket":d.ticket_id or "-","Stato":d.ticket_stato or "-"})
-            def rd(row, col):
-                val = row.get(col, "")
-                if col == "DeviceID": it = QTableWidgetItem(val); it.setData(Qt.UserRole, row.get("_full_did")); it.setToolTip(row.get("_full_did", val)); it.setForeground(QColor("#0066CC")); f = it.font(); f.setBold(True); it.setFont(f); return it
-                elif col == "Health": return colored_item(val, HEALTH_BG.get(val,""), bold=True)
-                elif col in ("Mongo","Batt","Porta"): return check_item(val)
-                elif col == "Maint.": return maint_item(val)
-                elif col == "Sotto C." and val == "SC": return colored_item("SC","#E3F2FD","#1565C0",True)
-                elif col == "Trend": it = QTableWidgetItem(val); it.setFont(QFont("Consolas",10)); return it
-                elif col == "Ticket" and val != "-":
-                    it = QTableWidgetItem(val); it.setForeground(QColor("#0052CC"))
-                    f = it.font(); f.setBold(True); f.setUnderline(True); it.setFont(f)
-                    key = _extract_jira_key(val)
-                    if key: it.setToolTip(f"Apri {JIRA_BASE_URL}/browse/{key}")
-                    return it
-                elif col == "Stato": return ticket_stato_item(val)
-                return QTableWidgetItem(str(val))
+            for d in filter(keep, read_model.devices().values()):
+                did = d["device_id"]; sd = d["sistema_digil"] or ""; ts = "M" if "master" in sd else "S" if "slave" in sd else "?"
+                data.append({"DeviceID":did,"_full_did":did,"Meter":d["client_id"] or device_name_to_clientid(did),"Linea":d["linea"] or "-","Fornitore":d["fornitore"] or "-","Tipo":ts,"DT":d["dt"] or "-","Health":d["current_health"] or "-","Mongo":d["check_mongo"] or "-","Batt":d["batteria"] or "-","Porta":d["porta_aperta"] or "-","Maint.":d["maint"] or "-","Sotto C.":"SC" if d["is_sotto_corona"] else "","Trend":trend_str(d["trend_7d"]),"Giorni":str(d["days_in_current"]) if d["days_in_current"] else "-","Malf.":d["tipo_malfunzionamento"] or "-","Ticket":d["ticket_id"] or "-","Stato":d["ticket_stato"] or "-"})
+            return data
+        def rd(row, col):
+            val = row.get(col, "")
+            if col == "DeviceID": it = QTableWidgetItem(val); it.setData(Qt.UserRole, row.get("_full_did")); it.setToolTip(row.get("_full_did", val)); it.setForeground(QColor("#0066CC")); f = it.font(); f.setBold(True); it.setFont(f); return it
+            elif col == "Health": return colored_item(val, HEALTH_BG.get(val,""), bold=True)
+            elif col in ("Mongo","Batt","Porta"): return check_item(val)
+            elif col == "Maint.": return maint_item(val)
+            elif col == "Sotto C." and val == "SC": return colored_item("SC","#E3F2FD","#1565C0",True)
+            elif col == "Trend": it = QTableWidgetItem(val); it.setFont(QFont("Consolas",10)); return it
+            elif col == "Ticket" and val != "-":
+                it = QTableWidgetItem(val); it.setForeground(QColor("#0052CC"))
+                f = it.font(); f.setBold(True); f.setUnderline(True); it.setFont(f)
+                key = _extract_jira_key(val)
+                if key: it.setToolTip(f"Apri {JIRA_BASE_URL}/browse/{key}")
+                return it
+            elif col == "Stato": return ticket_stato_item(val)
+            return QTableWidgetItem(str(val))
+        def apply(data):
+            self._apply_maint_overlay(data, overlay)
             self.dev_table.set_data(data, rd); self.dev_count_label.setText(f"{len(data)} dispositivi")
-        finally: session.close()
+        self._run_query("devices", load, apply)
 
     def refresh_overview(self):
-        session = get_session()
-        try:
-            fornitori = ["INDRA","MII","SIRTI"]; self.ov_forn_table.setRowCount(3)
-            for i, f in enumerate(fornitori):
-                devs = session.query(Device).filter(Device.fornitore==f).all(); total = len(devs)
-                ok = sum(1 for d in devs if d.current_health=="OK"); ko = sum(1 for d in devs if d.current_health=="KO"); deg = sum(1 for d in devs if d.current_health=="DEGRADED"); tickets = sum(1 for d in devs if d.ticket_stato=="Aperto"); sc = sum(1 for d in devs if d.is_sotto_corona); pct = round(ok/total*100,1) if total else 0
-                self.ov_forn_table.setItem(i,0,colored_item(f,bold=True)); self.ov_forn_table.setItem(i,1,colored_item(total,bold=True)); self.ov_forn_table.setItem(i,2,colored_item(ok,"#E8F5E9","#2E7D32",True)); self.ov_forn_table.setItem(i,3,colored_item(ko,"#FFEBEE","#C62828",True)); self.ov_forn_table.setItem(i,4,colored_item(deg,"#FFF3E0","#E65100")); self.ov_forn_table.setItem(i,5,colored_item(f"{pct}%",bold=True)); self.ov_forn_table.setItem(i,6,colored_item(tickets)); self.ov_forn_table.setItem(i,7,colored_item(sc,"#E3F2FD"))
+        def load():
+            try: jira = read_model.jira_overview()
+            except Exception: jira = None
+            return read_model.overview(), jira
+        def apply(res):
+            ov, jira = res
+            self.ov_forn_table.setRowCount(len(ov["fornitore"]))
+            for i, r in enumerate(ov["fornitore"]):
+                self.ov_forn_table.setItem(i,0,colored_item(r["Fornitore"],bold=True)); self.ov_forn_table.setItem(i,1,colored_item(r["Totale"],bold=True)); self.ov_forn_table.setItem(i,2,colored_item(r["OK"],"#E8F5E9","#2E7D32",True)); self.ov_forn_table.setItem(i,3,colored_item(r["KO"],"#FFEBEE","#C62828",True)); self.ov_forn_table.setItem(i,4,colored_item(r["Degraded"],"#FFF3E0","#E65100")); self.ov_forn_table.setItem(i,5,colored_item(f"{r['% OK']}%",bold=True)); self.ov_forn_table.setItem(i,6,colored_item(r["Ticket Aperti"])); self.ov_forn_table.setItem(i,7,colored_item(r["Sotto Corona"],"#E3F2FD"))
             self.ov_forn_table.resizeRowsToContents()
-            from sqlalchemy import func
-            dts = [(dt,cnt) for dt,cnt in session.query(Device.dt, func.count()).group_by(Device.dt).all() if dt]; dts.sort(key=lambda x:x[1], reverse=True); self.ov_dt_table.setRowCount(len(dts))
-            for i, (dt, total) in enumerate(dts):
-                ok = session.query(Device).filter(Device.dt==dt, Device.current_health=="OK").count(); pct = round(ok/total*100,1) if total else 0
-                self.ov_dt_table.setItem(i,0,colored_item(dt,bold=True)); self.ov_dt_table.setItem(i,1,colored_item(total)); self.ov_dt_table.setItem(i,2,colored_item(ok,"#E8F5E9","#2E7D32")); self.ov_dt_table.setItem(i,3,colored_item(total-ok,"#FFEBEE","#C62828")); self.ov_dt_table.setItem(i,4,colored_item(f"{pct}%",bold=True))
+            self.ov_dt_table.setRowCount(len(ov["dt"]))
+            for i, r in enumerate(ov["dt"]):
+                self.ov_dt_table.setItem(i,0,colored_item(r["DT"],bold=True)); self.ov_dt_table.setItem(i,1,colored_item(r["Totale"])); self.ov_dt_table.setItem(i,2,colored_item(r["OK"],"#E8F5E9","#2E7D32")); self.ov_dt_table.setItem(i,3,colored_item(r["KO"],"#FFEBEE","#C62828")); self.ov_dt_table.setItem(i,4,colored_item(f"{r['% OK']}%",bold=True))
             self.ov_dt_table.resizeRowsToContents()
-            self.ov_corr_table.setRowCount(3)
-            for i, f in enumerate(fornitori):
-                devs = session.query(Device).filter(Device.fornitore==f).all(); total = len(devs)
-                self.ov_corr_table.setItem(i,0,colored_item(f,bold=True)); self.ov_corr_table.setItem(i,1,colored_item(total))
-                self.ov_corr_table.setItem(i,2,colored_item(sum(1 for d in devs if d.check_mongo=="KO"),bold=True)); self.ov_corr_table.setItem(i,3,colored_item(sum(1 for d in devs if d.porta_aperta=="KO"),bold=True)); self.ov_corr_table.setItem(i,4,colored_item(sum(1 for d in devs if d.batteria=="KO"),bold=True))
+            self.ov_corr_table.setRowCount(len(ov["correlazione"]))
+            for i, r in enumerate(ov["correlazione"]):
+                self.ov_corr_table.setItem(i,0,colored_item(r["Fornitore"],bold=True)); self.ov_corr_table.setItem(i,1,colored_item(r["Totale"]))
+                self.ov_corr_table.setItem(i,2,colored_item(r["Mongo KO"],bold=True)); self.ov_corr_table.setItem(i,3,colored_item(r["Porta KO"],bold=True)); self.ov_corr_table.setItem(i,4,colored_item(r["Batt KO"],bold=True))
             self.ov_corr_table.resizeRowsToContents()
             # Jira ticket per fornitore con L3/L4
-            try:
-                jira_data, target_stati = get_ticket_overview_by_fornitore()
-                display_order = ["INDRA", "MII", "SIRTI"]
-                self.ov_jira_table.setRowCount(len(display_order) + 1)
-                totals = {s: 0 for s in target_stati}; grand = 0
-                for i, f in enumerate(display_order):
-                    display = FORNITORE_DISPLAY.get(f, f)
-                    self.ov_jira_table.setItem(i, 0, colored_item(display, bold=True))
-                    row_total = 0
-                    for j, s in enumerate(target_stati):
-                        cnt = jira_data.get(f, {}).get(s, 0)
-                        bg = "#FFEBEE" if "Aperto" in s else "#E8F5E9" if s=="Chiuso" else "#FFF3E0" if s=="Sospeso" else "#F5F5F5"
-                        self.ov_jira_table.setItem(i, j+1, colored_item(cnt if cnt else "", bg))
-                        totals[s] += cnt; row_total += cnt
-                    self.ov_jira_table.setItem(i, len(target_stati)+1, colored_item(row_total, bold=True)); grand += row_total
-                tr = len(display_order)
-                self.ov_jira_table.setItem(tr, 0, colored_item("Totale complessivo", bold=True))
+            if jira is None: return
+            jira_data, target_stati = jira
+            display_order = ["INDRA", "MII", "SIRTI"]
+            self.ov_jira_table.setRowCount(len(display_order) + 1)
+            totals = {s: 0 for s in target_stati}; grand = 0
+            for i, f in enumerate(display_order):
+                display = FORNITORE_DISPLAY.get(f, f)
+                self.ov_jira_table.setItem(i, 0, colored_item(display, bold=True))
+                row_total = 0
                 for j, s in enumerate(target_stati):
-                    self.ov_jira_table.setItem(tr, j+1, colored_item(totals[s], bold=True))
-                self.ov_jira_table.setItem(tr, len(target_stati)+1, colored_item(grand, bold=True))
-                self.ov_jira_table.resizeColumnsToContents(); self.ov_jira_table.resizeRowsToContents()
-            except Exception:
-                pass
-        finally: session.close()
+                    cnt = jira_data.get(f, {}).get(s, 0)
+                    bg = "#FFEBEE" if "Aperto" in s else "#E8F5E9" if s=="Chiuso" else "#FFF3E0" if s=="Sospeso" else "#F5F5F5"
+                    self.ov_jira_table.setItem(i, j+1, colored_item(cnt if cnt else "", bg))
+                    totals[s] += cnt; row_total += cnt
+                self.ov_jira_table.setItem(i, len(target_stati)+1, colored_item(row_total, bold=True)); grand += row_total
+            tr = len(display_order)
+            self.ov_jira_table.setItem(tr, 0, colored_item("Totale complessivo", bold=True))
+            for j, s in enumerate(target_stati):
+                self.ov_jira_table.setItem(tr, j+1, colored_item(totals[s], bold=True))
+            self.ov_jira_table.setItem(tr, len(target_stati)+1, colored_item(grand, bold=True))
+            self.ov_jira_table.resizeColumnsToContents(); self.ov_jira_table.resizeRowsToContents()
+        self._run_query("overview", load, apply)
 
     def _refresh_jira_cards(self):
         """Aggiorna le cards con statistiche Jira."""
-        try:
-            js = get_jira_stats()
+        def load():
+            try: return read_model.jira_stats()
+            except Exception: return None
+        def apply(js):
+            if js is None: return
             self._update_multi_card(self.card_jira_totale,
                 [js["aperto_l3"], js["aperto_l4"], js["chiuso"], js["scartato"]])
             self._update_multi_card(self.card_jira_week,
                 [js["week_aperti"], js["week_chiusi"], js["week_scartati"]])
-        except Exception:
-            pass
+        self._run_query("jira_cards", load, apply)
+
+    def _maint_queue(self, kind, force, then):
+        """Calcola nel pool query la coda di polling in ordine di priorità (alert CRITICAL/HIGH aperti,
+        poi KO, poi il resto): tutti i device con force=True, altrimenti solo quelli con TTL scaduto.
+        Chiama then(coda, totale, ultimo aggiornamento cache) sul thread GUI."""
+        def load():
+            prio = maint_priorities()
+            ids = list(prio) if force else maint_stale_devices(list(prio), priority=prio)
+            return ids, len(prio), (None if ids else maint_cache_ts())
+        self._run_query(kind, load, lambda res: then(*res))
+
+    def _run_query(self, kind, load, apply):
+        """Esegue load() nel pool e poi apply(risultato) sul thread GUI. Una nuova richiesta dello
+        stesso tipo sostituisce la precedente: se non è ancora partita viene tolta dalla coda,
+        altrimenti il suo risultato viene scartato."""
+        prev = self._queries.get(kind)
+        if prev is not None and self._query_pool.tryTake(prev): self._query_workers.discard(prev)
+        w = QueryWorker(load); self._queries[kind] = w; self._query_workers.add(w)
+        def _finish(res, ok):
+            self._query_workers.discard(w)
+            if self._queries.get(kind) is not w: return
+            del self._queries[kind]
+            if ok: apply(res)
+            else: self.status_label.setText(f"Errore: {res}")
+        w.signals.done.connect(lambda res: _finish(res, True))
+        w.signals.failed.connect(lambda msg: _finish(msg, False))
+        self._query_pool.start(w)
+
+    def _apply_maint_overlay(self, rows, overlay):
+        """Riporta sulle righe appena caricate gli stati Maint. arrivati durante la query."""
+        if not overlay: return
+        for r in rows:
+            st = overlay.get(r.get("_full_did"))
+            if st is not None: r["Maint."] = st
+
+    def _on_maint_batch(self, fresh, details):
+        """Blocco di risultati già salvati dal worker: aggiornamento in place della colonna Maint."""
+        read_model.patch_maint(fresh)
+        self.alert_table.update_column("Maint.", fresh)
+        self.dev_table.update_column("Maint.", fresh)
+        for ov in self._maint_overlay.values(): ov.update(fresh)
+
+    def _on_maint_progress(self, done, total):
+        self.maint_progress.setMaximum(total); self.maint_progress.setValue(done)
+
+    def _cancel_maint_check(self):
+        if self._maint_thread is not None and self._maint_thread.isRunning():
+            self._maint_thread.stop()
+            self.maint_cancel_btn.setEnabled(False); self.maint_cancel_btn.setText("Annullamento...")
+
+    def _end_maint_check(self):
+        self._maint_thread = None
+        self.maint_progress.hide(); self.maint_cancel_btn.hide()
 
     def run_maintenance_check(self, at_boot: bool = False, force: bool = False):
-        """Lancia check API maintenance con progress dialog modale.
-        Skippa se cache aggiornata < 8 ore fa (a meno di force=True).
-        Cache su disco viene aggiornata a fine fetch (sovrascrive eventuali cambi)."""
+        """Lancia check API maintenance in background con progress nella status bar.
+        Interroga solo i device con TTL scaduto (per stato, vedi maintenance_api._status_ttl),
+        oppure tutti con force=True. I risultati arrivano a blocchi: ogni blocco è salvato su DB
+        e aggiornato in place nella colonna Maint. delle tabelle."""
         # Evita doppio lancio concorrente
         if self._maint_thread is not None and self._maint_thread.isRunning():
             if not at_boot:
                 QMessageBox.information(self, "Maintenance", "Check già in corso.")
             return
-        # Skip se cache fresca (< TTL ore, configurabile via .env)
-        import os as _os
-        try: MAINT_TTL_HOURS = float(_os.getenv("MAINT_TTL_HOURS", "8"))
-        except Exception: MAINT_TTL_HOURS = 8.0
-        if not force:
-            ts = maint_cache_ts()
-            if ts:
-                try:
-                    last = datetime.fromisoformat(ts)
-                    age_h = (datetime.now() - last).total_seconds() / 3600
-                    if age_h < MAINT_TTL_HOURS:
-                        msg = f"Maintenance: cache recente ({age_h:.1f}h fa, soglia {MAINT_TTL_HOURS}h) — check skippato"
-                        self.status_label.setText(msg)
-                        if not at_boot:
-                            reply = QMessageBox.question(self, "Maintenance",
-                                f"Ultimo aggiornamento: {ts} ({age_h:.1f}h fa).\n"
-                                f"La cache è ancora fresca (< {MAINT_TTL_HOURS}h).\n\nForzare comunque il check?",
-                                QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
-                            if reply == QMessageBox.Yes:
-                                return self.run_maintenance_check(at_boot=False, force=True)
-                        return
-                except Exception:
-                    pass
         # Verifica config
         tm = get_maint_tm()
         if not tm.is_configured():
@@ -1458,54 +1810,80 @@ class MainWindow(QMainWindow):
                 QMessageBox.warning(self, "Config mancante",
                     "Configura AUTH_URL, CLIENT_ID, CLIENT_SECRET nel file .env")
             return
-        # Lista device
-        session = get_session()
-        try:
-            ids = [r[0] for r in session.query(Device.device_id).all()]
-        finally:
-            session.close()
-        if not ids:
+        # Coda device per priorità
+        self._maint_queue("maint_queue", force, lambda ids, n_all, ts: self._maint_queue_ready(ids, n_all, ts, at_boot))
+
+    def _maint_queue_ready(self, ids, n_all, ts, at_boot):
+        if self._maint_thread is not None and self._maint_thread.isRunning():
+            if not at_boot:
+                QMessageBox.information(self, "Maintenance", "Check già in corso.")
+            return
+        if not n_all:
             if not at_boot:
                 QMessageBox.information(self, "Maintenance", "Nessun device nel DB.")
             return
+        if not ids:
+            ts = ts or "mai"
+            self.status_label.setText(f"Maintenance: cache aggiornata per tutti i device (ultimo agg.: {ts}) — check skippato")
+            if not at_boot:
+                reply = QMessageBox.question(self, "Maintenance",
+                    f"Ultimo aggiornamento: {ts}.\nNessun device ha il TTL scaduto.\n\nForzare comunque il check di tutti i device?",
+                    QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+                if reply == QMessageBox.Yes:
+                    return self.run_maintenance_check(at_boot=False, force=True)
+            return
+        self.status_label.setText(f"Check maintenance API in corso: {len(ids)} device (su {n_all})...")
+        self._start_maint_thread(ids, quiet=False)
+
+    def _maint_trickle(self):
+        """Batch silenzioso dei device scaduti più prioritari (MAINT_TRICKLE_BATCH, default 200),
+        entro MAINT_TRICKLE_BUDGET_S secondi (default 60)."""
+        if self._maint_thread is not None and self._maint_thread.isRunning():
+            return
+        if not get_maint_tm().is_configured():
+            return
+        import os as _os
+        try: batch = int(_os.getenv("MAINT_TRICKLE_BATCH", "200"))
+        except Exception: batch = 200
+        try: budget = float(_os.getenv("MAINT_TRICKLE_BUDGET_S", "60"))
+        except Exception: budget = 60.0
+        def start(ids, n_all, ts):
+            if ids and (self._maint_thread is None or not self._maint_thread.isRunning()):
+                self._start_maint_thread(ids[:batch], quiet=True, time_budget_s=budget)
+        self._maint_queue("maint_trickle", False, start)
+
+    def _start_maint_thread(self, ids, quiet, time_budget_s=None):
+        """Avvia il worker. quiet=True (trickle): niente progress bar né popup di errore."""
+        thread = MaintenanceCheckThread(ids, time_budget_s)
         total = len(ids)
-        last_ts = maint_cache_ts() or "mai"
-        # Progress dialog modale
-        dlg = QProgressDialog(f"Check maintenance API in corso...\n0/{total} device\n(ultimo agg.: {last_ts})",
-                              "Annulla", 0, total, self)
-        dlg.setWindowTitle("Maintenance Check")
-        dlg.setWindowModality(Qt.ApplicationModal)
-        dlg.setMinimumDuration(0)
-        dlg.setAutoClose(False)
-        dlg.setAutoReset(False)
-        dlg.setValue(0)
-        # Worker
-        thread = MaintenanceCheckThread(ids)
-        def on_progress(done, total):
-            dlg.setMaximum(total)
-            dlg.setValue(done)
-            dlg.setLabelText(f"Check maintenance API in corso...\n{done}/{total} device")
+        if not quiet:
+            self.maint_progress.setRange(0, total); self.maint_progress.setValue(0); self.maint_progress.show()
+            self.maint_cancel_btn.setText("Annulla"); self.maint_cancel_btn.setEnabled(True); self.maint_cancel_btn.show()
+            thread.progress.connect(self._on_maint_progress)
+        thread.batch.connect(self._on_maint_batch)
         def on_finished(res):
-            self._maint_cache.update(res)
-            save_maint_cache(self._maint_cache)
-            dlg.setValue(dlg.maximum())
-            dlg.close()
-            on_c = sum(1 for v in res.values() if v == "ON")
-            off_c = sum(1 for v in res.values() if v == "OFF")
-            null_c = sum(1 for v in res.values() if v == "NULL")
-            err_c = sum(1 for v in res.values() if v == "ERR")
-            self.status_label.setText(f"Maintenance aggiornata: ON={on_c} OFF={off_c} NULL={null_c} ERR={err_c}")
-            self.refresh_alerts(); self.refresh_devices()
-            self._maint_thread = None
+            self._end_maint_check()
+            fresh = {k: v for k, v in res.items() if v != "SKIP"}
+            if quiet:
+                if fresh: self.status_label.setText(f"Maintenance: aggiornati {len(fresh)} device scaduti")
+                return
+            on_c = sum(1 for v in fresh.values() if v == "ON")
+            off_c = sum(1 for v in fresh.values() if v == "OFF")
+            null_c = sum(1 for v in fresh.values() if v == "NULL")
+            err_c = sum(1 for v in fresh.values() if v == "ERR")
+            skip_s = f" — annullato, {total - len(fresh)} non interrogati" if len(fresh) < total else ""
+            msg = f"Maintenance aggiornata ({len(fresh)} device): ON={on_c} OFF={off_c} NULL={null_c} ERR={err_c}{skip_s}"
+            self.status_label.setText(msg)
+            def show_flapping(flap):
+                if flap: self.status_label.setText(f"{msg} — {len(flap)} device in flapping (7gg)")
+            self._run_query("maint_flapping", maint_flapping, show_flapping)
         def on_error(msg):
-            dlg.close()
+            self._end_maint_check()
             self.status_label.setText(f"Maintenance: errore {msg}")
-            QMessageBox.warning(self, "Maintenance", f"Errore durante il check:\n{msg}")
-            self._maint_thread = None
-        thread.progress.connect(on_progress)
+            if not quiet:
+                QMessageBox.warning(self, "Maintenance", f"Errore durante il check:\n{msg}")
         thread.finished_ok.connect(on_finished)
         thread.error.connect(on_error)
-        dlg.canceled.connect(thread.stop)
         thread.start()
         self._maint_thread = thread
 
@@ -1519,8 +1897,9 @@ class MainWindow(QMainWindow):
         if idx==0: self.refresh_alerts()
         elif idx==1: self.refresh_devices()
         elif idx==2: self.refresh_overview()
-        elif idx==3: self._populate_tkt_filters(); self.refresh_tickets()
+        elif idx==3: self._populate_tkt_filters(then=self.refresh_tickets)
         elif idx==4: self.refresh_delta()
+        elif idx==5: self.refresh_heatmap()
 
     def do_import(self):
         fp, _ = QFileDialog.getOpenFileName(self, "Seleziona File Excel", "", "Excel (*.xlsx *.xls);;All (*)"); 
@@ -1528,7 +1907,7 @@ class MainWindow(QMainWindow):
         self.import_btn.setEnabled(False); self.status_label.setText("Importazione...")
         self.import_thread = ImportThread(fp); self.import_thread.finished.connect(self._on_import_done); self.import_thread.error.connect(self._on_import_error); self.import_thread.start()
     def _on_import_done(self, stats, ac):
-        self.import_btn.setEnabled(True); self.refresh_data()
+        self.import_btn.setEnabled(True); read_model.invalidate(); self.refresh_data()
         QMessageBox.information(self, "Import", f"Dispositivi: {stats['devices_imported']}\nAvailability: {stats['availability_records']}\nTicket nuovi: {stats.get('tickets_new',0)}\nTicket aggiornati: {stats.get('tickets_updated',0)}\nAlert: {ac}")
     def _on_import_error(self, error):
         self.import_btn.setEnabled(True); self.status_label.setText(f"Errore: {error}"); QMessageBox.critical(self, "Errore", error)
@@ -1609,23 +1988,14 @@ class MainWindow(QMainWindow):
         import pandas as pd
         fp, _ = QFileDialog.getSaveFileName(self, "Salva Overview", str(Path.home()/"Downloads"/f"DIGIL_Overview_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"), "Excel (*.xlsx)")
         if not fp: return
-        session = get_session()
         try:
-            fd = []; 
-            for f in ["INDRA","MII","SIRTI"]:
-                devs = session.query(Device).filter(Device.fornitore==f).all(); t = len(devs); ok = sum(1 for d in devs if d.current_health=="OK"); ko = sum(1 for d in devs if d.current_health=="KO"); deg = sum(1 for d in devs if d.current_health=="DEGRADED"); tix = sum(1 for d in devs if d.ticket_stato=="Aperto"); sc = sum(1 for d in devs if d.is_sotto_corona)
-                fd.append({"Fornitore":f,"Totale":t,"OK":ok,"KO":ko,"Degraded":deg,"% OK":round(ok/t*100,1) if t else 0,"Ticket Aperti":tix,"Sotto Corona":sc})
-            from sqlalchemy import func
-            dd = [{"DT":dt,"Totale":t,"OK":session.query(Device).filter(Device.dt==dt,Device.current_health=="OK").count(),"KO":t-session.query(Device).filter(Device.dt==dt,Device.current_health=="OK").count(),"% OK":round(session.query(Device).filter(Device.dt==dt,Device.current_health=="OK").count()/t*100,1) if t else 0} for dt,t in sorted(session.query(Device.dt,func.count()).group_by(Device.dt).all(),key=lambda x:x[1],reverse=True) if dt]
-            cd = []
-            for f in ["INDRA","MII","SIRTI"]:
-                devs = session.query(Device).filter(Device.fornitore==f).all(); t = len(devs)
-                cd.append({"Fornitore":f,"Totale":t,"Mongo KO":sum(1 for d in devs if d.check_mongo=="KO"),"Porta KO":sum(1 for d in devs if d.porta_aperta=="KO"),"Batt KO":sum(1 for d in devs if d.batteria=="KO")})
+            ov = read_model.overview()
+            fd, dd, cd = ov["fornitore"], ov["dt"], ov["correlazione"]
             with pd.ExcelWriter(fp, engine='xlsxwriter') as w:
                 pd.DataFrame(fd).to_excel(w, index=False, sheet_name='Stato Fornitore'); pd.DataFrame(dd).to_excel(w, index=False, sheet_name='Stato DT'); pd.DataFrame(cd).to_excel(w, index=False, sheet_name='Correlazione')
                 # Sheet Jira per Fornitore e Livello
                 try:
-                    jira_data, target_stati = get_ticket_overview_by_fornitore()
+                    jira_data, target_stati = read_model.jira_overview()
                     jira_rows = []
                     for f in ["INDRA", "MII", "SIRTI", "_SENZA"]:
                         row = {"Fornitore": FORNITORE_DISPLAY.get(f, f)}
@@ -1646,7 +2016,6 @@ class MainWindow(QMainWindow):
                     pass
             self.status_label.setText(f"Esportato: {fp}"); QMessageBox.information(self, "Export", f"Salvato:\n{fp}")
         except Exception as e: QMessageBox.critical(self, "Errore", str(e))
-        finally: session.close()
 
 def main():
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling, True); QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps, True)
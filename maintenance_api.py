@@ -7,84 +7,200 @@ Client OAuth2 per recuperare lo stato maintenanceMode dai DigIL via API.
 import os
 import json
 import time
+import asyncio
 import threading
-from datetime import datetime
-from pathlib import Path
+import importlib.util
+from collections import deque
+from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Optional, Tuple, Callable
 
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+from sqlalchemy import select, insert, func, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import (engine, get_session, DB_PATH, Device, AnomalyEvent, MaintenanceStatus, MaintenanceHistory,
+                      device_name_to_clientid)
+
+try:
+    import httpx
+except ImportError:  # fallback: pool di thread con requests
+    httpx = None
+
+# HTTP/2 solo se il pacchetto h2 è installato (httpx[http2])
+HAS_HTTP2 = importlib.util.find_spec("h2") is not None
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 load_dotenv()
 
 
+def _env_int(name: str, default: int) -> int:
+    try: return int(os.getenv(name, str(default)))
+    except: return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try: return float(os.getenv(name, str(default)))
+    except: return default
+
+
+def _max_threads() -> int:
+    return max(1, _env_int("MAINT_MAX_THREADS", 80))
+
+
+def _build_session(pool_size: int) -> requests.Session:
+    """Session condivisa tra i thread: pool di connessioni keep-alive dimensionato sulla
+    concorrenza e retry automatici su errori di connessione e 502/503/504."""
+    retry = Retry(
+        total=3, connect=3, read=0, status=2, backoff_factor=0.3,
+        status_forcelist=(502, 503, 504), allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+    s = requests.Session()
+    s.verify = False
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
 class TokenManager:
-    def __init__(self):
+    """Token OAuth2 client_credentials con rinnovo anticipato in un thread di background.
+    La durata arriva da expires_in (default DEFAULT_LIFETIME); il refresher rinnova a
+    REFRESH_MARGIN secondi dalla scadenza, così get_token non attende mai il round trip
+    finché il token è valido. I rinnovi sono single-flight: un solo POST alla volta, gli
+    altri thread attendono il risultato. Il refresher si ferma dopo IDLE_STOP secondi senza
+    richieste e riparte alla successiva."""
+
+    DEFAULT_LIFETIME = 300
+    REFRESH_MARGIN = 30
+    RETRY_DELAY = 5
+    IDLE_STOP = 600
+
+    def __init__(self, session: Optional[requests.Session] = None):
+        self.session = session or _build_session(2)
         self.auth_url = os.getenv("AUTH_URL")
         self.client_id = os.getenv("CLIENT_ID")
         self.client_secret = os.getenv("CLIENT_SECRET")
-        self._token: Optional[str] = None
-        self._token_expiry: float = 0
-        self._lock = threading.Lock()
-        self.TOKEN_LIFETIME = 300
-        self.REFRESH_MARGIN = 30
-
-    def _is_valid(self) -> bool:
-        return bool(self._token) and time.time() < (self._token_expiry - self.REFRESH_MARGIN)
-
-    def _fetch(self) -> str:
-        r = requests.post(
+        self._state: Tuple[Optional[str], float, float] = (None, 0.0, 0.0)   # (token, scadenza monotonic, durata)
+        self._cond = threading.Condition()
+        self._refreshing = False
+        self._refresher: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._last_used = 0.0
+
+    def _fetch(self) -> Tuple[str, float]:
+        r = self.session.post(
             self.auth_url,
             data={"grant_type": "client_credentials", "client_id": self.client_id, "client_secret": self.client_secret},
             headers={"Content-Type": "application/x-www-form-urlencoded"},
-            verify=False, timeout=30,
+            timeout=30,
         )
         r.raise_for_status()
-        return r.json().get("access_token")
+        data = r.json()
+        try: lifetime = float(data.get("expires_in") or self.DEFAULT_LIFETIME)
+        except (TypeError, ValueError): lifetime = self.DEFAULT_LIFETIME
+        return data.get("access_token"), lifetime
 
     def get_token(self) -> str:
-        with self._lock:
-            if not self._is_valid():
-                self._token = self._fetch()
-                self._token_expiry = time.time() + self.TOKEN_LIFETIME
-            return self._token
+        """Token corrente senza lock; blocca solo al primo uso o se il token è già scaduto."""
+        token = self.valid_token()
+        if token:
+            return token
+        token = self.refresh(self._state[0])
+        self._ensure_refresher()
+        return token
+
+    def valid_token(self) -> Optional[str]:
+        """Token corrente se non scaduto, altrimenti None. Non fa mai I/O (usabile nell'event loop)."""
+        self._last_used = time.monotonic()
+        token, expiry, _ = self._state
+        if token and time.monotonic() < expiry:
+            self._ensure_refresher()
+            return token
+        return None
+
+    def refresh(self, stale_token: Optional[str] = None) -> str:
+        """Rinnovo single-flight. stale_token è il token rifiutato (401/403) o in scadenza:
+        se nel frattempo un altro thread l'ha già sostituito si usa quello nuovo senza POST."""
+        with self._cond:
+            while self._refreshing:
+                self._cond.wait()
+            token, expiry, _ = self._state
+            if token and token != stale_token and time.monotonic() < expiry:
+                return token
+            self._refreshing = True
+        try:
+            token, lifetime = self._fetch()
+            with self._cond:
+                self._state = (token, time.monotonic() + lifetime, lifetime)
+            self._wake.set()
+            return token
+        finally:
+            with self._cond:
+                self._refreshing = False
+                self._cond.notify_all()
+
+    def _ensure_refresher(self):
+        t = self._refresher
+        if t is not None and t.is_alive():
+            return
+        with self._cond:
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(target=self._refresh_loop, name="maint-token-refresh", daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while time.monotonic() - self._last_used < self.IDLE_STOP:
+            token, expiry, lifetime = self._state
+            delay = expiry - min(self.REFRESH_MARGIN, lifetime / 2) - time.monotonic()
+            if token and delay > 0:
+                self._wake.wait(min(delay, self.IDLE_STOP))
+                self._wake.clear()
+                continue
+            try:
+                self.refresh(token)
+            except Exception:
+                # Il token attuale resta in uso fino alla scadenza; nuovo tentativo a breve
+                self._wake.wait(self.RETRY_DELAY)
+                self._wake.clear()
 
     def invalidate(self):
-        with self._lock:
-            self._token = None
-            self._token_expiry = 0
+        """Scarta il token: la prossima get_token ne richiede uno nuovo."""
+        with self._cond:
+            self._state = (None, 0.0, 0.0)
+        self._wake.set()
 
     def is_configured(self) -> bool:
         return bool(self.auth_url and self.client_id and self.client_secret)
 
 
 class MaintenanceApiClient:
-    def __init__(self, tm: TokenManager):
+    def __init__(self, tm: TokenManager, session: Optional[requests.Session] = None):
         self.tm = tm
+        self.session = session or tm.session
         base = os.getenv("BASE_URL", "https://digil-back-end-onesait.servizi.prv")
         self.config_url = f"{base}/api/v1/digils/{{deviceid}}/configuration"
 
-    def _headers(self) -> Dict[str, str]:
-        return {"Authorization": f"Bearer {self.tm.get_token()}", "Accept": "application/json"}
+    @staticmethod
+    def _headers(token: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {token}", "Accept": "application/json"}
 
     def get_maintenance_status(self, deviceid: str) -> Tuple[bool, str, str]:
         """Returns (success, status, error). status: ON|OFF|NULL|ERR"""
         url = self.config_url.format(deviceid=deviceid)
         try:
-            r = requests.get(url, headers=self._headers(), verify=False, timeout=20)
+            token = self.tm.get_token()
+            r = self.session.get(url, headers=self._headers(token), timeout=20)
             if r.status_code in (401, 403):
-                self.tm.invalidate()
-                r = requests.get(url, headers=self._headers(), verify=False, timeout=20)
+                token = self.tm.refresh(token)
+                r = self.session.get(url, headers=self._headers(token), timeout=20)
             r.raise_for_status()
-            data = r.json()
-            mm = (data.get("application") or {}).get("maintenanceMode")
-            if mm == "ON": return True, "ON", ""
-            if mm == "OFF": return True, "OFF", ""
-            if mm is None: return True, "NULL", ""
-            return True, str(mm), ""
+            return True, _parse_maintenance_mode(r.json()), ""
         except requests.exceptions.HTTPError as e:
             code = e.response.status_code if e.response is not None else "?"
             return False, "ERR", f"HTTP {code}"
@@ -95,23 +211,35 @@ class MaintenanceApiClient:
         except Exception as e:
             return False, "ERR", str(e)
 
-
-def device_name_to_clientid(name: str) -> str:
-    """Converte device_name DB (es. '1:1:2:15:22:DIGIL_MRN_0136') in clientid API (es. '1121522_0136').
-    Se il formato non corrisponde, ritorna l'input invariato."""
-    if not name:
-        return name
-    parts = name.split(":")
-    if len(parts) >= 6:
+    async def get_maintenance_status_async(self, http, deviceid: str) -> Tuple[bool, str, str]:
+        """Come get_maintenance_status ma su un httpx.AsyncClient condiviso (connessioni keep-alive)."""
+        url = self.config_url.format(deviceid=deviceid)
         try:
-            prefix = "".join(parts[:5])
-            last_seg = parts[5]
-            if "_" in last_seg:
-                suffix = last_seg.split("_")[-1]
-                return f"{prefix}_{suffix}"
-        except Exception:
-            pass
-    return name
+            # Token scaduto (refresher in ritardo o fallito): la POST di auth gira fuori dall'event loop
+            token = self.tm.valid_token() or await asyncio.to_thread(self.tm.get_token)
+            r = await http.get(url, headers=self._headers(token))
+            if r.status_code in (401, 403):
+                # Rinnovo fuori dall'event loop: le altre coroutine continuano a girare
+                token = await asyncio.to_thread(self.tm.refresh, token)
+                r = await http.get(url, headers=self._headers(token))
+            r.raise_for_status()
+            return True, _parse_maintenance_mode(r.json()), ""
+        except httpx.HTTPStatusError as e:
+            return False, "ERR", f"HTTP {e.response.status_code}"
+        except httpx.TimeoutException:
+            return False, "ERR", "Timeout"
+        except httpx.TransportError:
+            return False, "ERR", "Conn fallita"
+        except Exception as e:
+            return False, "ERR", str(e)
+
+
+def _parse_maintenance_mode(data: dict) -> str:
+    mm = (data.get("application") or {}).get("maintenanceMode")
+    if mm == "ON": return "ON"
+    if mm == "OFF": return "OFF"
+    if mm is None: return "NULL"
+    return str(mm)
 
 
 _tm: Optional[TokenManager] = None
@@ -121,7 +249,7 @@ _client: Optional[MaintenanceApiClient] = None
 def get_token_manager() -> TokenManager:
     global _tm
     if _tm is None:
-        _tm = TokenManager()
+        _tm = TokenManager(_build_session(_max_threads()))
     return _tm
 
 
@@ -132,106 +260,520 @@ def get_client() -> MaintenanceApiClient:
     return _client
 
 
+# Errori per cui ha senso riprovare a fine giro (backend lento/sovraccarico, rete)
+_TRANSIENT_ERRORS = frozenset({"Timeout", "Conn fallita", "HTTP 429", "HTTP 500", "HTTP 502", "HTTP 503", "HTTP 504"})
+_RETRY_BACKOFF_S = 1.0
+
+
+class _AimdLimiter:
+    """Limite di concorrenza adattivo (AIMD) deciso a finestre di circa un RTT (latenza media,
+    minimo 0.1 s): se nella finestra la quota di errori transitori supera error_threshold o la
+    latenza media supera target_s il limite si dimezza (non sotto min_limit), altrimenti +1.
+    Errori sporadici sotto soglia non riducono la concorrenza."""
+
+    def __init__(self, max_limit: int, min_limit: int, target_s: float, error_threshold: float):
+        self.max_limit = max_limit
+        self.min_limit = max(1, min(min_limit, max_limit))
+        self.target_s = target_s
+        self.error_threshold = error_threshold
+        self.limit = max_limit
+        self._lock = threading.Lock()
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now: float):
+        self._start = now
+        self._n = 0
+        self._errors = 0
+        self._latency = 0.0
+
+    @property
+    def current(self) -> int:
+        return self.limit
+
+    def record(self, ok: bool, latency_s: float):
+        with self._lock:
+            self._n += 1
+            self._errors += not ok
+            self._latency += latency_s
+            now = time.monotonic()
+            avg = self._latency / self._n
+            if now - self._start < max(0.1, avg):
+                return
+            if self._errors / self._n > self.error_threshold or avg > self.target_s:
+                self.limit = max(self.min_limit, self.limit // 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1)
+            self._reset_window(now)
+
+
+class _TokenBucket:
+    """Rate limit in richieste/s (rate <= 0: illimitato). reserve() prenota uno slot e ritorna
+    i secondi da attendere, così lo stesso bucket serve sia i thread sia le coroutine."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._t) * self.rate)
+            self._t = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class _Progress:
+    """Contatore condiviso per progress_cb (il totale cresce quando si accodano retry) e buffer
+    dei risultati consegnati a batch_cb a blocchi di batch_size."""
+
+    def __init__(self, cb: Optional[Callable[[int, int], None]], total: int,
+                 batch_cb: Optional[Callable[[Dict[str, str]], None]] = None, batch_size: int = 100):
+        self.cb = cb
+        self.total = total
+        self.done = 0
+        self.batch_cb = batch_cb
+        self.batch_size = max(1, batch_size)
+        self._batch: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def extend(self, n: int):
+        with self._lock:
+            self.total += n
+
+    def step(self, did: str, status: str):
+        with self._lock:
+            self.done += 1
+            if self.cb:
+                try: self.cb(self.done, self.total)
+                except: pass
+            if self.batch_cb:
+                self._batch[did] = status
+                if len(self._batch) >= self.batch_size:
+                    self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._batch:
+            batch, self._batch = self._batch, {}
+            try: self.batch_cb(batch)
+            except: pass
+
+
+class _StopCondition:
+    """stop_flag combinato: flag utente e/o scadenza del budget di tempo. Espone is_set/wait
+    come threading.Event, così i worker non distinguono i due casi."""
+
+    def __init__(self, flag: Optional[threading.Event], budget_s: Optional[float]):
+        self.flag = flag
+        self.deadline = time.monotonic() + budget_s if budget_s else None
+
+    def is_set(self) -> bool:
+        if self.flag is not None and self.flag.is_set():
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def wait(self, timeout: float) -> bool:
+        end = time.monotonic() + timeout
+        while not self.is_set():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(0.2, remaining))
+        return True
+
+
 def fetch_maintenance_bulk(device_ids: List[str],
                             progress_cb: Optional[Callable[[int, int], None]] = None,
                             stop_flag: Optional[threading.Event] = None,
-                            max_threads: Optional[int] = None) -> Dict[str, str]:
+                            max_threads: Optional[int] = None,
+                            details: Optional[Dict[str, Tuple[int, str]]] = None,
+                            batch_cb: Optional[Callable[[Dict[str, str]], None]] = None,
+                            time_budget_s: Optional[float] = None) -> Dict[str, str]:
     """
     Recupera maintenance status per una lista di device.
     Ritorna {device_id: "ON"|"OFF"|"NULL"|"ERR"|"SKIP"}.
+    Con httpx installato usa un event loop asyncio e un client con connessioni keep-alive
+    (HTTP/2 se disponibile); MAINT_ASYNC=0 forza il vecchio pool di thread.
+    max_threads (default MAINT_MAX_THREADS) è il tetto di richieste concorrenti: il limite
+    effettivo si adatta a latenza ed errori (AIMD, minimo MAINT_MIN_THREADS, latenza target
+    MAINT_LATENCY_TARGET_S, soglia errori MAINT_ERROR_THRESHOLD) e MAINT_RATE limita le
+    richieste/s (0 = nessun limite).
+    I device in errore transitorio vengono riprovati a fine giro, fino a MAINT_RETRY_ROUNDS
+    volte con backoff esponenziale.
+    Se passato, details viene riempito con {device_id: (latency_ms, errore)} dell'ultimo tentativo.
+    batch_cb riceve i risultati man mano, a blocchi di MAINT_BATCH_SIZE device (default 100)
+    e comunque a fine di ogni giro: details è già valorizzato per i device del blocco.
+    I device sono interrogati nell'ordine ricevuto (vedi device_priorities). Con time_budget_s
+    il fetch si ferma alla scadenza come con stop_flag: i device non raggiunti restano SKIP.
     """
     client = get_client()
     if not client.tm.is_configured():
         return {did: "ERR" for did in device_ids}
 
-    if max_threads is None:
-        try: max_threads = int(os.getenv("MAINT_MAX_THREADS", "80"))
-        except: max_threads = 80
+    max_threads = max(1, max_threads or _max_threads())
+    limiter = _AimdLimiter(max_threads, _env_int("MAINT_MIN_THREADS", 4),
+                           _env_float("MAINT_LATENCY_TARGET_S", 5.0),
+                           _env_float("MAINT_ERROR_THRESHOLD", 0.1))
+    bucket = _TokenBucket(_env_float("MAINT_RATE", 0.0))
+    progress = _Progress(progress_cb, len(device_ids), batch_cb, _env_int("MAINT_BATCH_SIZE", 100))
+    stop = _StopCondition(stop_flag, time_budget_s)
+    use_async = httpx is not None and os.getenv("MAINT_ASYNC", "1") != "0"
+    if details is None:
+        details = {}
+    try:
+        client.tm.get_token()  # primo token prima di partire: nessun worker attende l'auth
+    except Exception:
+        pass  # errore riportato per device da get_maintenance_status
 
     results: Dict[str, str] = {}
-    total = len(device_ids)
-    done = 0
-    lock = threading.Lock()
+    pending = list(device_ids)
+    for rnd in range(_env_int("MAINT_RETRY_ROUNDS", 2) + 1):
+        if rnd:
+            if stop.wait(_RETRY_BACKOFF_S * 2 ** (rnd - 1)):
+                break
+            progress.extend(len(pending))
+        if use_async:
+            out, pending = asyncio.run(_fetch_bulk_async(client, pending, progress, stop, limiter, bucket, details))
+        else:
+            out, pending = _fetch_bulk_threaded(client, pending, progress, stop, limiter, bucket, details)
+        results.update(out)
+        progress.flush()
+        if not pending or stop.is_set():
+            break
+
+    for did in device_ids:
+        results.setdefault(did, "SKIP")
+    return results
+
+
+# Connessioni per client httpx: lo scheduler del pool httpcore scorre tutte le connessioni
+# per ogni richiesta in attesa (costo quadratico), quindi la concorrenza viene ripartita su
+# più client piccoli. Con HTTP/2 negoziato ogni client multiplexa su un solo socket.
+_ASYNC_POOL_SHARD = 8
+
+
+async def _fetch_bulk_async(client: MaintenanceApiClient, device_ids: List[str], progress: _Progress,
+                            stop_flag, limiter: _AimdLimiter, bucket: _TokenBucket,
+                            details: Dict[str, Tuple[int, str]]) -> Tuple[Dict[str, str], List[str]]:
+    """Un solo event loop: i worker prelevano i device in ordine da una coda condivisa e riusano
+    le connessioni keep-alive dei client httpx; al massimo limiter.current richieste in volo.
+    Se stop_flag viene settato le richieste in volo sono cancellate.
+    Ritorna (risultati, device in errore transitorio da riprovare)."""
+    results: Dict[str, str] = {}
+    retry: List[str] = []
+    queue = deque(device_ids)
+    concurrency = limiter.max_limit
+    shard = min(concurrency, _ASYNC_POOL_SHARD)
+    limits = httpx.Limits(max_connections=shard, max_keepalive_connections=shard)
+    pools = [httpx.AsyncClient(http2=HAS_HTTP2, verify=False, timeout=20, limits=limits)
+             for _ in range(-(-concurrency // shard))]
+    gate = asyncio.Condition()
+    inflight = 0
+
+    async def worker(http):
+        nonlocal inflight
+        while queue:
+            if stop_flag is not None and stop_flag.is_set():
+                return
+            async with gate:
+                await gate.wait_for(lambda: inflight < limiter.current)
+                inflight += 1
+            try:
+                if not queue:
+                    return
+                did = queue.popleft()
+                wait = bucket.reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+                t0 = time.monotonic()
+                _, status, err = await client.get_maintenance_status_async(http, device_name_to_clientid(did))
+                latency = time.monotonic() - t0
+                transient = err in _TRANSIENT_ERRORS
+                limiter.record(not transient, latency)
+                results[did] = status
+                details[did] = (int(latency * 1000), err)
+                if transient:
+                    retry.append(did)
+                progress.step(did, status)
+            finally:
+                async with gate:
+                    inflight -= 1
+                    gate.notify_all()
+
+    workers = [asyncio.ensure_future(worker(pools[i % len(pools)])) for i in range(min(concurrency, len(device_ids)))]
+
+    async def watch_stop():
+        while not stop_flag.is_set():
+            await asyncio.sleep(0.2)
+        for w in workers:
+            w.cancel()
+
+    watcher = asyncio.ensure_future(watch_stop()) if stop_flag is not None else None
+    try:
+        await asyncio.gather(*workers, return_exceptions=True)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        for http in pools:
+            await http.aclose()
+    return results, retry
+
+
+def _fetch_bulk_threaded(client: MaintenanceApiClient, device_ids: List[str], progress: _Progress,
+                         stop_flag, limiter: _AimdLimiter, bucket: _TokenBucket,
+                         details: Dict[str, Tuple[int, str]]) -> Tuple[Dict[str, str], List[str]]:
+    results: Dict[str, str] = {}
+    retry: List[str] = []
+    gate = threading.Condition()
+    inflight = 0
 
     def worker(did: str) -> Tuple[str, str]:
+        nonlocal inflight
         if stop_flag is not None and stop_flag.is_set():
-            return did, "SKIP"
-        clientid = device_name_to_clientid(did)
-        _, status, _ = client.get_maintenance_status(clientid)
-        return did, status
-
-    with ThreadPoolExecutor(max_workers=max_threads) as ex:
+            return "SKIP", ""
+        with gate:
+            gate.wait_for(lambda: inflight < limiter.current)
+            inflight += 1
+        try:
+            wait = bucket.reserve()
+            if wait:
+                time.sleep(wait)
+            t0 = time.monotonic()
+            _, status, err = client.get_maintenance_status(device_name_to_clientid(did))
+            latency = time.monotonic() - t0
+            limiter.record(err not in _TRANSIENT_ERRORS, latency)
+            details[did] = (int(latency * 1000), err)
+            return status, err
+        finally:
+            with gate:
+                inflight -= 1
+                gate.notify_all()
+
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as ex:
         futs = {ex.submit(worker, did): did for did in device_ids}
         for f in as_completed(futs):
             did = futs[f]
             try:
-                _, status = f.result()
+                status, err = f.result()
             except Exception:
-                status = "ERR"
+                status, err = "ERR", ""
+            if status == "SKIP":
+                continue
             results[did] = status
-            with lock:
-                done += 1
-                if progress_cb:
-                    try: progress_cb(done, total)
-                    except: pass
+            if err in _TRANSIENT_ERRORS:
+                retry.append(did)
+            progress.step(did, status)
             if stop_flag is not None and stop_flag.is_set():
                 break
+    return results, retry
 
-    for did in device_ids:
-        results.setdefault(did, "SKIP")
-    return results
 
+# === Persistenza cache su DB (maintenance_status + maintenance_history) ===
 
-# === Persistenza cache su disco ===
+_tables_ready = False
 
-def _cache_path() -> Path:
-    p = Path(__file__).parent / "data" / "maintenance_cache.json"
-    p.parent.mkdir(parents=True, exist_ok=True)
-    return p
 
+def _ensure_tables():
+    """Crea le tabelle maintenance se mancano e importa una sola volta la vecchia cache JSON."""
+    global _tables_ready
+    if _tables_ready:
+        return
+    MaintenanceStatus.__table__.create(engine, checkfirst=True)
+    MaintenanceHistory.__table__.create(engine, checkfirst=True)
+    _tables_ready = True
+    _migrate_json_cache()
 
-def load_cache() -> Dict[str, str]:
-    """Carica cache {device_id: status} da disco. Ritorna {} se assente o corrotta."""
-    fp = _cache_path()
+
+def _migrate_json_cache():
+    """Importa data/maintenance_cache.json (formato piatto o con fetched_at per device) se la
+    tabella è vuota, poi rinomina il file in .json.migrated."""
+    fp = DB_PATH.parent / "maintenance_cache.json"
     if not fp.exists():
-        return {}
+        return
     try:
         with open(fp, "r", encoding="utf-8") as f:
             data = json.load(f)
-        if isinstance(data, dict):
-            payload = data.get("devices") if "devices" in data else data
-            return {k: str(v) for k, v in payload.items() if isinstance(k, str)}
     except Exception:
-        pass
-    return {}
+        return
+    if not isinstance(data, dict):
+        return
+    payload = data.get("devices") if "devices" in data else data
+    legacy_ts = _parse_ts(data.get("updated_at")) or datetime.now()
+    rows = []
+    for k, v in (payload or {}).items():
+        if not isinstance(k, str) or k == "updated_at":
+            continue
+        if isinstance(v, dict):
+            status, ts = str(v.get("status", "")), _parse_ts(v.get("fetched_at")) or legacy_ts
+        else:
+            status, ts = str(v), legacy_ts
+        if status and status != "SKIP":
+            rows.append({"device_id": k, "status": status, "fetched_at": ts, "latency_ms": None, "error": None})
+    session = get_session()
+    try:
+        if session.query(MaintenanceStatus.device_id).first() is None and rows:
+            session.execute(sqlite_insert(MaintenanceStatus).on_conflict_do_nothing(), rows)
+            session.commit()
+        fp.replace(fp.with_suffix(".json.migrated"))
+    except Exception:
+        session.rollback()
+    finally:
+        session.close()
 
 
-def save_cache(cache: Dict[str, str]) -> bool:
-    """Salva cache {device_id: status} su disco con timestamp."""
+def _parse_ts(value) -> Optional[datetime]:
+    try: return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError): return None
+
+
+def load_cache_entries() -> Dict[str, dict]:
+    """Carica {device_id: {"status": str, "fetched_at": datetime}} da maintenance_status."""
+    _ensure_tables()
+    session = get_session()
     try:
-        fp = _cache_path()
-        payload = {
-            "updated_at": datetime.now().isoformat(timespec="seconds"),
-            "count": len(cache),
-            "devices": cache,
-        }
-        tmp = fp.with_suffix(".json.tmp")
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-        tmp.replace(fp)
+        rows = session.execute(select(MaintenanceStatus.device_id, MaintenanceStatus.status,
+                                      MaintenanceStatus.fetched_at)).all()
+        return {did: {"status": st, "fetched_at": ts} for did, st, ts in rows}
+    finally:
+        session.close()
+
+
+def load_cache() -> Dict[str, str]:
+    """Carica cache {device_id: status}. Ritorna {} se vuota."""
+    return {k: e["status"] for k, e in load_cache_entries().items()}
+
+
+def save_cache(cache: Dict[str, str], details: Optional[Dict[str, Tuple[int, str]]] = None) -> bool:
+    """Upsert degli stati passati con fetched_at=ora (gli SKIP non vengono salvati); le altre
+    righe restano invariate. details {device_id: (latency_ms, errore)} da fetch_maintenance_bulk.
+    Ogni cambio di stato rispetto all'ultimo in storico (ERR esclusi) è aggiunto a maintenance_history."""
+    _ensure_tables()
+    details = details or {}
+    now = datetime.now().replace(microsecond=0)
+    rows = []
+    for did, status in cache.items():
+        if status == "SKIP":
+            continue
+        latency_ms, err = details.get(did, (None, ""))
+        rows.append({"device_id": did, "status": status, "fetched_at": now,
+                     "latency_ms": latency_ms, "error": err or None})
+    if not rows:
+        return True
+    session = get_session()
+    try:
+        stmt = sqlite_insert(MaintenanceStatus)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MaintenanceStatus.device_id],
+            set_={c: stmt.excluded[c] for c in ("status", "fetched_at", "latency_ms", "error")},
+        )
+        session.execute(stmt, rows)
+
+        # Ultimo stato in storico per i device del batch (max id = ultima riga appesa)
+        ids = [r["device_id"] for r in rows if r["status"] != "ERR"]
+        last = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            latest = (select(func.max(MaintenanceHistory.id))
+                      .where(MaintenanceHistory.device_id.in_(chunk))
+                      .group_by(MaintenanceHistory.device_id))
+            last.update(session.execute(
+                select(MaintenanceHistory.device_id, MaintenanceHistory.status)
+                .where(MaintenanceHistory.id.in_(latest))).all())
+        changes = [{"device_id": r["device_id"], "status": r["status"], "fetched_at": now,
+                    "latency_ms": r["latency_ms"]}
+                   for r in rows if r["status"] != "ERR" and last.get(r["device_id"]) != r["status"]]
+        if changes:
+            session.execute(insert(MaintenanceHistory), changes)
+        session.commit()
         return True
     except Exception:
+        session.rollback()
         return False
+    finally:
+        session.close()
+
+
+# TTL per stato: ERR si riprova dopo pochi minuti, ON (manutenzione attiva, può chiudersi
+# a breve) si ricontrolla più spesso di OFF. Default di ripiego MAINT_TTL_HOURS.
+def _status_ttl(status: str) -> timedelta:
+    default_h = _env_float("MAINT_TTL_HOURS", 8.0)
+    if status == "ERR":
+        return timedelta(minutes=_env_float("MAINT_TTL_ERR_MINUTES", 15.0))
+    if status == "ON":
+        return timedelta(hours=_env_float("MAINT_TTL_ON_HOURS", 2.0))
+    if status == "OFF":
+        return timedelta(hours=_env_float("MAINT_TTL_OFF_HOURS", 12.0))
+    return timedelta(hours=default_h)
+
+
+def device_priorities() -> Dict[str, int]:
+    """Priorità di polling per device (0 = prima): 0 con alert CRITICAL/HIGH non acknowledged,
+    1 KO, 2 tutti gli altri. Una sola query; il dict è già in ordine di priorità."""
+    alerted = (select(AnomalyEvent.device_id)
+               .where(AnomalyEvent.acknowledged == False, AnomalyEvent.severity.in_(("CRITICAL", "HIGH"))))
+    tier = case((Device.device_id.in_(alerted), 0), (Device.current_health == "KO", 1), else_=2)
+    session = get_session()
+    try:
+        rows = session.execute(select(Device.device_id, tier).order_by(tier, Device.device_id)).all()
+        return {did: t for did, t in rows}
+    finally:
+        session.close()
+
+
+def stale_devices(device_ids: List[str], entries: Optional[Dict[str, dict]] = None,
+                  now: Optional[datetime] = None, priority: Optional[Dict[str, int]] = None) -> List[str]:
+    """Device da ricontrollare, in ordine di priorità (vedi device_priorities) e, a parità,
+    prima i mai interrogati poi per scadenza TTL più vecchia."""
+    if entries is None:
+        entries = load_cache_entries()
+    now = now or datetime.now()
+    priority = priority or {}
+    due = []
+    for did in device_ids:
+        e = entries.get(did)
+        if e is None or e["fetched_at"] is None:
+            due.append((priority.get(did, 2), 0, datetime.min, did))
+            continue
+        expires = e["fetched_at"] + _status_ttl(e["status"])
+        if expires <= now:
+            due.append((priority.get(did, 2), 1, expires, did))
+    due.sort()
+    return [did for *_, did in due]
 
 
 def cache_last_updated() -> Optional[str]:
     """Ritorna timestamp ISO dell'ultimo aggiornamento cache, o None."""
-    fp = _cache_path()
-    if not fp.exists():
-        return None
+    _ensure_tables()
+    session = get_session()
     try:
-        with open(fp, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data.get("updated_at") if isinstance(data, dict) else None
-    except Exception:
-        return None
+        ts = session.execute(select(func.max(MaintenanceStatus.fetched_at))).scalar()
+        return ts.isoformat(timespec="seconds") if ts else None
+    finally:
+        session.close()
+
+
+def get_flapping_devices(days: int = 7, min_changes: int = 3) -> List[Tuple[str, int]]:
+    """Device con almeno min_changes righe di storico (cambi di maintenanceMode, inclusa la prima
+    osservazione) negli ultimi `days` giorni, ordinati per numero di cambi decrescente."""
+    _ensure_tables()
+    since = datetime.now() - timedelta(days=days)
+    session = get_session()
+    try:
+        n = func.count(MaintenanceHistory.id)
+        q = (select(MaintenanceHistory.device_id, n)
+             .where(MaintenanceHistory.fetched_at >= since)
+             .group_by(MaintenanceHistory.device_id)
+             .having(n >= min_changes)
+             .order_by(n.desc()))
+        return [(did, cnt) for did, cnt in session.execute(q).all()]
+    finally:
+        session.close()
@@ -0,0 +1,205 @@
+"""
+DIGIL Monitoring - Query di lettura per la dashboard
+Query SQL usate dalla GUI: caricano i record tenuti in memoria dal read model (read_model.py),
+selezionando solo le colonne mostrate, e lasciano a SQLite le aggregazioni.
+"""
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select, func, case, cast, Integer
+from sqlalchemy.orm import selectinload
+
+from database import Device, AvailabilityDaily, AnomalyEvent, MaintenanceStatus
+from jira_client import JiraTicket, VENDOR_VALIDI
+from importer import AV_STATUS_NUMERIC
+
+
+# Colonne dei record device tenuti in memoria (read_model): quelle mostrate da Alert, Dispositivi e Delta
+DEVICE_COLUMNS = ("device_id", "client_id", "linea", "fornitore", "dt", "sistema_digil", "current_health",
+                  "check_mongo", "batteria", "porta_aperta", "is_sotto_corona", "trend_7d", "days_in_current",
+                  "data_onesait", "misure_mancanti", "tipo_malfunzionamento", "ticket_id", "ticket_stato",
+                  "ticket_data_apertura", "ticket_data_risoluzione", "ticket_data_apertura_l4")
+
+
+def device_records(session):
+    """Un record per device {colonna: valore} con le DEVICE_COLUMNS più lo stato maintenance
+    in cache ("maint"), in ordine di inserimento. Ritorna {device_id: record}."""
+    stmt = (select(*(getattr(Device, c) for c in DEVICE_COLUMNS), MaintenanceStatus.status.label("maint"))
+            .outerjoin(MaintenanceStatus, MaintenanceStatus.device_id == Device.device_id))
+    return {r.device_id: dict(r._mapping) for r in session.execute(stmt)}
+
+
+def latest_alerts(session, severity=None, event_type=None):
+    """Alert non acknowledged, uno per device: il più recente (created_at, poi id) tra quelli che
+    rispettano i filtri su severity/tipo. Ritorna tuple (device_id, severity, event_type,
+    description) ordinate dall'alert più recente.
+    La deduplicazione è fatta in SQL con ROW_NUMBER() OVER (PARTITION BY device_id ...): la
+    partizione per device è servita dall'indice (acknowledged, device_id, created_at)."""
+    rn = func.row_number().over(partition_by=AnomalyEvent.device_id,
+                                order_by=(AnomalyEvent.created_at.desc(), AnomalyEvent.id))
+    ranked = select(AnomalyEvent.id.label("event_id"), rn.label("rn")).where(AnomalyEvent.acknowledged == False)
+    if severity: ranked = ranked.where(AnomalyEvent.severity == severity)
+    if event_type: ranked = ranked.where(AnomalyEvent.event_type == event_type)
+    ranked = ranked.subquery()
+    stmt = (select(AnomalyEvent.device_id, AnomalyEvent.severity, AnomalyEvent.event_type, AnomalyEvent.description)
+            .join(ranked, (ranked.c.event_id == AnomalyEvent.id) & (ranked.c.rn == 1))
+            .order_by(AnomalyEvent.created_at.desc(), AnomalyEvent.id))
+    return [tuple(r) for r in session.execute(stmt)]
+
+
+def alert_summary(session):
+    """Contatori delle card alert: (alert CRITICAL aperti, alert HIGH aperti, tipi di alert)."""
+    sev = dict(session.execute(select(AnomalyEvent.severity, func.count())
+                               .where(AnomalyEvent.acknowledged == False, AnomalyEvent.severity.in_(("CRITICAL", "HIGH")))
+                               .group_by(AnomalyEvent.severity)).all())
+    types = sorted(t for t in session.execute(select(AnomalyEvent.event_type).distinct()).scalars() if t)
+    return sev.get("CRITICAL", 0), sev.get("HIGH", 0), types
+
+
+# ============================================================
+# DETTAGLIO DEVICE (DeviceDetailDialog)
+# ============================================================
+_DEVICE_ATTRS = tuple(c.key for c in Device.__table__.columns)
+
+
+class DeviceSnapshot:
+    """Dettaglio di un device staccato dalla sessione: le colonne di Device come attributi, più
+    ticket_history (dal più recente), availability [(data, stato)] in ordine di data e gli
+    ultimi 10 alert (events)."""
+    __slots__ = _DEVICE_ATTRS + ("ticket_history", "availability", "events")
+
+
+def device_detail(session, device_id):
+    """Carica device, storico ticket, availability e alert con un solo execute (selectinload:
+    una SELECT per collezione, senza le righe duplicate di una JOIN) e li copia in un
+    DeviceSnapshot. None se il device non esiste."""
+    stmt = (select(Device).where(Device.device_id == device_id)
+            .options(selectinload(Device.ticket_history), selectinload(Device.events),
+                     selectinload(Device.availability).load_only(AvailabilityDaily.check_date, AvailabilityDaily.raw_status)))
+    dev = session.execute(stmt).scalar_one_or_none()
+    if dev is None:
+        return None
+    snap = DeviceSnapshot()
+    for attr in _DEVICE_ATTRS:
+        setattr(snap, attr, getattr(dev, attr))
+    snap.ticket_history = list(dev.ticket_history)
+    snap.availability = sorted((a.check_date, a.raw_status) for a in dev.availability)
+    snap.events = sorted(dev.events, key=lambda e: e.created_at or datetime.min, reverse=True)[:10]
+    return snap
+
+
+# ============================================================
+# HEATMAP AVAILABILITY DI FLOTTA
+# ============================================================
+# raw_status -> codice 1-4 di AV_STATUS_NUMERIC (nomenclatura nuova, vecchia e CODE_n); 0 = nessun dato
+AV_CODES = {name: code for code, name in AV_STATUS_NUMERIC.items()}
+AV_CODES.update({"COMPLETE": 1, "AVAILABLE": 2, "NOT AVAILABLE": 3})
+AV_CODES.update({f"CODE_{code}": code for code in AV_STATUS_NUMERIC})
+
+
+def availability_matrix(session):
+    """Availability di tutti i device come matrice uint8 device × giorno (codici AV_CODES, 0 se
+    il giorno manca). Il codice e l'indice del giorno sono calcolati in SQL; la matrice è
+    riempita con un'unica assegnazione numpy. Ritorna (device_ids, primo giorno, matrice):
+    le righe seguono l'ordine dei device nella tabella devices, primo giorno None se vuota."""
+    ids = list(session.execute(select(Device.device_id)).scalars())
+    first, last = session.execute(select(func.min(AvailabilityDaily.check_date), func.max(AvailabilityDaily.check_date))).one()
+    if first is None:
+        return ids, None, np.zeros((len(ids), 0), dtype=np.uint8)
+    day = cast(func.julianday(AvailabilityDaily.check_date) - func.julianday(first.isoformat()), Integer)
+    code = case(AV_CODES, value=AvailabilityDaily.raw_status, else_=0)
+    rows = session.execute(select(AvailabilityDaily.device_id, day, code)).all()
+    index = {did: i for i, did in enumerate(ids)}
+    matrix = np.zeros((len(ids), (last - first).days + 1), dtype=np.uint8)
+    if rows:
+        dids, days, codes = zip(*rows)
+        r = np.fromiter((index.get(d, -1) for d in dids), dtype=np.int32, count=len(rows))
+        ok = r >= 0
+        matrix[r[ok], np.asarray(days, dtype=np.int32)[ok]] = np.asarray(codes, dtype=np.uint8)[ok]
+    return ids, first, matrix
+
+
+# ============================================================
+# OVERVIEW (tab Overview ed export Excel)
+# ============================================================
+OVERVIEW_FORNITORI = ["INDRA", "MII", "SIRTI"]
+
+
+def _count_if(cond):
+    return func.sum(case((cond, 1), else_=0))
+
+
+def _pct(part, total):
+    return round(part / total * 100, 1) if total else 0
+
+
+def overview_tables(session):
+    """Tabelle della tab Overview, calcolate con una GROUP BY ciascuna (somme condizionali).
+    Ritorna {"fornitore": [...], "dt": [...], "correlazione": [...]}: liste di dict con le stesse
+    chiavi delle colonne mostrate/esportate, condivise da refresh_overview ed export_overview."""
+    forn = {f: None for f in OVERVIEW_FORNITORI}
+    stmt = (select(Device.fornitore, func.count(),
+                   _count_if(Device.current_health == "OK"), _count_if(Device.current_health == "KO"),
+                   _count_if(Device.current_health == "DEGRADED"), _count_if(Device.ticket_stato == "Aperto"),
+                   _count_if(Device.is_sotto_corona == True), _count_if(Device.check_mongo == "KO"),
+                   _count_if(Device.porta_aperta == "KO"), _count_if(Device.batteria == "KO"))
+            .where(Device.fornitore.in_(OVERVIEW_FORNITORI)).group_by(Device.fornitore))
+    for row in session.execute(stmt):
+        forn[row[0]] = row[1:]
+    by_forn, corr = [], []
+    for f in OVERVIEW_FORNITORI:
+        total, ok, ko, deg, tix, sc, mongo_ko, porta_ko, batt_ko = forn[f] or (0,) * 9
+        by_forn.append({"Fornitore": f, "Totale": total, "OK": ok, "KO": ko, "Degraded": deg,
+                        "% OK": _pct(ok, total), "Ticket Aperti": tix, "Sotto Corona": sc})
+        corr.append({"Fornitore": f, "Totale": total, "Mongo KO": mongo_ko, "Porta KO": porta_ko, "Batt KO": batt_ko})
+    # DT con più device per primi; a parità, ordine alfabetico
+    total = func.count()
+    stmt = (select(Device.dt, total, _count_if(Device.current_health == "OK"))
+            .where(Device.dt != None, Device.dt != "").group_by(Device.dt).order_by(total.desc(), Device.dt))
+    by_dt = [{"DT": dt, "Totale": t, "OK": ok, "KO": t - ok, "% OK": _pct(ok, t)} for dt, t, ok in session.execute(stmt)]
+    return {"fornitore": by_forn, "dt": by_dt, "correlazione": corr}
+
+
+# ============================================================
+# DELTA TICKET (Excel vs Jira)
+# ============================================================
+def _day(dt):
+    return dt.strftime("%Y-%m-%d") if dt else ""
+
+
+def delta_rows(session):
+    """Righe della tab Delta: device con ticket in Excel, in LEFT JOIN con jira_tickets su
+    ticket_id = key (solo i ticket mostrati nella tab Ticket: 'Bug in esercizio' dei fornitori
+    validi), con le sole colonne confrontate. I flag di discrepanza Excel/Jira (_tipo_mismatch,
+    _data_mismatch) sono calcolati qui, nello stesso passaggio che formatta le righe."""
+    jira = (JiraTicket.key == Device.ticket_id) & JiraTicket.fornitore.in_(VENDOR_VALIDI) \
+        & (JiraTicket.issue_type == "Bug in esercizio")
+    stmt = (select(Device.device_id, Device.ticket_id, Device.tipo_malfunzionamento, Device.ticket_stato,
+                   Device.ticket_data_apertura, Device.ticket_data_risoluzione, Device.ticket_data_apertura_l4,
+                   JiraTicket.info_l1, JiraTicket.status, JiraTicket.assignee_level, JiraTicket.created, JiraTicket.updated)
+            .outerjoin(JiraTicket, jira)
+            .where(Device.ticket_id != None, Device.ticket_id != ""))
+    rows = []
+    for r in session.execute(stmt):
+        status = r.status or ""
+        tipo_excel = r.tipo_malfunzionamento or "-"; tipo_jira = r.info_l1 or "-"
+        ap_excel = str(r.ticket_data_apertura) if r.ticket_data_apertura else "-"; ap_jira = _day(r.created) or "-"
+        rows.append({
+            "DeviceID": r.device_id,
+            "_full_did": r.device_id,
+            "Ticket": r.ticket_id,
+            "Tipo Malf. (Excel)": tipo_excel,
+            "Tipo Malf. (Jira)": tipo_jira,
+            "Stato (Excel)": r.ticket_stato or "-",
+            "Stato (Jira)": status or "-",
+            "Livello (Jira)": r.assignee_level or "-",
+            "Data Apertura (Excel)": ap_excel,
+            "Data Risoluzione (Excel)": str(r.ticket_data_risoluzione) if r.ticket_data_risoluzione else "-",
+            "Data Apertura L4 (Excel)": str(r.ticket_data_apertura_l4) if r.ticket_data_apertura_l4 else "-",
+            "Data Apertura (Jira)": ap_jira,
+            "Chiusura (Jira)": (_day(r.updated) if status in ("Chiusa", "Discarded") else "") or "-",
+            "Aggiornato (Jira)": _day(r.updated) or "-",
+            "_tipo_mismatch": "-" not in (tipo_excel, tipo_jira) and tipo_excel.strip().lower() != tipo_jira.strip().lower(),
+            "_data_mismatch": "-" not in (ap_excel, ap_jira) and ap_excel != ap_jira,
+        })
+    return rows
@@ -0,0 +1,155 @@
+"""
+DIGIL Monitoring - Read model in memoria per le tab della dashboard
+====================================================================
+Record compatti di device, alert aperti e ticket Jira, caricati una volta dal DB e condivisi da
+tutte le tab (Alert, Dispositivi, Overview, Ticket, Delta): cambiare tab o filtro non fa I/O.
+
+Ogni voce dipende da una o più sorgenti ("devices", "events", "tickets", "maint") e resta valida
+finché una scrittura su quelle sorgenti non la invalida:
+  - import Excel + detection  -> invalidate()              (tutto)
+  - sync/import Jira          -> invalidate("tickets")
+  - batch maintenance         -> patch_maint(risultati)    (aggiornamento in place, niente reload)
+Thread-safe: le voci sono lette dai worker del pool query della GUI.
+"""
+import threading
+from collections import Counter
+
+from database import get_session
+from queries import device_records, latest_alerts, alert_summary, overview_tables, delta_rows, device_detail, availability_matrix
+from jira_client import get_ticket_data, get_filter_options, get_jira_stats, get_ticket_overview_by_fornitore
+
+SOURCES = ("devices", "events", "tickets", "maint")
+
+
+class ReadModel:
+    DETAIL_MAX = 64     # snapshot DeviceDetailDialog tenuti in cache (i più recenti)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}                      # {nome: (valore, sorgenti)}
+        self._gen = {s: 0 for s in SOURCES}     # incrementato a ogni invalidazione della sorgente
+
+    def _get(self, name, deps, loader):
+        """Valore in cache di `name`, caricato con loader() al primo accesso. Il caricamento avviene
+        fuori dal lock: se nel frattempo una sorgente viene invalidata, il valore è restituito ma
+        non messo in cache."""
+        with self._lock:
+            if name in self._entries:
+                return self._entries[name][0]
+            gen = [self._gen[s] for s in deps]
+        value = loader()
+        with self._lock:
+            if [self._gen[s] for s in deps] == gen:
+                self._entries.setdefault(name, (value, deps))
+        return value
+
+    def _load_session(self, fn):
+        session = get_session()
+        try:
+            return fn(session)
+        finally:
+            session.close()
+
+    def invalidate(self, *sources):
+        """Scarta le voci che dipendono da `sources` (tutte se non indicate)."""
+        sources = set(sources or SOURCES)
+        with self._lock:
+            for s in sources:
+                self._gen[s] += 1
+            self._entries = {k: v for k, v in self._entries.items() if not sources.intersection(v[1])}
+
+    def patch_maint(self, statuses):
+        """Aggiorna lo stato maintenance dei record device già caricati ({device_id: status}).
+        Se i device non sono in cache un caricamento può essere in corso con gli stati precedenti
+        al batch: la sorgente "maint" viene invalidata così che quel risultato non finisca in cache."""
+        with self._lock:
+            entry = self._entries.get("devices")
+            if entry is None:
+                self._gen["maint"] += 1
+                return
+            for did, st in statuses.items():
+                rec = entry[0].get(did)
+                if rec is not None:
+                    rec["maint"] = st
+
+    # ── Device e alert ─────────────────────────────────────────────
+    def devices(self):
+        """{device_id: record} (vedi queries.DEVICE_COLUMNS), più "maint"."""
+        return self._get("devices", ("devices", "maint"), lambda: self._load_session(device_records))
+
+    def latest_alerts(self, severity=None, event_type=None, fornitore=None, no_ticket=False):
+        """Un alert per device, il più recente tra quelli che rispettano i filtri su severity/tipo
+        (queries.latest_alerts, in cache per coppia di filtri), con il record del device.
+        Fornitore e "solo senza ticket" sono filtrati in memoria. Ritorna [(alert, device)] dall'alert più recente."""
+        alerts = self._get(("alerts", severity, event_type), ("events",),
+                           lambda: self._load_session(lambda session: latest_alerts(session, severity, event_type)))
+        devs = self.devices(); out = []
+        for a in alerts:
+            d = devs.get(a[0])
+            if d is None or (fornitore and d["fornitore"] != fornitore) or (no_ticket and d["ticket_id"]):
+                continue
+            out.append((a, d))
+        return out
+
+    def device_detail(self, device_id):
+        """Snapshot del dettaglio device (queries.device_detail), None se il device non esiste.
+        Restano in cache gli ultimi DETAIL_MAX aperti: riaprire un device durante il triage
+        non interroga il DB."""
+        snap = self._get(("detail", device_id), ("devices", "events"),
+                         lambda: self._load_session(lambda session: device_detail(session, device_id)))
+        with self._lock:
+            details = [k for k in self._entries if isinstance(k, tuple) and k[0] == "detail"]
+            for k in details[:-self.DETAIL_MAX]:
+                del self._entries[k]
+        return snap
+
+    def availability_matrix(self):
+        """(device_ids, primo giorno, matrice uint8 device × giorno) per la heatmap di flotta."""
+        return self._get("availability", ("devices",), lambda: self._load_session(availability_matrix))
+
+    def summary(self):
+        """Contatori delle card: (totale device, {health: n}, alert CRITICAL, alert HIGH, tipi alert)."""
+        def load():
+            devs = self.devices(); crit, high, types = self._load_session(alert_summary)
+            return len(devs), Counter(d["current_health"] for d in devs.values()), crit, high, types
+        return self._get("summary", ("devices", "events"), load)
+
+    def overview(self):
+        """Tabelle della tab Overview (queries.overview_tables)."""
+        return self._get("overview", ("devices",), lambda: self._load_session(overview_tables))
+
+    def delta(self):
+        """Righe della tab Delta Excel vs Jira (queries.delta_rows)."""
+        return self._get("delta", ("devices", "tickets"), lambda: self._load_session(delta_rows))
+
+    # ── Ticket Jira ────────────────────────────────────────────────
+    def tickets(self, filters=None):
+        """Ticket di get_ticket_data(), filtrati in memoria con la stessa semantica dei filtri SQL.
+        In cache ci sono solo i campi del DB: timing_hours/timing_color sono None e vanno calcolati
+        con compute_timing_hours al momento della visualizzazione."""
+        data = self._get("tickets", ("tickets",), lambda: get_ticket_data(timing=False))
+        if not filters:
+            return data
+        eq = [(k, filters[k]) for k in ("status", "reporter", "assignee", "resolution", "priority") if filters.get(k)]
+        lo = filters.get("created_from"); hi = filters.get("created_to")
+        return [t for t in data
+                if all(t[k] == v for k, v in eq)
+                and (lo is None or (t["created"] is not None and t["created"] >= lo))
+                and (hi is None or (t["created"] is not None and t["created"] <= hi))]
+
+    def ticket(self, key):
+        """Ticket per chiave Jira, None se assente."""
+        index = self._get("ticket_index", ("tickets",), lambda: {t["key"]: t for t in self.tickets()})
+        return index.get(key)
+
+    def ticket_filter_options(self):
+        return self._get("ticket_filters", ("tickets",), get_filter_options)
+
+    def jira_stats(self):
+        return self._get("jira_stats", ("tickets",), get_jira_stats)
+
+    def jira_overview(self):
+        return self._get("jira_overview", ("tickets",), get_ticket_overview_by_fornitore)
+
+
+read_model = ReadModel()